@@ -7,3 +7,14 @@ __version__ = '0.1.0'
 
 
 from .adamalib import Adama
+from .transport import Transport
+from .cache import (MemoryBackend, PersistentCache, ResponseCache,
+                    SQLiteBackend, StateDirectory, TTLCache)
+from .instrumentation import Instrumentation, RequestStats
+from .table import Table
+from .catalog import Catalog
+
+__all__ = ['Adama', 'Catalog', 'Instrumentation', 'MemoryBackend',
+           'PersistentCache', 'RequestStats', 'ResponseCache',
+           'SQLiteBackend', 'StateDirectory', 'TTLCache', 'Table',
+           'Transport']
@@ -1,20 +1,44 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import codecs
+import copy
+import itertools
+import json
 import os
+import random
 import subprocess
-from contextlib import contextmanager
-import tarfile
-import tempfile
 import textwrap
+import threading
 import time
-import json
 
-import requests
-import yaml
-from prov.model import ProvDocument
+import six
+
+from .cache import (DEFAULT_STATE_RESPONSE_TTL, PersistentCache,
+                    ResponseCache, StateDirectory, TTLCache)
+from .catalog import Catalog
+from .compression import wire_bytes
+from .decoding import ENVELOPE, default_decoder
+from .discovery import find_metadata_file, load_metadata, repository_root
+from .download import download
+from .instrumentation import RequestEvent, route_template, timer
+from .packaging import ArchiveStream, multipart_upload, pack
+from .parallel import SingleFlight, bounded_map
+from .stream import ResultParser
+from .table import Table
+from .transport import Transport
 
 
 REGISTER_TIMEOUT = 30  # seconds
+STREAM_CHUNK_SIZE = 64 * 1024  # bytes
+PAGE_SIZE = 1000  # records
+PROV_CACHE_SIZE = 256  # documents
+PROV_FORMATS = {
+    'json': lambda content, decoder: decoder.loads(content),
+    'sources': lambda content, decoder: decoder.loads(content),
+    'prov-n': lambda content, decoder: content.decode('utf-8'),
+    'prov': lambda content, decoder: prov_document(decoder.loads(content)),
+    'png': lambda content, decoder: content,
+}
 
 
 class APIException(Exception):
@@ -24,20 +48,97 @@ class APIException(Exception):
         self.obj = obj
 
 
+class MapError(APIException):
+    """Failure of a single call inside ``Endpoint.map``."""
+
+    def __init__(self, kwargs, exc):
+        super(MapError, self).__init__(str(exc), exc)
+        self.kwargs = kwargs
+
+
 # noinspection PyMethodMayBeStatic
 class Adama(object):
+    """Client of an Adama server.
+
+    A client can be shared by all the threads of a process: the transport,
+    caches and request coalescing are thread-safe, and navigation objects
+    (``adama.ns``, ``ns.srv``, ``srv['0.2']``) load their metadata once,
+    under a lock, and do not change afterwards. ``delete()`` is the
+    exception: it must not run concurrently with other uses of the object
+    it deletes.
+    """
+
+    def __init__(self, url, token=None, verify=True, transport=None,
+                 metadata_cache=None, response_cache=None, prov_cache=None,
+                 instrumentation=None, decoder=None, coalesce=True,
+                 state_dir=None):
+        """Create a client.
+
+        With ``state_dir``, metadata, query results and provenance
+        documents are also kept in that directory, unless the matching
+        cache is given, so that later processes start with warm caches.
+        Query results without ``ETag`` or ``Last-Modified`` are then served
+        for ``DEFAULT_STATE_RESPONSE_TTL`` seconds; pass a ``response_cache``
+        to choose another lifetime.
 
-    def __init__(self, url, token=None, verify=True):
-        """
         :type url: str
         :type token: str
         :type verify: bool
+        :type transport: Transport
+        :type metadata_cache: TTLCache
+        :type response_cache: ResponseCache
+        :type prov_cache: TTLCache
+        :type instrumentation: Instrumentation
+        :type decoder: adamalib.decoding.Decoder
+        :type coalesce: bool
+        :type state_dir: str|StateDirectory
         :rtype: None
         """
         self.url = url
         self.token = token
         self.verify = verify
+        self.transport = transport if transport is not None else Transport()
+        self._owns_state = isinstance(state_dir, six.string_types)
+        if self._owns_state:
+            state_dir = StateDirectory(state_dir)
+        self.state = state_dir
+        self._prov_store = None
+        if state_dir is not None:
+            if metadata_cache is None:
+                metadata_cache = PersistentCache(
+                    TTLCache(), state_dir.scope('metadata', url))
+            if response_cache is None:
+                response_cache = ResponseCache(
+                    backend=state_dir.scope('responses', url),
+                    ttl=DEFAULT_STATE_RESPONSE_TTL)
+            self._prov_store = state_dir.scope('prov')
+        self.metadata_cache = (metadata_cache if metadata_cache is not None
+                               else TTLCache())
+        self.response_cache = response_cache
+        self.prov_cache = (prov_cache if prov_cache is not None
+                           else TTLCache(maxsize=PROV_CACHE_SIZE, ttl=None))
+        self.instrumentation = instrumentation
+        self.decoder = decoder if decoder is not None else default_decoder
+        self.single_flight = SingleFlight() if coalesce else None
         self._prov = None
+        self._schemas = {}
+
+    def close(self):
+        """Release the pooled connections of this client.
+
+        A state directory given by path is closed too.
+
+        :rtype: None
+        """
+        self.transport.close()
+        if self._owns_state:
+            self.state.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     @property
     def utils(self):
@@ -61,11 +162,126 @@ class Adama(object):
         headers = kwargs.setdefault('headers', {})
         """:type : dict"""
         headers['Authorization'] = 'Bearer {}'.format(self.token)
-        fun = getattr(requests, method)
-        response = fun(self.url + url, verify=self.verify, **kwargs)
+        response = self._send(
+            method, self.url + url, verify=self.verify, **kwargs)
         response.raise_for_status()
         return response
 
+    def _send(self, method, url, decode=False, cache_lookup=False,
+              **kwargs):
+        """Send a request, sharing identical GETs already in flight.
+
+        Concurrent callers of the same buffered GET share one transfer.
+        Every caller gets its own response object and decodes the body
+        itself, so results can be modified independently.
+
+        :type method: str
+        :type url: str
+        :type decode: bool|tuple[str]
+        :type cache_lookup: bool
+        :type kwargs: dict[str, object]
+        :rtype: requests.Response
+        """
+        if (self.single_flight is None or method.lower() != 'get' or
+                kwargs.get('stream')):
+            return self._transfer(method, url, decode, cache_lookup,
+                                  **kwargs)
+        key = json.dumps([url, decode, cache_lookup, kwargs],
+                         sort_keys=True, default=repr)
+        leader = []
+
+        def transfer():
+            leader.append(True)
+            return self._transfer(method, url, decode, cache_lookup,
+                                  **kwargs)
+
+        response = self.single_flight.do(key, transfer)
+        if leader:
+            return response
+        # a copy drops the decoded body installed by predecode
+        response = copy.copy(response)
+        if decode:
+            predecode(response, self.decoder, decode)
+        return response
+
+    def _transfer(self, method, url, decode=False, cache_lookup=False,
+                  **kwargs):
+        """Send a request through the transport.
+
+        With ``decode`` true the body is parsed as JSON by ``decoder``
+        before returning, and ``response.json()`` returns the parsed value;
+        a tuple of field names keeps only those members of the top level
+        object. ``cache_lookup``
+        marks requests made on a miss or revalidation of a cache. When
+        ``instrumentation`` is set, a ``RequestEvent`` is emitted for
+        every request.
+
+        :type method: str
+        :type url: str
+        :type decode: bool|tuple[str]
+        :type cache_lookup: bool
+        :type kwargs: dict[str, object]
+        :rtype: requests.Response
+        """
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            response = self.transport.request(method, url, **kwargs)
+            if decode:
+                predecode(response, self.decoder, decode)
+            return response
+        event = RequestEvent(method.upper(), url,
+                             route_template(self.url, url))
+        self.transport.pop_connect_time()
+        start = timer()
+        try:
+            response = self.transport.request(method, url, **kwargs)
+        except Exception as exc:
+            event.connect = self.transport.pop_connect_time()
+            event.wait = timer() - start - event.connect
+            event.error = exc
+            instrumentation.emit(event)
+            raise
+        received = timer()
+        event.status = response.status_code
+        event.connect = self.transport.pop_connect_time()
+        headers_at = response.elapsed.total_seconds()
+        event.wait = max(headers_at - event.connect, 0.0)
+        if not kwargs.get('stream'):
+            event.download = max(received - start - headers_at, 0.0)
+            event.bytes = len(response.content)
+            event.wire_bytes = wire_bytes(response)
+        if decode:
+            start = timer()
+            predecode(response, self.decoder, decode)
+            event.decode = timer() - start
+        if cache_lookup:
+            event.cache = ('revalidated' if response.status_code == 304
+                           else 'miss')
+        instrumentation.emit(event)
+        return response
+
+    def _invalidate(self, key=None, prefix=None):
+        """Forget cached metadata and query results below ``prefix``.
+
+        :type key: str
+        :type prefix: str
+        :rtype: None
+        """
+        self.metadata_cache.invalidate(key, prefix=prefix)
+        if self.response_cache is not None:
+            self.response_cache.invalidate(self.url + (prefix or key))
+
+    def _cache_hit(self, url):
+        """Emit the event of a request answered by a cache.
+
+        :type url: str
+        :rtype: None
+        """
+        if self.instrumentation is not None:
+            url = self.url + url
+            self.instrumentation.emit(RequestEvent(
+                'GET', url, route_template(self.url, url), cache='hit'))
+
     def get(self, url, **kwargs):
         """
         :type url: str
@@ -80,11 +296,32 @@ class Adama(object):
         :type kwargs: dict[str, object]
         :rtype: dict
         """
-        response = self.get(url, **kwargs).json()
+        response = self.get(url, decode=True, **kwargs).json()
         if response['status'] != 'success':
             self.error(response['message'], response)
         return response
 
+    def get_metadata(self, url):
+        """Namespace or service metadata, served from ``metadata_cache``.
+
+        Responses of services that are still registering or failed to
+        register are not cached.
+
+        :type url: str
+        :rtype: dict
+        """
+        try:
+            info = self.metadata_cache.get(url)
+        except KeyError:
+            pass
+        else:
+            self._cache_hit(url)
+            return info
+        info = self.get_json(url, cache_lookup=True)
+        if is_complete_metadata(info):
+            self.metadata_cache.set(url, info)
+        return info
+
     def post(self, url, **kwargs):
         """
         :type url: str
@@ -109,9 +346,104 @@ class Adama(object):
         nss = self.get_json('/namespaces')['result']
         return Namespaces(self, [Namespace(self, ns['name']) for ns in nss])
 
+    def prepare(self, namespace, service, version, endpoint, type=None):
+        """Endpoint handle whose calls are single requests.
+
+        Without ``type``, the service metadata is loaded once to find it.
+
+        :type namespace: str
+        :type service: str
+        :type version: str
+        :type endpoint: str
+        :type type: str
+        :rtype: PreparedEndpoint
+        """
+        if type is None:
+            srv = Service(Namespace(self, namespace), service, version)
+            if srv._load() is None:
+                self.error('service {} is not ready'.format(srv._full_name),
+                           srv)
+            type = srv.type
+        return PreparedEndpoint(self.url, namespace, service, version,
+                                endpoint, type, self.token, self.verify,
+                                self)
+
+    def catalog(self, concurrency=8):
+        """Snapshot of every namespace and service, with a search index.
+
+        :type concurrency: int
+        :rtype: Catalog
+        """
+        return Catalog.fetch(self, concurrency)
+
     def prov(self, obj):
         self._prov = obj
 
+    def get_prov(self, url, format='json'):
+        """Provenance at ``url`` in ``format``, memoized in ``prov_cache``.
+
+        Cached documents are shared between callers and must not be
+        modified. With a state directory the downloaded documents are
+        stored there too.
+
+        :type url: str
+        :type format: str
+        :rtype: dict|str|bytes|prov.model.ProvDocument
+        """
+        if format not in PROV_FORMATS:
+            raise APIException('unknown provenance format: {}'.format(format))
+        key = (url, format)
+        try:
+            return self.prov_cache.get(key)
+        except KeyError:
+            pass
+        content = self._stored_prov(key)
+        if content is None:
+            content = self.utils._get(url, {'format': format}).content
+            if self._prov_store is not None:
+                self._prov_store.set(json.dumps(key), content)
+        value = PROV_FORMATS[format](content, self.decoder)
+        self.prov_cache.set(key, value)
+        return value
+
+    def _stored_prov(self, key):
+        """
+        :type key: (str, str)
+        :rtype: bytes|None
+        """
+        if self._prov_store is None:
+            return None
+        content = self._prov_store.get(json.dumps(key))
+        if content is not None and self.instrumentation is not None:
+            self.instrumentation.emit(RequestEvent(
+                'GET', key[0], route_template(self.url, key[0]), cache='hit'))
+        return content
+
+    def bulk_prov(self, results, format='json', concurrency=4):
+        """Provenance of many results, downloaded concurrently.
+
+        Each distinct provenance url is fetched once.
+
+        :type results: list[ProvList]
+        :type format: str
+        :type concurrency: int
+        :rtype: list
+        """
+        urls = []
+        for result in results:
+            if result.prov_url is None:
+                raise APIException('no provenance information found')
+            if result.prov_url not in urls:
+                urls.append(result.prov_url)
+        documents = {}
+        for url, ok, value in bounded_map(
+                lambda url: self.get_prov(url, format), urls,
+                concurrency=concurrency):
+            if not ok:
+                raise value
+            documents[url] = value
+        return [documents[result.prov_url] for result in results]
+
     def __getattr__(self, item):
         """
         :type item: str
@@ -120,11 +452,25 @@ class Adama(object):
         return Namespace(self, item)
 
     def __getitem__(self, item):
-        """
+        """The namespace ``item``, even if a client attribute has its name.
+
         :type item: str
         :rtype: Namespace
         """
-        return getattr(self, item)
+        return Namespace(self, item)
+
+
+def is_complete_metadata(info):
+    """
+    :type info: dict
+    :rtype: bool
+    """
+    result = info.get('result')
+    if not isinstance(result, dict):
+        return True
+    if result.get('slot') == 'error':
+        return False
+    return result.get('service', True) is not None
 
 
 class Namespaces(list):
@@ -134,7 +480,7 @@ class Namespaces(list):
         self.adama = adama
 
     def add(self, **kwargs):
-        response = self.adama.post('/namespaces', data=kwargs)
+        response = self.adama.post('/namespaces', data=kwargs, decode=True)
         json_response = response.json()
         if json_response['status'] != 'success':
             self.adama.error(json_response['message'], json_response)
@@ -152,6 +498,7 @@ class Namespace(object):
         self.adama = adama
         self.namespace = namespace
         self._ns_info = None
+        self._lock = threading.Lock()
 
     def __repr__(self):
         return 'Namespace({})'.format(self.namespace)
@@ -168,15 +515,29 @@ class Namespace(object):
         """
         :rtype: dict
         """
-        info = self.adama.get_json('/{}'.format(self.namespace))
+        info = self.adama.get_metadata('/{}'.format(self.namespace))
         self.__dict__.update(info['result'])
         return info
 
+    def _load(self):
+        """Load the metadata once, however many threads ask for it.
+
+        :rtype: dict
+        """
+        if self._ns_info is None:
+            with self._lock:
+                if self._ns_info is None:
+                    self._ns_info = self._preload()
+        return self._ns_info
+
     def delete(self):
         """
         :rtype: None
         """
         self.adama.delete('/{}'.format(self.namespace))
+        self.adama._invalidate(
+            '/{}'.format(self.namespace),
+            prefix='/{}/'.format(self.namespace))
         self._ns_info = None
         self.namespace = '<deleted>'
 
@@ -186,10 +547,18 @@ class Namespace(object):
         :rtype: Service
         """
         if not item.startswith('_') and self._ns_info is None:
-            self._ns_info = self._preload()
+            self._load()
             return getattr(self, item)
         return Service(self, item)
 
+    def __getitem__(self, item):
+        """The service ``item``, even if a namespace attribute has its name.
+
+        :type item: str
+        :rtype: Service
+        """
+        return Service(self, item)
+
 
 class Services(list):
 
@@ -205,36 +574,156 @@ class Services(list):
         self.adama = adama
         self.namespace = namespace
 
-    def add(self, mod, async=False, timeout=REGISTER_TIMEOUT):
+    def add(self, mod, async=False, timeout=REGISTER_TIMEOUT,
+            compresslevel=9, stream=False, progress=None):
         """
         :type mod: module
         :type async: bool
-        :rtype: Service|None
+        :type compresslevel: int
+        :type stream: bool
+        :type progress: callable
+        :rtype: Service|Registration
         """
         # TODO: if mod is a string, register as a git repo
-        code, name, typ, md_path = find_code(mod)
+        code, name, typ, md_path, version = find_code(
+            mod, compresslevel, stream)
+        body, content_type = multipart_upload(
+            {'type': typ, 'metadata': md_path}, 'code', code, progress)
         response = self.adama.post(
             '/{}/services'.format(self.namespace),
-            files={'code': code}, data={'type': typ, 'metadata': md_path})
+            data=body, headers={'Content-Type': content_type}, decode=True)
         try:
             json_response = response.json()
         except ValueError:
             return self.adama.error(response.text, response)
         if json_response['status'] != 'success':
             return self.adama.error(json_response['message'], json_response)
-        srv = Service(Namespace(self.adama, self.namespace), name)
+        srv = Service(Namespace(self.adama, self.namespace), name, version)
+        self.adama._invalidate(srv._full_name, prefix=srv._full_name + '/')
+        registration = Registration(srv, timeout)
         if async:
-            return srv
+            return registration
+        return registration.result()
+
+
+class Registration(object):
+    """Future-like handle on a service being registered.
+
+    The service is polled with exponential backoff and jitter until it is
+    ready, fails, or ``timeout`` seconds have passed since submission.
+    """
+
+    def __init__(self, service, timeout=REGISTER_TIMEOUT,
+                 initial_delay=0.1, max_delay=5.0, factor=2.0, jitter=0.5):
+        """
+        :type service: Service
+        :type timeout: float
+        :type initial_delay: float
+        :type max_delay: float
+        :type factor: float
+        :type jitter: float
+        :rtype: None
+        """
+        self.service = service
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.polls = 0
+        self._started = time.time()
+        self._next_poll = self._started
+        self._done = False
+        self._exception = None
+
+    def __repr__(self):
+        return 'Registration({})'.format(self.service._full_name)
+
+    @property
+    def deadline(self):
+        return self._started + self.timeout
+
+    def _delay(self):
+        delay = min(self.max_delay,
+                    self.initial_delay * self.factor ** self.polls)
+        return delay * random.uniform(1 - self.jitter, 1)
+
+    def poll(self):
+        """Check the service once and return whether registration ended.
+
+        :rtype: bool
+        """
+        if self._done:
+            return True
+        info = self.service._preload()
+        self.polls += 1
+        now = time.time()
+        if info is not None:
+            self.service._srv_info = info
+            self._done = True
+        elif getattr(self.service, '_error', None):
+            self._exception = APIException(self.service._message)
+            self._done = True
+        elif now >= self.deadline:
+            self._exception = APIException('timeout registering service')
+            self._done = True
         else:
-            t = time.time()
-            while True:
-                if time.time() - t > timeout:
-                    return self.adama.error('timeout registering service')
-                if getattr(srv, '_error', None):
-                    return self.adama.error(srv._message)
-                if srv.name is not None:
-                    return srv
-                time.sleep(0.5)
+            self._next_poll = min(now + self._delay(), self.deadline)
+        return self._done
+
+    def done(self):
+        """
+        :rtype: bool
+        """
+        return self._done
+
+    def wait(self):
+        """Block until registration ends.
+
+        :rtype: None
+        """
+        while not self.poll():
+            time.sleep(max(self._next_poll - time.time(), 0))
+
+    def exception(self):
+        """
+        :rtype: APIException|None
+        """
+        self.wait()
+        return self._exception
+
+    def result(self):
+        """
+        :rtype: Service
+        """
+        self.wait()
+        if self._exception is not None:
+            raise self._exception
+        return self.service
+
+
+def wait_all(registrations):
+    """Wait for many registrations, polling each on its own schedule.
+
+    Returns the registered services, or raises the first failure once all
+    registrations have ended.
+
+    :type registrations: list[Registration]
+    :rtype: list[Service]
+    """
+    pending = list(registrations)
+    while pending:
+        now = time.time()
+        pending = [registration for registration in pending
+                   if registration._next_poll > now or
+                   not registration.poll()]
+        if pending:
+            wake = min(registration._next_poll for registration in pending)
+            time.sleep(max(wake - time.time(), 0))
+    for registration in registrations:
+        if registration._exception is not None:
+            raise registration._exception
+    return [registration.service for registration in registrations]
 
 
 class Service(object):
@@ -243,12 +732,14 @@ class Service(object):
         """
         :type namespace: Namespace
         :type service: str
+        :type version: str
         :rtype: None
         """
         self._namespace = namespace
         self.service = service
         self._srv_info = None
         self._version = version
+        self._lock = threading.Lock()
 
     @property
     def _full_name(self):
@@ -258,15 +749,19 @@ class Service(object):
     def __repr__(self):
         return 'Service({})'.format(self._full_name)
 
-    def __getitem__(self, item):
-        self._version = item
-        return self
+    def __getitem__(self, version):
+        """The same service at another version, as a new object.
+
+        :type version: str
+        :rtype: Service
+        """
+        return Service(self._namespace, self.service, version)
 
     def _preload(self):
         """
         :rtype: dict
         """
-        info = self._namespace.adama.get_json(self._full_name)
+        info = self._namespace.adama.get_metadata(self._full_name)
         result = info['result']
         if result.get('slot') == 'error':
             self._message = result['msg']
@@ -276,6 +771,20 @@ class Service(object):
             self.__dict__.update(info['result']['service'])
             return info
 
+    def _load(self):
+        """Load the metadata once, however many threads ask for it.
+
+        Returns ``None`` while the service is not ready, and loads again
+        on the next call.
+
+        :rtype: dict|None
+        """
+        if self._srv_info is None:
+            with self._lock:
+                if self._srv_info is None:
+                    self._srv_info = self._preload()
+        return self._srv_info
+
     def __getattr__(self, item):
         """
         :type item: str
@@ -284,8 +793,7 @@ class Service(object):
         if item.startswith('_'):
             return getattr(super(Service, self), item)
         if self._srv_info is None:
-            self._srv_info = self._preload()
-            if self._srv_info is not None:
+            if self._load() is not None:
                 return getattr(self, item)
             else:
                 return None
@@ -293,6 +801,8 @@ class Service(object):
 
     def delete(self):
         self._namespace.adama.delete(self._full_name)
+        self._namespace.adama._invalidate(
+            self._full_name, prefix=self._full_name + '/')
         self._srv_info = None
         self.service = '<deleted>'
 
@@ -311,23 +821,333 @@ class Endpoint(object):
         self.namespace = self.service._namespace
         self.adama = self.service._namespace.adama
 
+    def prepare(self):
+        """Resolve the url and service type for repeated calls.
+
+        :rtype: PreparedEndpoint
+        """
+        return self.adama.prepare(
+            self.namespace.name, self.service.name, self.service.version,
+            self.endpoint, self.service.type)
+
     def __call__(self, **kwargs):
-        response = self.adama.get('/{}/{}_v{}/{}'.format(
-            self.namespace.name, self.service.name,
-            self.service.version, self.endpoint),
-            params=kwargs)
+        """Query the endpoint with ``kwargs`` as parameters.
+
+        See ``PreparedEndpoint.__call__``.
+
+        :rtype: ProvList|requests.Response
+        """
+        return self.prepare()(**kwargs)
+
+    def stream(self, **kwargs):
+        """See ``PreparedEndpoint.stream``.
+
+        :rtype: ResultStream|requests.Response
+        """
+        return self.prepare().stream(**kwargs)
+
+    def table(self, **kwargs):
+        """See ``PreparedEndpoint.table``.
+
+        :rtype: Table
+        """
+        return self.prepare().table(**kwargs)
+
+    def map(self, iterable_of_kwargs, concurrency=4, ordered=True):
+        """See ``PreparedEndpoint.map``.
+
+        :type iterable_of_kwargs: collections.Iterable[dict]
+        :type concurrency: int
+        :type ordered: bool
+        :rtype: collections.Iterator[ProvList|requests.Response|MapError]
+        """
+        return self.prepare().map(iterable_of_kwargs, concurrency, ordered)
+
+    def pages(self, page_size=PAGE_SIZE, prefetch=True, **kwargs):
+        """See ``PreparedEndpoint.pages``.
+
+        :type page_size: int
+        :type prefetch: bool
+        :rtype: PagedResult
+        """
+        return self.prepare().pages(page_size, prefetch, **kwargs)
+
+    def download(self, target, checksum=None, resume=True, progress=None,
+                 **kwargs):
+        """See ``PreparedEndpoint.download``.
+
+        :type target: str|io.BufferedIOBase
+        :type checksum: str
+        :type resume: bool
+        :type progress: callable
+        :rtype: adamalib.download.Download
+        """
+        return self.prepare().download(target, checksum, resume, progress,
+                                       **kwargs)
+
+
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+
+def shared_client(url, token=None, verify=True):
+    """Client of ``url`` shared by the whole process, created on first use.
+
+    :type url: str
+    :type token: str
+    :type verify: bool
+    :rtype: Adama
+    """
+    key = (url, token, verify)
+    with _shared_clients_lock:
+        if key not in _shared_clients:
+            _shared_clients[key] = Adama(url, token, verify)
+        return _shared_clients[key]
+
+
+class PreparedEndpoint(object):
+    """Endpoint with a resolved url and service type.
+
+    Every call is a single request, without metadata lookups. Handles are
+    immutable and can be pickled, for instance to be sent to worker
+    processes. An unpickled handle calls through ``shared_client``, which
+    has the url, token and ``verify`` of the original client but default
+    caches and transport. Pickles include the token.
+    """
+
+    __slots__ = ('url', 'token', 'verify', 'namespace', 'service', 'version',
+                 'endpoint', 'type', '_adama')
+
+    def __init__(self, url, namespace, service, version, endpoint, type,
+                 token=None, verify=True, adama=None):
+        """
+        :type url: str
+        :type namespace: str
+        :type service: str
+        :type version: str
+        :type endpoint: str
+        :type type: str
+        :type token: str
+        :type verify: bool
+        :type adama: Adama
+        :rtype: None
+        """
+        for name, value in zip(self.__slots__, (
+                url, token, verify, namespace, service, str(version),
+                endpoint, type, adama)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('PreparedEndpoint is immutable')
+
+    __delattr__ = __setattr__
+
+    def __reduce__(self):
+        return PreparedEndpoint, (
+            self.url, self.namespace, self.service, self.version,
+            self.endpoint, self.type, self.token, self.verify)
+
+    def _key(self):
+        return (self.url, self.namespace, self.service, self.version,
+                self.endpoint, self.type)
+
+    def __eq__(self, other):
+        return (isinstance(other, PreparedEndpoint) and
+                self._key() == other._key())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return 'PreparedEndpoint({}, {})'.format(self.path, self.type)
+
+    @property
+    def adama(self):
+        """
+        :rtype: Adama
+        """
+        if self._adama is not None:
+            return self._adama
+        return shared_client(self.url, self.token, self.verify)
+
+    @property
+    def service_path(self):
+        return '/{}/{}_v{}'.format(self.namespace, self.service, self.version)
+
+    @property
+    def path(self):
+        return '{}/{}'.format(self.service_path, self.endpoint)
+
+    def __call__(self, **kwargs):
+        """Query the endpoint with ``kwargs`` as parameters.
+
+        Every keyword argument is sent to the service.
+
+        :rtype: ProvList|requests.Response
+        """
+        return self._call(kwargs)
+
+    def stream(self, **kwargs):
+        """Query the endpoint without reading the whole response.
+
+        Results of ``query`` and ``map_filter`` services are returned as a
+        ``ResultStream`` yielding records as they arrive, and other
+        services return an unread response.
+
+        :rtype: ResultStream|requests.Response
+        """
+        return self._call(kwargs, stream=True)
+
+    def table(self, **kwargs):
+        """Query the endpoint and return the results as a columnar ``Table``.
+
+        The table is typed with a schema inferred once per service. Only
+        ``query`` and ``map_filter`` services return records.
+
+        :rtype: Table
+        """
+        if self.type not in ('query', 'map_filter'):
+            raise APIException('{} services do not return records: {}'.format(
+                self.type, self.path))
+        return self._call(kwargs, as_table=True)
+
+    def _call(self, kwargs, stream=False, as_table=False):
+        """
+        :type kwargs: dict
+        :type stream: bool
+        :type as_table: bool
+        :rtype: ProvList|Table|ResultStream|requests.Response
+        """
+        adama = self.adama
+        path = self.path
+        is_query = self.type in ('query', 'map_filter')
+        cache = adama.response_cache
+        if (cache is not None and not stream and cache.accepts(path) and
+                is_query):
+            result = self._cached_query(adama, cache, path, kwargs)
+            if as_table:
+                return self._table(adama, result, result.prov_url)
+            return result
+        response = adama.get(path, params=kwargs, stream=stream,
+                             decode=ENVELOPE if is_query and not stream
+                             else False)
         if not response.ok:
-            self.adama.error(response.text, response)
-        if self.service.type in ('query', 'map_filter'):
+            adama.error(response.text, response)
+        if is_query:
+            if stream:
+                return ResultStream(response, adama)
             json_response = response.json()
             if json_response['status'] != 'success':
-                self.adama.error(json_response['message'], json_response)
+                adama.error(json_response['message'], json_response)
+            if as_table:
+                return self._table(adama, json_response['result'],
+                                   get_prov_uri(response))
             return ProvList(json_response['result'],
                             get_prov_uri(response),
-                            self.adama)
+                            adama)
         else:
             return response
 
+    def _table(self, adama, records, prov_url):
+        """Columnar results, typed with the schema of the service.
+
+        :type adama: Adama
+        :type records: list[dict]
+        :type prov_url: str
+        :rtype: Table
+        """
+        key = self.service_path
+        table = Table.from_records(records, prov_url, adama,
+                                   adama._schemas.get(key))
+        adama._schemas[key] = table.schema
+        return table
+
+    def _cached_query(self, adama, cache, path, params):
+        """
+        :type adama: Adama
+        :type cache: ResponseCache
+        :type path: str
+        :type params: dict
+        :rtype: ProvList
+        """
+        key = cache.key(adama.url, path, params, adama.token)
+        entry = cache.lookup(key)
+        headers = {}
+        if entry is not None:
+            if cache.is_fresh(entry):
+                cache.record('hits')
+                adama._cache_hit(path)
+                return ProvList(entry['result'], entry['prov_url'], adama)
+            headers = cache.conditional_headers(entry)
+        response = adama.get(path, params=params, headers=headers,
+                             decode=ENVELOPE, cache_lookup=True)
+        if entry is not None and response.status_code == 304:
+            cache.record('revalidated')
+            return ProvList(entry['result'], entry['prov_url'], adama)
+        cache.record('misses')
+        json_response = response.json()
+        if json_response['status'] != 'success':
+            adama.error(json_response['message'], json_response)
+        prov_url = get_prov_uri(response)
+        cache.store(key, json_response['result'], prov_url, response.headers)
+        return ProvList(json_response['result'], prov_url, adama)
+
+    def map(self, iterable_of_kwargs, concurrency=4, ordered=True):
+        """Call the endpoint once per dict of parameters, concurrently.
+
+        Results are yielded in input order (or as they complete if
+        ``ordered`` is false). A failed call does not stop the batch: its
+        place in the output is taken by a ``MapError`` carrying the
+        parameters and the original exception.
+
+        :type iterable_of_kwargs: collections.Iterable[dict]
+        :type concurrency: int
+        :type ordered: bool
+        :rtype: collections.Iterator[ProvList|requests.Response|MapError]
+        """
+        for kwargs, ok, value in bounded_map(
+                lambda kwargs: self(**kwargs), iterable_of_kwargs,
+                concurrency=concurrency, ordered=ordered):
+            yield value if ok else MapError(kwargs, value)
+
+    def pages(self, page_size=PAGE_SIZE, prefetch=True, **kwargs):
+        """Results of a ``query`` or ``map_filter`` call, page by page.
+
+        Pages are requested with ``limit`` and ``offset`` parameters only
+        when they are needed, and with ``prefetch`` the next page is
+        downloaded while the current one is consumed.
+
+        :type page_size: int
+        :type prefetch: bool
+        :rtype: PagedResult
+        """
+        return PagedResult(self, kwargs, page_size, prefetch)
+
+    def download(self, target, checksum=None, resume=True, progress=None,
+                 **kwargs):
+        """Stream the response to ``kwargs`` into a file, with bounded memory.
+
+        For ``generic`` and ``passthrough`` services returning large files.
+        ``target`` is a path or a binary file object. Interrupted transfers
+        are resumed with ``Range`` requests, and ``checksum``, such as
+        ``'sha256:<hex>'``, is verified at the end; see
+        ``adamalib.download.download``.
+
+        :type target: str|io.BufferedIOBase
+        :type checksum: str
+        :type resume: bool
+        :type progress: callable
+        :rtype: adamalib.download.Download
+        """
+        adama = self.adama
+        return download(
+            lambda headers: adama.get(self.path, params=kwargs,
+                                      headers=headers, stream=True),
+            target, checksum, resume, progress=progress)
+
 
 def get_prov_uri(response):
     try:
@@ -347,23 +1167,259 @@ class ProvList(list):
     def prov(self, format='json', filename=None):
         if self.prov_url is None:
             raise APIException('no provenance information found')
-        response = self.adama.utils.request(self.prov_url, format=format)
-        if format in ('json', 'sources'):
-            return response.json()
-        elif format == 'prov-n':
-            return response.text
-        elif format == 'prov':
-            return ProvDocument.deserialize(
-                content=json.dumps(response.json()))
-        elif format == 'png':
-            return png(response.content, filename)
+        if format == 'png' and filename is not None:
+            return self.adama.utils.download(self.prov_url, filename,
+                                             params={'format': format})
+        value = self.adama.get_prov(self.prov_url, format)
+        if format == 'png':
+            return png(value, filename)
+        return value
+
+    def to_columns(self, schema=None):
+        """The results as a columnar ``Table`` with the same provenance.
+
+        :type schema: collections.OrderedDict
+        :rtype: Table
+        """
+        return Table.from_records(self, self.prov_url, self.adama, schema)
+
+
+class PagedResult(object):
+    """Lazy sequence of the records of a paged query.
+
+    Every page is a ``ProvList`` with the provenance of its own request.
+    Fetched pages are kept, so records can be indexed and iterated again
+    without new requests. A page shorter than ``page_size`` ends the
+    results. A page longer than ``page_size`` means the service ignored
+    ``limit`` and ``offset`` and returned every record: it becomes the
+    only page and ``unpaged`` is set.
+    """
+
+    def __init__(self, endpoint, params, page_size=PAGE_SIZE,
+                 prefetch=True):
+        """
+        :type endpoint: PreparedEndpoint
+        :type params: dict
+        :type page_size: int
+        :type prefetch: bool
+        :rtype: None
+        """
+        if page_size < 1:
+            raise ValueError('page_size must be at least 1')
+        self.endpoint = endpoint
+        self.params = params
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self._pages = {}
+        self._last = None
+        self._lock = threading.Lock()
+        self.unpaged = False
+
+    def __repr__(self):
+        return 'PagedResult({}, {} pages loaded)'.format(
+            self.params, len(self._pages))
+
+    def page(self, number):
+        """The page ``number``, counting from 0, fetched at most once.
+
+        Pages past the end are empty.
+
+        :type number: int
+        :rtype: ProvList
+        """
+        with self._lock:
+            if number in self._pages:
+                return self._pages[number]
+            if self._last is not None and number > self._last:
+                return ProvList([], None, self.endpoint.adama)
+        params = dict(self.params, limit=self.page_size,
+                      offset=number * self.page_size)
+        result = self.endpoint(**params)
+        with self._lock:
+            if self.unpaged:
+                return self._pages[0] if number == 0 else ProvList(
+                    [], None, self.endpoint.adama)
+            if len(result) > self.page_size:
+                self._pages = {0: result}
+                self._last = 0
+                self.unpaged = True
+                return result if number == 0 else ProvList(
+                    [], None, self.endpoint.adama)
+            self._pages[number] = result
+            if len(result) < self.page_size and (
+                    self._last is None or number < self._last):
+                self._last = number
+        return result
+
+    def iter_pages(self):
+        """Iterate over the non-empty pages.
+
+        :rtype: collections.Iterator[ProvList]
+        """
+        if not self.prefetch:
+            fetches = ((number, True, self.page(number))
+                       for number in itertools.count())
+        else:
+            # one worker, two pages in flight: the current and the next
+            fetches = bounded_map(self.page, itertools.count(),
+                                  concurrency=1, window=2)
+        try:
+            for _, ok, page in fetches:
+                if not ok:
+                    raise page
+                if page:
+                    yield page
+                if len(page) != self.page_size:
+                    return
+        finally:
+            fetches.close()
+
+    def __iter__(self):
+        for page in self.iter_pages():
+            for record in page:
+                yield record
+
+    def __getitem__(self, index):
+        """
+        :type index: int
+        :rtype: object
+        """
+        if index < 0:
+            return list(self)[index]
+        number, offset = divmod(index, self.page_size)
+        page = self.page(number)
+        if self.unpaged:
+            page, offset = self.page(0), index
+        try:
+            return page[offset]
+        except IndexError:
+            raise IndexError('result index out of range')
+
+    def __len__(self):
+        """Number of records; fetches every page.
+
+        :rtype: int
+        """
+        return sum(len(page) for page in self.iter_pages())
+
+    @property
+    def loaded_pages(self):
+        """
+        :rtype: list[ProvList]
+        """
+        with self._lock:
+            return [self._pages[number] for number in sorted(self._pages)
+                    if self._pages[number]]
+
+    def prov(self, format='json', concurrency=4):
+        """Provenance of every loaded page, in page order.
+
+        :type format: str
+        :type concurrency: int
+        :rtype: list
+        """
+        return self.endpoint.adama.bulk_prov(self.loaded_pages, format,
+                                             concurrency)
+
+
+def predecode(response, decoder=default_decoder, fields=True):
+    """Parse the JSON body of ``response`` once, for every ``json()`` call.
+
+    ``fields`` is ``True`` to keep the whole document, or the names of the
+    top level members to keep. Bodies that are not valid JSON are left
+    alone, so that ``json()`` raises as usual.
+
+    :type response: requests.Response
+    :type decoder: adamalib.decoding.Decoder
+    :type fields: bool|tuple[str]
+    :rtype: None
+    """
+    try:
+        if fields is True:
+            body = decoder.loads(response.content)
+        else:
+            body = decoder.envelope(response.content, fields)
+    except ValueError:
+        return
+    response.json = lambda **kwargs: body
+
+
+def prov_document(data):
+    """Build a ``ProvDocument`` from decoded PROV-JSON without re-parsing.
+
+    :type data: dict
+    :rtype: prov.model.ProvDocument
+    """
+    from prov.model import ProvDocument
+    from prov.serializers.provjson import decode_json_document
+    document = ProvDocument()
+    decode_json_document(data, document)
+    return document
+
+
+class ResultStream(object):
+    """Records of a query, parsed incrementally from the response body.
+
+    Only one chunk of the body and the records not yet consumed are held
+    in memory. ``prov_url`` is known before iteration starts. The
+    connection is released when the stream is exhausted or closed.
+    """
+
+    def __init__(self, response, adama, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        :type response: requests.Response
+        :type adama: Adama
+        :type chunk_size: int
+        :rtype: None
+        """
+        self.prov_url = get_prov_uri(response)
+        self.adama = adama
+        self.fields = None
+        self._response = response
+        self._chunk_size = chunk_size
+
+    def __iter__(self):
+        parser = ResultParser()
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            for chunk in self._response.iter_content(self._chunk_size):
+                for record in self._feed(parser, decoder.decode(chunk)):
+                    yield record
+            for record in self._feed(parser, decoder.decode(b'', True)):
+                yield record
+            parser.close()
+            self.fields = parser.fields
+        finally:
+            self.close()
+
+    def _feed(self, parser, text):
+        records = parser.feed(text)
+        status = parser.fields.get('status')
+        if status is not None and status != 'success':
+            self.adama.error(parser.fields.get('message'), parser.fields)
+        return records
+
+    def close(self):
+        """
+        :rtype: None
+        """
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def prov(self, format='json', filename=None):
+        return ProvList((), self.prov_url, self.adama).prov(format, filename)
 
 
 def png(data, filename):
     # Return an IPython image if possible, or just the content of the png
     # otherwise
     if filename is not None:
-        with open(filename, 'w') as out:
+        with open(filename, 'wb') as out:
             out.write(data)
     else:
         try:
@@ -390,7 +1446,35 @@ class Utils(object):
         :type kwargs: dict[str, object]
         :rtype: requests.Response
         """
-        resp = requests.get(url, params=kwargs, verify=self.adama.verify)
+        return self._get(url, kwargs)
+
+    def download(self, url, target, params=None, **options):
+        """Stream ``url`` into ``target``, as ``PreparedEndpoint.download``.
+
+        :type url: str
+        :type target: str|io.BufferedIOBase
+        :type params: dict[str, object]
+        :rtype: adamalib.download.Download
+        """
+        adama = self.adama
+
+        def send(headers):
+            response = adama._send('get', url, params=params, headers=headers,
+                                   stream=True, verify=adama.verify)
+            response.raise_for_status()
+            return response
+
+        return download(send, target, **options)
+
+    def _get(self, url, params, decode=False):
+        """
+        :type url: str
+        :type params: dict[str, object]
+        :type decode: bool
+        :rtype: requests.Response
+        """
+        resp = self.adama._send('get', url, decode=decode, params=params,
+                                verify=self.adama.verify)
         if not resp.ok:
             self.adama.error(resp.text, resp)
         return resp
@@ -421,26 +1505,25 @@ class Utils(object):
                                    .format(target))
         else:
             init_git(target)
-        with chdir(target):
-            with open('metadata.yml', 'w') as md:
-                md.write(textwrap.dedent(
-                    """
-                    ---
-                    name: {}
-                    version: 0.1
-                    type: {}
-                    main_module: main.py
-                    """.format(name, service_type)))
-            with open('main.py', 'w') as py:
-                py.write(textwrap.dedent(
-                    """
-                    import json
-
-                    def main(args, adama):
-                        print(json.dumps({'key': 'value'}))
-                    """))
-            with open('__init__.py', 'w'):
-                pass
+        with open(os.path.join(target, 'metadata.yml'), 'w') as md:
+            md.write(textwrap.dedent(
+                """
+                ---
+                name: {}
+                version: 0.1
+                type: {}
+                main_module: main.py
+                """.format(name, service_type)))
+        with open(os.path.join(target, 'main.py'), 'w') as py:
+            py.write(textwrap.dedent(
+                """
+                import json
+
+                def main(args, adama):
+                    print(json.dumps({'key': 'value'}))
+                """))
+        with open(os.path.join(target, '__init__.py'), 'w'):
+            pass
 
 
 def init_git(directory):
@@ -448,71 +1531,66 @@ def init_git(directory):
     :type directory: str
     :rtype: None
     """
-    with chdir(directory):
-        subprocess.check_call('git init'.split())
+    subprocess.check_call(['git', 'init', '-q'], cwd=directory)
 
 
-def find_code(mod):
-    """
+def find_code(mod, compresslevel=9, stream=False):
+    """Locate, describe and package the service containing ``mod``.
+
+    With ``stream`` the code is returned as an ``ArchiveStream`` built
+    during the upload instead of a cached ``Archive``. The service is
+    located in process; packaging it runs ``git ls-files`` once.
+
     :type mod: module
-    :rtype: (file, str, str, str)
+    :type compresslevel: int
+    :type stream: bool
+    :rtype: (Archive|ArchiveStream, str, str, str, str)
+    :return: code, name, type, metadata path and version of the service
     """
     mod_dir = os.path.dirname(os.path.abspath(mod.__file__))
-    toplevel_dir = git_top_level(mod_dir)
-    code = pack(toplevel_dir)
-    metadata = find_metadata(mod_dir, toplevel_dir)
-    md_dict = yaml.load(open(metadata))
+    toplevel_dir, metadata, md_dict = service_metadata(mod_dir)
+    if stream:
+        code = ArchiveStream(toplevel_dir, compresslevel)
+    else:
+        code = pack(toplevel_dir, compresslevel=compresslevel)
     name = md_dict['name']
     typ = md_dict['type']
-    return code, name, typ, os.path.dirname(metadata)[len(toplevel_dir)+1:]
+    version = str(md_dict.get('version', '0.1'))
+    return (code, name, typ, os.path.dirname(metadata)[len(toplevel_dir)+1:],
+            version)
 
 
-def git_top_level(directory):
-    """
+def service_metadata(directory):
+    """Repository, metadata file and metadata of the service in ``directory``.
+
     :type directory: str
-    :rtype: str
+    :rtype: (str, str, dict)
     """
-    with chdir(directory):
-        try:
-            return subprocess.check_output(
-                'git rev-parse --show-toplevel'.split()).strip()
-        except subprocess.CalledProcessError:
-            raise APIException('module not in a git repository')
+    toplevel_dir = git_top_level(directory)
+    metadata = find_metadata(directory, toplevel_dir)
+    return toplevel_dir, metadata, load_metadata(metadata)
 
 
-def pack(directory):
+def git_top_level(directory):
     """
     :type directory: str
-    :rtype: file
+    :rtype: str
     """
-    temp = tempfile.mkdtemp()
-    tar_name = os.path.join(temp, 'code.tgz')
-    with chdir(directory), \
-            tarfile.open(tar_name, 'w:gz') as tar:
-        tar.add('.')
-    return open(tar_name)
+    root = repository_root(directory)
+    if root is None:
+        raise APIException('module not in a git repository')
+    return root
 
 
 def find_metadata(directory, toplevel):
-    """
+    """Nearest ``metadata.yml`` in ``directory`` or its parents.
+
     :type directory: str
+    :type toplevel: str
     :rtype: str
     """
-    if len(os.path.abspath(directory)) < len(os.path.abspath(toplevel)):
+    md = find_metadata_file(directory, toplevel)
+    if md is None:
         raise APIException('could not find metadata file in '
                            'directory: {}'.format(toplevel))
-    try:
-        md = os.path.join(directory, 'metadata.yml')
-    except IOError:
-        return find_metadata(os.path.join(directory, '..'), toplevel)
     return md
-
-
-@contextmanager
-def chdir(directory):
-    old_wd = os.getcwd()
-    try:
-        os.chdir(directory)
-        yield
-    finally:
-        os.chdir(old_wd)
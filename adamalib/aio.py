@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Asyncio client for Adama.
+
+Mirrors the navigation of the synchronous client::
+
+    async with AsyncAdama(url, token) as adama:
+        result = await adama.ns.srv.endpoint(q='...')
+        stream = await adama.ns.srv.endpoint.stream(q='...')
+        async for record in stream:
+            ...
+
+Requires Python 3.5+ and ``aiohttp``.
+"""
+import asyncio
+import codecs
+import collections
+
+import aiohttp
+
+from .adamalib import (PROV_CACHE_SIZE, PROV_FORMATS, APIException,
+                       ProvList, is_complete_metadata, png)
+from .cache import TTLCache
+from .decoding import default_decoder
+from .stream import ResultParser
+
+
+PROV_LINK = 'http://www.w3.org/ns/prov#has_provenance'
+CHUNK_SIZE = 64 * 1024
+
+
+class AsyncAdama(object):
+
+    def __init__(self, url, token=None, verify=True, limit=100,
+                 limit_per_host=10, keepalive_timeout=15,
+                 concurrency=None, timeout=None, metadata_cache=None,
+                 decoder=None, prov_cache=None):
+        """
+        :type url: str
+        :type token: str
+        :type verify: bool
+        :type limit: int
+        :type limit_per_host: int
+        :type keepalive_timeout: float
+        :type concurrency: int
+        :type timeout: float
+        :type metadata_cache: TTLCache
+        :type decoder: adamalib.decoding.Decoder
+        :type prov_cache: TTLCache
+        :rtype: None
+        """
+        self.url = url
+        self.token = token
+        self.verify = verify
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.metadata_cache = (metadata_cache if metadata_cache is not None
+                               else TTLCache())
+        self.decoder = decoder if decoder is not None else default_decoder
+        self.prov_cache = (prov_cache if prov_cache is not None
+                           else TTLCache(maxsize=PROV_CACHE_SIZE, ttl=None))
+        self._session = None
+        self._semaphore = None
+
+    def _get_session(self):
+        # sessions and semaphores bind to the running loop: create lazily
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit, limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ssl=None if self.verify else False)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._semaphore = asyncio.Semaphore(
+                self.concurrency or self.limit or 100)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def error(self, message, obj=None):
+        raise APIException(message, obj)
+
+    async def _open(self, url, auth=True, **kwargs):
+        """Send a GET and return the unread response, holding a slot.
+
+        The caller must ``_release`` the response.
+
+        :rtype: aiohttp.ClientResponse
+        """
+        session = self._get_session()
+        headers = kwargs.setdefault('headers', {})
+        if auth:
+            headers['Authorization'] = 'Bearer {}'.format(self.token)
+        await self._semaphore.acquire()
+        try:
+            response = await session.get(url, **kwargs)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        if response.status >= 400:
+            text = await response.text()
+            self._release(response)
+            self.error(text, response)
+        return response
+
+    def _release(self, response):
+        response.release()
+        self._semaphore.release()
+
+    async def _read(self, url, auth=True, **kwargs):
+        response = await self._open(url, auth=auth, **kwargs)
+        try:
+            body = await response.read()
+        finally:
+            self._release(response)
+        return response, body
+
+    async def get_json(self, url, **kwargs):
+        """
+        :type url: str
+        :rtype: dict
+        """
+        _, body = await self._read(self.url + url, **kwargs)
+        response = self.decoder.loads(body)
+        if response['status'] != 'success':
+            self.error(response['message'], response)
+        return response
+
+    async def get_metadata(self, url):
+        """Metadata served from ``metadata_cache``, as ``Adama.get_metadata``.
+
+        :type url: str
+        :rtype: dict
+        """
+        try:
+            return self.metadata_cache.get(url)
+        except KeyError:
+            pass
+        info = await self.get_json(url)
+        if is_complete_metadata(info):
+            self.metadata_cache.set(url, info)
+        return info
+
+    def _invalidate(self, key=None, prefix=None):
+        """Forget cached metadata below ``prefix``, as ``Adama._invalidate``.
+
+        The asyncio client keeps no query results to drop.
+
+        :type key: str
+        :type prefix: str
+        :rtype: None
+        """
+        self.metadata_cache.invalidate(key, prefix=prefix)
+
+    async def _request(self, method, url, **kwargs):
+        session = self._get_session()
+        headers = kwargs.setdefault('headers', {})
+        headers['Authorization'] = 'Bearer {}'.format(self.token)
+        async with self._semaphore:
+            async with session.request(
+                    method, self.url + url, **kwargs) as response:
+                body = await response.read()
+        if response.status >= 400:
+            self.error(body.decode('utf-8', 'replace'), response)
+        return response, body
+
+    async def post(self, url, **kwargs):
+        return await self._request('POST', url, **kwargs)
+
+    async def delete(self, url):
+        return await self._request('DELETE', url)
+
+    async def status(self):
+        return await self.get_json('/status')
+
+    async def namespaces(self):
+        nss = (await self.get_json('/namespaces'))['result']
+        return [AsyncNamespace(self, ns['name']) for ns in nss]
+
+    async def request(self, url, **kwargs):
+        """Unauthenticated GET of an absolute url, as ``Utils.request``.
+
+        :rtype: (aiohttp.ClientResponse, bytes)
+        """
+        return await self._read(url, auth=False, params=kwargs)
+
+    async def get_prov(self, url, format='json'):
+        """Provenance at ``url`` in ``format``, as ``Adama.get_prov``.
+
+        :type url: str
+        :type format: str
+        :rtype: dict|str|bytes|prov.model.ProvDocument
+        """
+        if format not in PROV_FORMATS:
+            raise APIException('unknown provenance format: {}'.format(format))
+        key = (url, format)
+        try:
+            return self.prov_cache.get(key)
+        except KeyError:
+            pass
+        _, content = await self.request(url, format=format)
+        value = PROV_FORMATS[format](content, self.decoder)
+        self.prov_cache.set(key, value)
+        return value
+
+    def __getattr__(self, item):
+        """
+        :type item: str
+        :rtype: AsyncNamespace
+        """
+        if item.startswith('_'):
+            raise AttributeError(item)
+        return AsyncNamespace(self, item)
+
+    def __getitem__(self, item):
+        return AsyncNamespace(self, item)
+
+
+class AsyncNamespace(object):
+
+    def __init__(self, adama, namespace):
+        """
+        :type adama: AsyncAdama
+        :type namespace: str
+        :rtype: None
+        """
+        self.adama = adama
+        self.namespace = namespace
+        self._ns_info = None
+        self._lock = None
+
+    def __repr__(self):
+        return 'AsyncNamespace({})'.format(self.namespace)
+
+    async def load(self):
+        """Fetch the namespace metadata once and expose it as attributes.
+
+        Concurrent callers wait for a single request.
+
+        :rtype: dict
+        """
+        if self._ns_info is None:
+            self._lock = self._lock or asyncio.Lock()
+            async with self._lock:
+                if self._ns_info is None:
+                    info = await self.adama.get_metadata(
+                        '/{}'.format(self.namespace))
+                    self.__dict__.update(info['result'])
+                    self._ns_info = info
+        return self._ns_info
+
+    async def services(self):
+        srvs = (await self.adama.get_json(
+            '/{}/services'.format(self.namespace)))['result']
+        return [AsyncService(self, srv['name'], srv['version'])
+                for srv in srvs]
+
+    async def delete(self):
+        await self.adama.delete('/{}'.format(self.namespace))
+        self.adama._invalidate(
+            '/{}'.format(self.namespace),
+            prefix='/{}/'.format(self.namespace))
+        self._ns_info = None
+        self.namespace = '<deleted>'
+
+    def __getattr__(self, item):
+        """
+        :type item: str
+        :rtype: AsyncService
+        """
+        if item.startswith('_'):
+            raise AttributeError(item)
+        return AsyncService(self, item)
+
+    def __getitem__(self, item):
+        return AsyncService(self, item)
+
+
+class AsyncService(object):
+
+    def __init__(self, namespace, service, version='0.1'):
+        """
+        :type namespace: AsyncNamespace
+        :type service: str
+        :type version: str
+        :rtype: None
+        """
+        self._namespace = namespace
+        self.service = service
+        self._version = version
+        self._srv_info = None
+        self._lock = None
+
+    @property
+    def _full_name(self):
+        return '/{}/{}_v{}'.format(
+            self._namespace.namespace, self.service, self._version)
+
+    def __repr__(self):
+        return 'AsyncService({})'.format(self._full_name)
+
+    def __getitem__(self, version):
+        return AsyncService(self._namespace, self.service, version)
+
+    async def load(self):
+        """Fetch the service metadata once and expose it as attributes.
+
+        Concurrent callers wait for a single request.
+
+        :rtype: dict
+        """
+        if self._srv_info is None:
+            # asyncio locks bind to the running loop: create lazily
+            self._lock = self._lock or asyncio.Lock()
+            async with self._lock:
+                if self._srv_info is None:
+                    self._srv_info = await self._fetch()
+        return self._srv_info['result']['service']
+
+    async def _fetch(self):
+        info = await self._namespace.adama.get_metadata(self._full_name)
+        result = info['result']
+        if result.get('slot') == 'error':
+            self._namespace.adama.error(result['msg'], result)
+        if result['service'] is None:
+            self._namespace.adama.error(
+                'service {} is not ready'.format(self._full_name), info)
+        self.__dict__.update(result['service'])
+        return info
+
+    async def delete(self):
+        await self._namespace.adama.delete(self._full_name)
+        self._namespace.adama._invalidate(
+            self._full_name, prefix=self._full_name + '/')
+        self._srv_info = None
+        self.service = '<deleted>'
+
+    def __getattr__(self, item):
+        """
+        :type item: str
+        :rtype: AsyncEndpoint
+        """
+        if item.startswith('_'):
+            raise AttributeError(item)
+        return AsyncEndpoint(self, item)
+
+
+class AsyncEndpoint(object):
+
+    def __init__(self, service, endpoint):
+        """
+        :type service: AsyncService
+        :type endpoint: str
+        :rtype: None
+        """
+        self.service = service
+        self.endpoint = endpoint
+        self.namespace = service._namespace
+        self.adama = service._namespace.adama
+
+    async def _url(self):
+        info = await self.service.load()
+        url = '{}/{}/{}_v{}/{}'.format(
+            self.adama.url, self.namespace.namespace, info['name'],
+            info['version'], self.endpoint)
+        return url, info['type']
+
+    async def __call__(self, **kwargs):
+        """
+        :rtype: AsyncProvList|(aiohttp.ClientResponse, bytes)
+        """
+        url, typ = await self._url()
+        response, body = await self.adama._read(url, params=kwargs)
+        if typ not in ('query', 'map_filter'):
+            return response, body
+        json_response = self.adama.decoder.envelope(body)
+        if json_response['status'] != 'success':
+            self.adama.error(json_response['message'], json_response)
+        return AsyncProvList(json_response['result'],
+                             get_prov_uri(response), self.adama)
+
+    async def stream(self, **kwargs):
+        """Start a query and return an async iterator over its records.
+
+        :rtype: AsyncResultStream
+        """
+        url, _ = await self._url()
+        response = await self.adama._open(url, params=kwargs)
+        return AsyncResultStream(self.adama, response)
+
+
+class AsyncResultStream(object):
+    """Records of a query, parsed as the response arrives.
+
+    ``prov_url`` is available before iteration. The underlying connection
+    is released when the stream is exhausted, closed or cancelled.
+    """
+
+    def __init__(self, adama, response):
+        """
+        :type adama: AsyncAdama
+        :type response: aiohttp.ClientResponse
+        :rtype: None
+        """
+        self.adama = adama
+        self.prov_url = get_prov_uri(response)
+        self._response = response
+        self._parser = ResultParser()
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._pending = collections.deque()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            while not self._pending:
+                if self._response is None:
+                    raise StopAsyncIteration
+                chunk = await self._response.content.read(CHUNK_SIZE)
+                if not chunk:
+                    self._finish()
+                else:
+                    self._feed(self._decoder.decode(chunk))
+        except BaseException:
+            self.close()
+            raise
+        return self._pending.popleft()
+
+    def _feed(self, text):
+        self._pending.extend(self._parser.feed(text))
+        status = self._parser.fields.get('status')
+        if status is not None and status != 'success':
+            self.adama.error(self._parser.fields.get('message'),
+                             self._parser.fields)
+
+    def _finish(self):
+        self._feed(self._decoder.decode(b'', final=True))
+        self.close()
+        self._parser.close()
+
+    def close(self):
+        if self._response is not None:
+            self.adama._release(self._response)
+            self._response = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+class AsyncProvList(ProvList):
+
+    async def prov(self, format='json', filename=None):
+        if self.prov_url is None:
+            raise APIException('no provenance information found')
+        value = await self.adama.get_prov(self.prov_url, format)
+        if format == 'png':
+            return png(value, filename)
+        return value
+
+
+def get_prov_uri(response):
+    """
+    :type response: aiohttp.ClientResponse
+    :rtype: str
+    """
+    try:
+        return str(response.links[PROV_LINK]['url'])
+    except KeyError:
+        return None
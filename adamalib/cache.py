@@ -0,0 +1,562 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import collections
+import errno
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import six
+
+
+DEFAULT_METADATA_TTL = 300  # seconds
+DEFAULT_METADATA_SIZE = 1024  # entries
+DEFAULT_RESPONSE_ENTRIES = 1024
+DEFAULT_RESPONSE_BYTES = 256 * 1024 * 1024
+DEFAULT_STATE_BYTES = 512 * 1024 * 1024
+DEFAULT_STATE_RESPONSE_TTL = 3600  # seconds
+STATE_FILE = 'state.db'
+SCOPE_SEPARATOR = '\x1f'  # sqlite string functions stop at NUL
+
+
+class TTLCache(object):
+    """Thread-safe LRU cache whose entries expire after ``ttl`` seconds.
+
+    A ``ttl`` of ``None`` keeps entries until they are evicted by size.
+    """
+
+    def __init__(self, maxsize=DEFAULT_METADATA_SIZE,
+                 ttl=DEFAULT_METADATA_TTL, timer=time.time):
+        """
+        :type maxsize: int
+        :type ttl: float
+        :type timer: callable
+        :rtype: None
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()
+
+    def get(self, key):
+        """Return the cached value, or raise ``KeyError``.
+
+        :type key: collections.Hashable
+        :rtype: object
+        """
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                raise
+            if expires is not None and expires <= self._timer():
+                self.misses += 1
+                raise KeyError(key)
+            self._data[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store ``value`` for ``ttl`` seconds, the cache's ``ttl`` by default.
+
+        :type key: collections.Hashable
+        :type value: object
+        :type ttl: float
+        :rtype: None
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else self._timer() + ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key=None, prefix=None):
+        """Drop ``key``, every string key starting with ``prefix``, or all.
+
+        :type key: collections.Hashable
+        :type prefix: str
+        :rtype: None
+        """
+        with self._lock:
+            if key is None and prefix is None:
+                self._data.clear()
+                return
+            self._data.pop(key, None)
+            if prefix is not None:
+                for cached in list(self._data):
+                    if (isinstance(cached, six.string_types) and
+                            cached.startswith(prefix)):
+                        del self._data[cached]
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def stats(self):
+        """
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._data)}
+
+
+class MemoryBackend(object):
+    """In-memory LRU store of serialized responses."""
+
+    def __init__(self, max_entries=DEFAULT_RESPONSE_ENTRIES,
+                 max_bytes=DEFAULT_RESPONSE_BYTES):
+        """
+        :type max_entries: int
+        :type max_bytes: int
+        :rtype: None
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()
+        self._bytes = 0
+
+    def get(self, key):
+        """
+        :type key: str
+        :rtype: bytes|None
+        """
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is not None:
+                self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        """
+        :type key: str
+        :type value: bytes
+        :rtype: None
+        """
+        if self.max_bytes is not None and len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._data[key] = value
+            self._bytes += len(value)
+            while (len(self._data) > self.max_entries or
+                   self.max_bytes is not None and
+                   self._bytes > self.max_bytes):
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._data if key.startswith(prefix)]:
+                self._bytes -= len(self._data.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+
+class SQLiteBackend(object):
+    """On-disk LRU store of serialized responses in a sqlite database.
+
+    The database can be shared by several processes: it uses write-ahead
+    logging, and writers wait up to 30 seconds for each other.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_RESPONSE_BYTES):
+        """
+        :type path: str
+        :type max_bytes: int
+        :rtype: None
+        """
+        import sqlite3
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30,
+                                   check_same_thread=False)
+        try:
+            self._db.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.OperationalError:
+            pass  # e.g. on network filesystems; keep the default journal
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                'size INTEGER NOT NULL, accessed REAL NOT NULL)')
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS responses_accessed '
+                'ON responses (accessed)')
+
+    def get(self, key):
+        """
+        :type key: str
+        :rtype: bytes|None
+        """
+        with self._lock, self._db:
+            row = self._db.execute(
+                'SELECT value FROM responses WHERE key = ?',
+                (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                'UPDATE responses SET accessed = ? WHERE key = ?',
+                (time.time(), key))
+            return bytes(row[0])
+
+    def set(self, key, value):
+        """
+        :type key: str
+        :type value: bytes
+        :rtype: None
+        """
+        if self.max_bytes is not None and len(value) > self.max_bytes:
+            return
+        import sqlite3
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                (key, sqlite3.Binary(value), len(value), time.time()))
+            if self.max_bytes is None:
+                return
+            total, = self._db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()
+            rows = self._db.execute(
+                'SELECT key, size FROM responses ORDER BY accessed')
+            evicted = []
+            for old_key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                evicted.append((old_key,))
+                total -= size
+            self._db.executemany('DELETE FROM responses WHERE key = ?',
+                                 evicted)
+
+    def delete(self, key):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+
+    def delete_prefix(self, prefix):
+        with self._lock, self._db:
+            self._db.execute(
+                'DELETE FROM responses WHERE substr(key, 1, ?) = ?',
+                (len(prefix), prefix))
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM responses')
+
+    def close(self):
+        self._db.close()
+
+
+class ScopedBackend(object):
+    """View of the keys of ``backend`` starting with ``scope``."""
+
+    def __init__(self, backend, scope):
+        """
+        :type backend: MemoryBackend|SQLiteBackend
+        :type scope: str
+        :rtype: None
+        """
+        self.backend = backend
+        self.scope = scope
+
+    def get(self, key):
+        return self.backend.get(self.scope + key)
+
+    def set(self, key, value):
+        self.backend.set(self.scope + key, value)
+
+    def delete(self, key):
+        self.backend.delete(self.scope + key)
+
+    def delete_prefix(self, prefix):
+        self.backend.delete_prefix(self.scope + prefix)
+
+    def clear(self):
+        self.backend.delete_prefix(self.scope)
+
+
+class PersistentCache(object):
+    """``TTLCache`` in front of a persistent store of JSON values.
+
+    Entries missing from ``memory`` are looked up in ``backend``, where
+    they stay valid for the ``ttl`` of ``memory`` counted from when they
+    were stored, so that other processes and later runs can use them.
+    """
+
+    def __init__(self, memory, backend):
+        """
+        :type memory: TTLCache
+        :type backend: ScopedBackend|MemoryBackend|SQLiteBackend
+        :rtype: None
+        """
+        self.memory = memory
+        self.backend = backend
+        self.loaded = 0
+
+    @property
+    def ttl(self):
+        return self.memory.ttl
+
+    def get(self, key):
+        """Return the cached value, or raise ``KeyError``.
+
+        :type key: str
+        :rtype: object
+        """
+        try:
+            return self.memory.get(key)
+        except KeyError:
+            pass
+        data = self.backend.get(key)
+        if data is None:
+            raise KeyError(key)
+        entry = json.loads(data.decode('utf-8'))
+        ttl = None
+        if self.ttl is not None:
+            ttl = entry['stored'] + self.ttl - time.time()
+            if ttl <= 0:
+                self.backend.delete(key)
+                raise KeyError(key)
+        self.memory.set(key, entry['value'], ttl)
+        self.loaded += 1
+        return entry['value']
+
+    def set(self, key, value):
+        """
+        :type key: str
+        :type value: object
+        :rtype: None
+        """
+        self.memory.set(key, value)
+        self.backend.set(key, json.dumps(
+            {'stored': time.time(), 'value': value}).encode('utf-8'))
+
+    def invalidate(self, key=None, prefix=None):
+        """
+        :type key: str
+        :type prefix: str
+        :rtype: None
+        """
+        self.memory.invalidate(key, prefix)
+        if key is None and prefix is None:
+            self.backend.clear()
+            return
+        if key is not None:
+            self.backend.delete(key)
+        if prefix is not None:
+            self.backend.delete_prefix(prefix)
+
+    def __len__(self):
+        return len(self.memory)
+
+    @property
+    def stats(self):
+        """
+        :rtype: dict[str, int]
+        """
+        return dict(self.memory.stats, loaded=self.loaded)
+
+
+class StateDirectory(object):
+    """Client state kept in a directory, for warm restarts.
+
+    Metadata, query results and provenance documents are stored in one
+    sqlite database, ``state.db``, that concurrent processes can share.
+    The least recently used entries are evicted beyond ``max_bytes``.
+    The directory is created readable by the current user only, as it
+    holds the results and provenance fetched with the user's token.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_STATE_BYTES):
+        """
+        :type path: str
+        :type max_bytes: int
+        :rtype: None
+        """
+        path = os.path.expanduser(path)
+        try:
+            os.makedirs(path, 0o700)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        self.path = path
+        self.backend = SQLiteBackend(os.path.join(path, STATE_FILE),
+                                     max_bytes)
+
+    def scope(self, *names):
+        """Part of the state reserved to ``names``.
+
+        :type names: str
+        :rtype: ScopedBackend
+        """
+        return ScopedBackend(self.backend, ''.join(
+            name + SCOPE_SEPARATOR for name in names))
+
+    def clear(self):
+        self.backend.clear()
+
+    def close(self):
+        self.backend.close()
+
+    def __repr__(self):
+        return 'StateDirectory({})'.format(self.path)
+
+
+class ResponseCache(object):
+    """Opt-in cache of ``query`` and ``map_filter`` endpoint results.
+
+    Entries keep the result together with its provenance url and the
+    ``ETag``/``Last-Modified`` validators of the response. Entries with
+    validators are revalidated with a conditional request; entries without
+    them are served while younger than ``ttl`` (forever if ``None``).
+    """
+
+    def __init__(self, backend=None, ttl=None, exclude=()):
+        """
+        :type backend: MemoryBackend|SQLiteBackend
+        :type ttl: float
+        :type exclude: collections.Iterable[str]
+        :rtype: None
+        """
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'revalidated': 0}
+        self._excluded = set()
+        for name in exclude:
+            self.exclude(*name.split('/'))
+
+    def exclude(self, namespace, service, version=None):
+        """Never cache results of a service (of any version by default).
+
+        Only ``service`` itself is excluded, not services whose names
+        start with it, such as ``<service>_v2``.
+
+        :type namespace: str
+        :type service: str
+        :type version: str
+        :rtype: None
+        """
+        version = (re.escape(str(version)) if version is not None
+                   else '(?:(?!_v)[^/])+')
+        self._excluded.add(re.compile('{}{}/'.format(
+            re.escape('/{}/{}_v'.format(namespace, service)), version)))
+
+    def accepts(self, path):
+        """
+        :type path: str
+        :rtype: bool
+        """
+        return not any(pattern.match(path) for pattern in self._excluded)
+
+    @staticmethod
+    def key(url, path, params, token=None):
+        """Key of the result of ``path`` on the server at ``url``.
+
+        Keys start with ``url + path``, so that the results of a service
+        can be dropped by prefix with ``invalidate``. A hash of ``token``
+        keeps the results of different users apart in a shared backend.
+
+        :type url: str
+        :type path: str
+        :type params: dict
+        :type token: str
+        :rtype: str
+        """
+        user = (hashlib.sha256(token.encode('utf-8')).hexdigest()[:32]
+                if token else '')
+        return '{}{}?{}&{}'.format(url, path, user,
+                                   json.dumps(sorted(params.items())))
+
+    def invalidate(self, prefix):
+        """Forget the results whose key starts with ``prefix``.
+
+        :type prefix: str
+        :rtype: None
+        """
+        self.backend.delete_prefix(prefix)
+
+    def lookup(self, key):
+        """Return the stored entry for ``key``, or ``None``.
+
+        :type key: str
+        :rtype: dict|None
+        """
+        value = self.backend.get(key)
+        if value is None:
+            return None
+        return json.loads(value.decode('utf-8'))
+
+    def is_fresh(self, entry):
+        """
+        :type entry: dict
+        :rtype: bool
+        """
+        if entry['etag'] or entry['last_modified']:
+            return False
+        return self.ttl is None or time.time() - entry['stored'] < self.ttl
+
+    def store(self, key, result, prov_url, headers):
+        """
+        :type key: str
+        :type result: list
+        :type prov_url: str
+        :type headers: collections.Mapping
+        :rtype: None
+        """
+        entry = {'result': result, 'prov_url': prov_url,
+                 'etag': headers.get('ETag'),
+                 'last_modified': headers.get('Last-Modified'),
+                 'stored': time.time()}
+        self.backend.set(key, json.dumps(entry).encode('utf-8'))
+
+    @staticmethod
+    def conditional_headers(entry):
+        """
+        :type entry: dict
+        :rtype: dict[str, str]
+        """
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def record(self, outcome):
+        """Count a lookup as one of ``hits``, ``misses`` or ``revalidated``.
+
+        :type outcome: str
+        :rtype: None
+        """
+        with self._lock:
+            self._stats[outcome] += 1
+
+    @property
+    def stats(self):
+        """
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return dict(self._stats)
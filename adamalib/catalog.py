@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import bisect
+import json
+import os
+import re
+import tempfile
+import time
+
+import six
+
+from .parallel import bounded_map
+
+
+CATALOG_VERSION = 1
+TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def tokens(text):
+    """
+    :type text: six.text_type
+    :rtype: list[six.text_type]
+    """
+    return TOKEN.findall(six.text_type(text).lower())
+
+
+def service_key(namespace, name, version):
+    """
+    :type namespace: str
+    :type name: str
+    :type version: str
+    :rtype: str
+    """
+    return '{}/{}_v{}'.format(namespace, name, version)
+
+
+def endpoint_names(service):
+    """Endpoint names of a service, without leading slashes.
+
+    :type service: dict
+    :rtype: list[str]
+    """
+    endpoints = service.get('endpoints') or ()
+    return sorted(six.text_type(endpoint).strip('/')
+                  for endpoint in endpoints)
+
+
+class Catalog(object):
+    """Local snapshot of the namespaces and services of an Adama server.
+
+    Services are indexed by namespace, name, type, version, description
+    and endpoint names, so they can be searched without requests. A
+    snapshot is saved to and loaded from a JSON file, and ``refresh``
+    only downloads the service lists that changed.
+    """
+
+    def __init__(self, url, namespaces=None):
+        """
+        :type url: str
+        :type namespaces: dict[str, dict]
+        :rtype: None
+        """
+        self.url = url
+        self.namespaces = namespaces or {}
+        self._build_index()
+
+    @classmethod
+    def fetch(cls, adama, concurrency=8):
+        """Download the whole catalog of ``adama``.
+
+        :type adama: adamalib.Adama
+        :type concurrency: int
+        :rtype: Catalog
+        """
+        catalog = cls(adama.url)
+        catalog.refresh(adama, concurrency=concurrency)
+        return catalog
+
+    def refresh(self, adama, max_age=None, concurrency=8):
+        """Bring the snapshot up to date.
+
+        The namespace list is always downloaded. Service lists are
+        downloaded for new namespaces and for known ones fetched more than
+        ``max_age`` seconds ago (all of them by default); the latter are
+        revalidated with their ``ETag``/``Last-Modified`` validators.
+
+        :type adama: adamalib.Adama
+        :type max_age: float
+        :type concurrency: int
+        :rtype: list[str]
+        :return: names of the namespaces whose services changed
+        """
+        now = time.time()
+        listed = dict((ns['name'], ns) for ns in
+                      adama.get_json('/namespaces')['result'])
+        changed = sorted(set(self.namespaces) - set(listed))
+        for name in changed:
+            del self.namespaces[name]
+        stale = [name for name in sorted(listed)
+                 if name not in self.namespaces or max_age is None or
+                 now - self.namespaces[name]['fetched'] > max_age]
+        for name in set(listed) - set(stale):
+            self.namespaces[name]['info'] = listed[name]
+        for name, ok, value in bounded_map(
+                lambda name: self._fetch_services(adama, name), stale,
+                concurrency=concurrency):
+            if not ok:
+                raise value
+            entry, modified = value
+            entry['info'] = listed[name]
+            self.namespaces[name] = entry
+            if modified:
+                changed.append(name)
+        self._build_index()
+        return sorted(changed)
+
+    def _fetch_services(self, adama, name):
+        """
+        :type adama: adamalib.Adama
+        :type name: str
+        :rtype: (dict, bool)
+        """
+        old = self.namespaces.get(name)
+        headers = {}
+        if old is not None:
+            if old.get('etag'):
+                headers['If-None-Match'] = old['etag']
+            if old.get('last_modified'):
+                headers['If-Modified-Since'] = old['last_modified']
+        fetched = time.time()
+        response = adama.get('/{}/services'.format(name), headers=headers,
+                             decode=True)
+        if old is not None and response.status_code == 304:
+            return dict(old, fetched=fetched), False
+        body = response.json()
+        if body['status'] != 'success':
+            adama.error(body['message'], body)
+        return {'services': body['result'], 'fetched': fetched,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')}, True
+
+    def _build_index(self):
+        self.services = {}
+        postings = {}
+        for namespace, entry in self.namespaces.items():
+            for service in entry.get('services', ()):
+                key = service_key(namespace, service['name'],
+                                  service.get('version'))
+                self.services[key] = dict(service, namespace=namespace)
+                words = tokens(' '.join([
+                    namespace, service['name'], str(service.get('version')),
+                    service.get('type') or '',
+                    service.get('description') or ''] +
+                    endpoint_names(service)))
+                for word in words:
+                    postings.setdefault(word, set()).add(key)
+        self._words = sorted(postings)
+        self._postings = postings
+
+    def __len__(self):
+        return len(self.services)
+
+    def _matching(self, prefix):
+        keys = set()
+        start = bisect.bisect_left(self._words, prefix)
+        for word in self._words[start:]:
+            if not word.startswith(prefix):
+                break
+            keys.update(self._postings[word])
+        return keys
+
+    def search(self, text=None, namespace=None, name=None, type=None,
+               version=None, endpoint=None):
+        """Services matching all the given criteria, sorted by key.
+
+        Every word of ``text`` must start a word of the namespace, name,
+        type, version, description or endpoints of a service. The other
+        criteria are exact matches.
+
+        :type text: str
+        :type namespace: str
+        :type name: str
+        :type type: str
+        :type version: str
+        :type endpoint: str
+        :rtype: list[dict]
+        """
+        keys = set(self.services)
+        for word in tokens(text or ''):
+            keys &= self._matching(word)
+        found = []
+        for key in sorted(keys):
+            service = self.services[key]
+            if ((namespace is None or service['namespace'] == namespace) and
+                    (name is None or service['name'] == name) and
+                    (type is None or service.get('type') == type) and
+                    (version is None or
+                     str(service.get('version')) == str(version)) and
+                    (endpoint is None or
+                     endpoint.strip('/') in endpoint_names(service))):
+                found.append(service)
+        return found
+
+    def complete(self, prefix):
+        """Keys of the services starting with ``prefix``, for completion.
+
+        :type prefix: str
+        :rtype: list[str]
+        """
+        return sorted(key for key in self.services if key.startswith(prefix))
+
+    def save(self, path):
+        """Write the snapshot to ``path`` atomically.
+
+        :type path: str
+        :rtype: None
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, partial = tempfile.mkstemp(dir=directory, suffix='.partial')
+        try:
+            with os.fdopen(fd, 'w') as out:
+                json.dump({'version': CATALOG_VERSION, 'url': self.url,
+                           'namespaces': self.namespaces}, out)
+            os.rename(partial, path)
+        except BaseException:
+            os.remove(partial)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        :type path: str
+        :rtype: Catalog
+        """
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != CATALOG_VERSION:
+            raise ValueError('unsupported catalog version: {}'.format(
+                data.get('version')))
+        return cls(data['url'], data['namespaces'])
+
+    def __repr__(self):
+        return 'Catalog({}, {} namespaces, {} services)'.format(
+            self.url, len(self.namespaces), len(self.services))
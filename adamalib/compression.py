@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import zlib
+
+import six
+from six.moves.urllib.parse import urlencode
+
+
+MIN_COMPRESSED_BODY = 1024  # bytes
+COMPRESS_LEVEL = 6
+
+
+def accept_encoding():
+    """Content codings the transport decodes, for ``Accept-Encoding``.
+
+    gzip and deflate are always decoded; brotli and zstd are offered when
+    the installed urllib3 can decode them (``brotli`` or ``zstandard``
+    installed).
+
+    :rtype: str
+    """
+    from requests.packages.urllib3 import response
+    encodings = ['gzip', 'deflate']
+    if getattr(response, 'brotli', None) is not None:
+        encodings.append('br')
+    if getattr(response, 'zstd', None) is not None:
+        encodings.append('zstd')
+    return ', '.join(encodings)
+
+
+def compress(data, encoding, level=COMPRESS_LEVEL):
+    """
+    :type data: bytes
+    :type encoding: str
+    :type level: int
+    :rtype: bytes
+    """
+    if encoding in ('gzip', 'deflate'):
+        compressor = zlib.compressobj(
+            level, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+        return compressor.compress(data) + compressor.flush()
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(data, quality=level)
+    if encoding == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError('unsupported content coding: {}'.format(encoding))
+
+
+def compress_body(kwargs, encoding, min_size=MIN_COMPRESSED_BODY):
+    """Compress the ``data`` of the request ``kwargs`` in place.
+
+    Only bodies held in memory (bytes, text or form fields) of at least
+    ``min_size`` bytes are compressed. Uploaded files and streamed bodies,
+    such as service archives, are sent unchanged.
+
+    :type kwargs: dict[str, object]
+    :type encoding: str
+    :type min_size: int
+    :rtype: bool
+    :return: whether the body was compressed
+    """
+    data = kwargs.get('data')
+    if kwargs.get('files') or data is None:
+        return False
+    content_type = None
+    if isinstance(data, (dict, list)):
+        data = urlencode(data, doseq=True).encode('utf-8')
+        content_type = 'application/x-www-form-urlencoded'
+    elif isinstance(data, six.text_type):
+        data = data.encode('utf-8')
+    elif not isinstance(data, bytes):
+        return False
+    if len(data) < min_size:
+        return False
+    headers = kwargs['headers'] = dict(kwargs.get('headers') or {})
+    if content_type is not None:
+        headers.setdefault('Content-Type', content_type)
+    headers['Content-Encoding'] = encoding
+    kwargs['data'] = compress(data, encoding)
+    return True
+
+
+def wire_bytes(response):
+    """Bytes of ``response`` body received, before content decoding.
+
+    :type response: requests.Response
+    :rtype: int
+    """
+    counted = getattr(response.raw, 'wire_bytes', None)
+    if counted is not None:
+        return counted
+    try:
+        return response.raw.tell()
+    except (AttributeError, IOError):
+        return len(response.content)
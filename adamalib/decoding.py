@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import importlib
+import json
+
+from requests.utils import guess_json_utf
+
+
+BACKENDS = ('orjson', 'ujson')
+ENVELOPE = ('status', 'message', 'result')
+
+
+def stdlib_loads(data):
+    """Decode JSON text or bytes with the standard library.
+
+    The encoding of bytes is detected as in ``requests.Response.json``.
+
+    :type data: bytes|str
+    :rtype: object
+    """
+    if isinstance(data, bytes):
+        data = data.decode(guess_json_utf(data) or 'utf-8')
+    return json.loads(data)
+
+
+class Decoder(object):
+    """JSON decoder using the first installed backend of ``backends``.
+
+    Backends decode bytes directly, without an intermediate string.
+    Documents a backend rejects (``NaN``, integers beyond 64 bits, ...)
+    are decoded again by the standard library, so results and errors are
+    those of ``json.loads``.
+    """
+
+    def __init__(self, backends=BACKENDS):
+        """
+        :type backends: collections.Iterable[str|callable]
+        :rtype: None
+        """
+        self.name = 'json'
+        self._loads = None
+        for backend in backends:
+            if callable(backend):
+                self.name = getattr(backend, '__name__', 'custom')
+                self._loads = backend
+                break
+            try:
+                self._loads = importlib.import_module(backend).loads
+            except ImportError:
+                continue
+            self.name = backend
+            break
+
+    def __repr__(self):
+        return 'Decoder({})'.format(self.name)
+
+    def loads(self, data):
+        """
+        :type data: bytes|str
+        :rtype: object
+        """
+        if self._loads is not None:
+            try:
+                return self._loads(data)
+            except ValueError:
+                pass
+        return stdlib_loads(data)
+
+    def envelope(self, data, fields=ENVELOPE):
+        """Decode an Adama response keeping only ``fields``.
+
+        Other members of the top level object are dropped as soon as the
+        document is decoded.
+
+        :type data: bytes|str
+        :type fields: collections.Iterable[str]
+        :rtype: dict
+        """
+        document = self.loads(data)
+        if not isinstance(document, dict):
+            return document
+        return dict((field, document[field]) for field in fields
+                    if field in document)
+
+
+default_decoder = Decoder()
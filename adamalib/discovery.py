@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Location of services on disk, without subprocesses or ``chdir``.
+
+Repository roots and metadata files are cached per directory, and the
+most recently parsed metadata per content hash, under a lock, so that
+many services can be located from concurrent threads. Packaging still
+lists the tracked files with ``git ls-files`` (see
+``adamalib.packaging.tracked_files``).
+"""
+import collections
+import copy
+import hashlib
+import os
+import threading
+
+
+METADATA_FILE = 'metadata.yml'
+PARSED_CACHE_SIZE = 256  # parsed metadata files kept
+
+_lock = threading.Lock()
+_roots = {}
+_metadata_files = {}
+_parsed = collections.OrderedDict()
+
+
+def repository_root(directory):
+    """Top level directory of the git repository containing ``directory``.
+
+    As ``git rev-parse --show-toplevel``, symbolic links are resolved.
+    A ``.git`` file, as in worktrees and submodules, marks a root too.
+
+    :type directory: str
+    :rtype: str|None
+    """
+    directory = os.path.realpath(directory)
+    with _lock:
+        root = _roots.get(directory)
+    if root is not None and os.path.exists(os.path.join(root, '.git')):
+        return root
+    current = directory
+    while not os.path.exists(os.path.join(current, '.git')):
+        parent = os.path.dirname(current)
+        if parent == current:
+            return None
+        current = parent
+    with _lock:
+        _roots[directory] = current
+    return current
+
+
+def find_metadata_file(directory, toplevel):
+    """Nearest ``metadata.yml`` in ``directory`` or above, up to ``toplevel``.
+
+    :type directory: str
+    :type toplevel: str
+    :rtype: str|None
+    """
+    directory = os.path.realpath(directory)
+    toplevel = os.path.realpath(toplevel)
+    relative = os.path.relpath(directory, toplevel)
+    if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        return None
+    key = (directory, toplevel)
+    with _lock:
+        path = _metadata_files.get(key)
+    if path is not None and os.path.isfile(path):
+        return path
+    current = directory
+    while True:
+        path = os.path.join(current, METADATA_FILE)
+        if os.path.isfile(path):
+            with _lock:
+                _metadata_files[key] = path
+            return path
+        parent = os.path.dirname(current)
+        if current == toplevel or parent == current:
+            return None
+        current = parent
+
+
+def load_metadata(path):
+    """Parsed content of the metadata file at ``path``.
+
+    Files with identical content are parsed once, as long as they are
+    among the ``PARSED_CACHE_SIZE`` most recently loaded contents. Each
+    call returns its own copy, which the caller may modify.
+
+    :type path: str
+    :rtype: dict
+    """
+    with open(path, 'rb') as md:
+        content = md.read()
+    digest = hashlib.sha1(content).hexdigest()
+    with _lock:
+        parsed = _parsed.pop(digest, None)
+        if parsed is not None:
+            _parsed[digest] = parsed
+    if parsed is None:
+        import yaml
+        parsed = yaml.safe_load(content)
+        with _lock:
+            _parsed[digest] = parsed
+            while len(_parsed) > PARSED_CACHE_SIZE:
+                _parsed.popitem(last=False)
+    return copy.deepcopy(parsed)
+
+
+def clear_caches():
+    """Forget every cached root, metadata location and parsed metadata.
+
+    :rtype: None
+    """
+    with _lock:
+        _roots.clear()
+        _metadata_files.clear()
+        _parsed.clear()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import re
+
+import requests
+import six
+from requests.packages.urllib3.exceptions import (ProtocolError,
+                                                  ReadTimeoutError)
+
+from .instrumentation import timer
+
+
+CHUNK_SIZE = 256 * 1024  # bytes
+PARTIAL_SUFFIX = '.partial'
+MAX_RESUMES = 3
+CONTENT_RANGE = re.compile(r'bytes (?:(\d+)-\d+|\*)/(\d+|\*)')
+INTERRUPTED = (requests.exceptions.ConnectionError,
+               requests.exceptions.ChunkedEncodingError)
+
+
+class ChecksumError(ValueError):
+    """Downloaded content does not match the expected checksum."""
+
+
+class Download(object):
+    """Outcome of a download.
+
+    ``size`` is the size of the whole file and ``transferred`` the bytes
+    received by this download, less than ``size`` when it resumed an
+    earlier one at ``resumed_from``. ``resumes`` counts the interrupted
+    transfers continued with a ``Range`` request. ``digest`` is the
+    hexadecimal checksum, when one was asked for.
+    """
+
+    def __init__(self, target, size, transferred, resumed_from, resumes,
+                 elapsed, digest=None):
+        self.target = target
+        self.size = size
+        self.transferred = transferred
+        self.resumed_from = resumed_from
+        self.resumes = resumes
+        self.elapsed = elapsed
+        self.digest = digest
+
+    @property
+    def throughput(self):
+        """Bytes received per second.
+
+        :rtype: float
+        """
+        return self.transferred / self.elapsed if self.elapsed else 0.0
+
+    def __repr__(self):
+        return 'Download({}, {} bytes, {:.0f} B/s)'.format(
+            self.target, self.size, self.throughput)
+
+
+def parse_checksum(checksum):
+    """Split ``'sha256:<hex>'`` into a ``hashlib`` name and a digest.
+
+    :type checksum: str|None
+    :rtype: (str, str)|(None, None)
+    """
+    if checksum is None:
+        return None, None
+    algorithm, _, digest = checksum.partition(':')
+    if not digest:
+        raise ValueError('checksum must be "<algorithm>:<hex digest>"')
+    hashlib.new(algorithm)  # raises ValueError for unknown algorithms
+    return algorithm, digest.lower()
+
+
+def download(send, target, checksum=None, resume=True,
+             max_resumes=MAX_RESUMES, progress=None, chunk_size=CHUNK_SIZE):
+    """Stream the response of ``send`` into ``target``.
+
+    ``send`` is called with the request headers and returns a streamed
+    ``requests.Response``. The body is written chunk by chunk, as sent,
+    without content decoding: ``identity`` is requested, and the bytes of
+    a server that compresses the body anyway are written unchanged, since
+    ``Content-Length`` and ``Range`` offsets count them. A path ``target``
+    is written to ``<path>.partial``
+    and renamed when complete; with ``resume``, an existing partial file
+    is continued with a ``Range`` request, and interrupted transfers are
+    continued up to ``max_resumes`` times. File objects must be seekable
+    to be resumed. ``progress`` is called after every chunk with the
+    bytes written, the expected size (``None`` if unknown) and the
+    seconds elapsed.
+
+    :type send: callable
+    :type target: str|io.BufferedIOBase
+    :type checksum: str
+    :type resume: bool
+    :type max_resumes: int
+    :type progress: callable
+    :type chunk_size: int
+    :rtype: Download
+    """
+    algorithm, expected = parse_checksum(checksum)
+    is_path = isinstance(target, six.string_types)
+    if is_path:
+        partial = target + PARTIAL_SUFFIX
+        out = open(partial, 'ab' if resume else 'wb')
+        origin = 0
+    else:
+        out = target
+        try:
+            origin = out.tell()
+        except (AttributeError, IOError, OSError):
+            origin = None  # not seekable: cannot restart
+    try:
+        transfer = _Transfer(out, origin, algorithm)
+        if is_path and resume:
+            transfer.rehash(partial)
+        resumed_from = transfer.written
+        resumes = 0
+        start = timer()
+        while True:
+            try:
+                if transfer.receive(send, chunk_size, progress, start):
+                    break
+            except INTERRUPTED:
+                if not resume or resumes >= max_resumes:
+                    raise
+            else:
+                if not resume or resumes >= max_resumes:
+                    raise requests.exceptions.ConnectionError(
+                        'download interrupted after {} of {} bytes'.format(
+                            transfer.written, transfer.total))
+            resumes += 1
+        elapsed = timer() - start
+    finally:
+        if is_path:
+            out.close()
+    digest = transfer.hasher.hexdigest() if transfer.hasher else None
+    if expected is not None and digest != expected:
+        if is_path:
+            os.remove(partial)
+        raise ChecksumError('{} checksum {} does not match {}'.format(
+            algorithm, digest, expected))
+    if is_path:
+        os.rename(partial, target)
+    return Download(target, transfer.written,
+                    transfer.written - resumed_from, resumed_from, resumes,
+                    elapsed, digest)
+
+
+class _Transfer(object):
+    """Bytes of one download written so far, with their running checksum."""
+
+    def __init__(self, out, origin, algorithm):
+        self.out = out
+        self.origin = origin
+        self.algorithm = algorithm
+        self.hasher = hashlib.new(algorithm) if algorithm else None
+        self.written = 0
+        self.total = None
+
+    def rehash(self, path):
+        """Account for the content already in the partial file ``path``."""
+        with open(path, 'rb') as existing:
+            for chunk in iter(lambda: existing.read(CHUNK_SIZE), b''):
+                if self.hasher is not None:
+                    self.hasher.update(chunk)
+                self.written += len(chunk)
+
+    def restart(self):
+        """Discard what was written, when the server ignores ``Range``."""
+        if self.origin is None:
+            raise requests.exceptions.ConnectionError(
+                'cannot restart a download into an unseekable file')
+        self.out.seek(self.origin)
+        self.out.truncate()
+        self.hasher = hashlib.new(self.algorithm) if self.algorithm else None
+        self.written = 0
+
+    def receive(self, send, chunk_size, progress, start):
+        """Request the missing bytes and write them.
+
+        :rtype: bool
+        :return: whether the content is complete
+        """
+        headers = {'Accept-Encoding': 'identity'}
+        if self.written:
+            headers['Range'] = 'bytes={}-'.format(self.written)
+        try:
+            response = send(headers)
+        except requests.exceptions.HTTPError as exc:
+            if exc.response is None or exc.response.status_code != 416:
+                raise
+            response = exc.response
+        try:
+            if response.status_code == 416 and self.written:
+                match = CONTENT_RANGE.match(
+                    response.headers.get('Content-Range', ''))
+                if match and match.group(2) == str(self.written):
+                    self.total = self.written
+                    return True
+                self.restart()
+                return False
+            response.raise_for_status()
+            if response.status_code == 206:
+                match = CONTENT_RANGE.match(
+                    response.headers.get('Content-Range', ''))
+                if not match or match.group(1) != str(self.written):
+                    self.restart()
+                    return False
+            elif self.written:
+                self.restart()  # the server sent the whole content
+            length = response.headers.get('Content-Length')
+            self.total = (self.written + int(length) if length is not None
+                          else None)
+            for chunk in raw_chunks(response, chunk_size):
+                self.out.write(chunk)
+                if self.hasher is not None:
+                    self.hasher.update(chunk)
+                self.written += len(chunk)
+                if progress is not None:
+                    progress(self.written, self.total, timer() - start)
+        finally:
+            response.close()
+        return self.total is None or self.written >= self.total
+
+
+def raw_chunks(response, chunk_size):
+    """Body of ``response`` as received, before content decoding.
+
+    Errors are raised as by ``iter_content``.
+
+    :type response: requests.Response
+    :type chunk_size: int
+    :rtype: collections.Iterator[bytes]
+    """
+    if not hasattr(response.raw, 'stream'):
+        for chunk in response.iter_content(chunk_size):
+            yield chunk
+        return
+    try:
+        for chunk in response.raw.stream(chunk_size, decode_content=False):
+            yield chunk
+    except ProtocolError as exc:
+        raise requests.exceptions.ChunkedEncodingError(exc)
+    except ReadTimeoutError as exc:
+        raise requests.exceptions.ConnectionError(exc)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import collections
+import threading
+import time
+
+
+timer = getattr(time, 'perf_counter', time.time)
+
+SAMPLES_PER_ROUTE = 4096
+QUANTILES = (50, 95, 99)
+FIXED_ROUTES = ('status', 'namespaces')
+
+
+def quantile(samples, q):
+    """Nearest-rank percentile ``q`` of ``samples``, 0 without samples.
+
+    :type samples: collections.Iterable[float]
+    :type q: float
+    :rtype: float
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = int(round(q / 100.0 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+class RequestEvent(object):
+    """Timing and size of one request, in seconds and bytes.
+
+    ``connect`` is the time spent opening new connections, ``wait`` the
+    time until the response headers arrived, ``download`` the time reading
+    the body and ``decode`` the time parsing it as JSON. Phases that did
+    not happen are ``None``. ``bytes`` is the size of the body and
+    ``wire_bytes`` the size received, which is smaller for compressed
+    responses. ``cache`` is ``'hit'``, ``'miss'`` or ``'revalidated'`` for
+    requests answered by or checked against a cache.
+    """
+
+    __slots__ = ('method', 'url', 'route', 'status', 'connect', 'wait',
+                 'download', 'decode', 'bytes', 'wire_bytes', 'cache',
+                 'error')
+
+    def __init__(self, method, url, route, status=None, connect=None,
+                 wait=None, download=None, decode=None, bytes=0,
+                 wire_bytes=0, cache=None, error=None):
+        self.method = method
+        self.url = url
+        self.route = route
+        self.status = status
+        self.connect = connect
+        self.wait = wait
+        self.download = download
+        self.decode = decode
+        self.bytes = bytes
+        self.wire_bytes = wire_bytes
+        self.cache = cache
+        self.error = error
+
+    @property
+    def total(self):
+        """
+        :rtype: float
+        """
+        return sum(phase or 0.0 for phase in (
+            self.connect, self.wait, self.download, self.decode))
+
+    def as_dict(self):
+        """
+        :rtype: dict
+        """
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return 'RequestEvent({} {} {} {:.3f}s)'.format(
+            self.method, self.route, self.status, self.total)
+
+
+class RouteStats(object):
+    """Counters and latency samples of one route; cache hits count apart."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.wire_bytes = 0
+        self.cache = collections.Counter()
+        self.phases = collections.Counter()
+        self.total = 0.0
+        self.samples = collections.deque(maxlen=SAMPLES_PER_ROUTE)
+
+    def add(self, event):
+        """
+        :type event: RequestEvent
+        :rtype: None
+        """
+        if event.cache is not None:
+            self.cache[event.cache] += 1
+        if event.cache == 'hit':
+            return
+        self.count += 1
+        if event.error is not None or (event.status or 0) >= 400:
+            self.errors += 1
+        self.bytes += event.bytes or 0
+        self.wire_bytes += event.wire_bytes or 0
+        for phase in ('connect', 'wait', 'download', 'decode'):
+            self.phases[phase] += getattr(event, phase) or 0.0
+        total = event.total
+        self.total += total
+        self.samples.append(total)
+
+    def quantile(self, q):
+        """Latency at percentile ``q`` of the most recent samples.
+
+        :type q: float
+        :rtype: float
+        """
+        return quantile(self.samples, q)
+
+    def summary(self):
+        """
+        :rtype: dict
+        """
+        result = {'count': self.count, 'errors': self.errors,
+                  'bytes': self.bytes, 'wire_bytes': self.wire_bytes,
+                  'total': self.total,
+                  'cache': dict(self.cache), 'phases': dict(self.phases)}
+        for q in QUANTILES:
+            result['p{}'.format(q)] = self.quantile(q)
+        return result
+
+
+class RequestStats(object):
+    """Aggregated request statistics per route template."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def __call__(self, event):
+        with self._lock:
+            stats = self._routes.get(event.route)
+            if stats is None:
+                stats = self._routes[event.route] = RouteStats()
+            stats.add(event)
+
+    def summary(self):
+        """
+        :rtype: dict[str, dict]
+        """
+        with self._lock:
+            return dict((route, stats.summary())
+                        for route, stats in self._routes.items())
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+    def prometheus(self, prefix='adama_client'):
+        """Statistics in the Prometheus text exposition format.
+
+        :type prefix: str
+        :rtype: str
+        """
+        summary = self.summary()
+        lines = [
+            '# HELP {}_request_seconds Request latency.'.format(prefix),
+            '# TYPE {}_request_seconds summary'.format(prefix)]
+        for route, stats in sorted(summary.items()):
+            for q in QUANTILES:
+                lines.append('{}_request_seconds{{route="{}",quantile="{}"}} '
+                             '{!r}'.format(prefix, route, q / 100.0,
+                                           stats['p{}'.format(q)]))
+            lines.append('{}_request_seconds_sum{{route="{}"}} {!r}'.format(
+                prefix, route, stats['total']))
+            lines.append('{}_request_seconds_count{{route="{}"}} {}'.format(
+                prefix, route, stats['count']))
+        for name, key, kind in (('errors', 'errors', 'Failed requests.'),
+                                ('bytes', 'bytes', 'Bytes received.'),
+                                ('wire_bytes', 'wire_bytes',
+                                 'Bytes received before decompression.')):
+            lines.append('# HELP {}_{}_total {}'.format(prefix, name, kind))
+            lines.append('# TYPE {}_{}_total counter'.format(prefix, name))
+            for route, stats in sorted(summary.items()):
+                lines.append('{}_{}_total{{route="{}"}} {}'.format(
+                    prefix, name, route, stats[key]))
+        lines.append('# HELP {}_cache_total Cache lookups by result.'
+                     .format(prefix))
+        lines.append('# TYPE {}_cache_total counter'.format(prefix))
+        for route, stats in sorted(summary.items()):
+            for result, count in sorted(stats['cache'].items()):
+                lines.append('{}_cache_total{{route="{}",result="{}"}} {}'
+                             .format(prefix, route, result, count))
+        return '\n'.join(lines) + '\n'
+
+
+class Instrumentation(object):
+    """Hooks called with a ``RequestEvent`` after every request.
+
+    The aggregated ``stats`` are always collected; more callables can be
+    added with ``add_hook``.
+    """
+
+    def __init__(self, hooks=()):
+        """
+        :type hooks: collections.Iterable[callable]
+        :rtype: None
+        """
+        self.stats = RequestStats()
+        self.hooks = [self.stats] + list(hooks)
+
+    def add_hook(self, hook):
+        """
+        :type hook: callable
+        :rtype: None
+        """
+        self.hooks.append(hook)
+
+    def emit(self, event):
+        """
+        :type event: RequestEvent
+        :rtype: None
+        """
+        for hook in self.hooks:
+            hook(event)
+
+
+def route_template(base_url, url):
+    """Route of ``url`` with its variable parts replaced by placeholders.
+
+    :type base_url: str
+    :type url: str
+    :rtype: str
+    """
+    if not url.startswith(base_url):
+        return 'external'
+    parts = [part for part in url[len(base_url):].split('?')[0].split('/')
+             if part]
+    if not parts:
+        return '/'
+    if parts[0] == 'prov':
+        return '/prov/{id}'
+    if len(parts) == 1:
+        return '/' + parts[0] if parts[0] in FIXED_ROUTES else '/{ns}'
+    if len(parts) == 2:
+        return '/{ns}/services' if parts[1] == 'services' else '/{ns}/{srv}'
+    return '/{ns}/{srv}/{endpoint}'
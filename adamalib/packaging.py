@@ -0,0 +1,483 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import errno
+import fnmatch
+import hashlib
+import itertools
+import logging
+import os
+import stat
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+from six.moves import queue
+
+
+logger = logging.getLogger(__name__)
+
+IGNORE_FILE = '.adamaignore'
+PACK_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join('~', '.cache'),
+    'adamalib', 'packs')
+PACK_CACHE_SIZE = 16  # archives
+CHUNK_SIZE = 64 * 1024  # bytes
+
+
+class Archive(object):
+    """A packed service, with the statistics of how it was produced."""
+
+    def __init__(self, path, digest, files, elapsed, reused):
+        """
+        :type path: str
+        :type digest: str
+        :type files: int
+        :type elapsed: float
+        :type reused: bool
+        :rtype: None
+        """
+        self.path = path
+        self.digest = digest
+        self.files = files
+        self.elapsed = elapsed
+        self.reused = reused
+
+    @property
+    def size(self):
+        """
+        :rtype: int
+        """
+        return os.path.getsize(self.path)
+
+    @property
+    def filename(self):
+        """Name under which the archive is uploaded.
+
+        :rtype: str
+        """
+        return 'code' + os.path.splitext(self.path)[1]
+
+    def open(self):
+        """
+        :rtype: file
+        """
+        return open(self.path, 'rb')
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """
+        :type chunk_size: int
+        :rtype: collections.Iterator[bytes]
+        """
+        return file_chunks(self.path, chunk_size)
+
+    def __repr__(self):
+        return 'Archive({}, {} files, {} bytes, {:.3f}s{})'.format(
+            self.path, self.files, self.size, self.elapsed,
+            ', reused' if self.reused else '')
+
+
+def tracked_files(directory):
+    """Files of the git work tree at ``directory`` that should be packed.
+
+    Only files tracked by git are included, minus the glob patterns listed
+    in an optional ``.adamaignore`` file at the top of ``directory``.
+    The list comes from one ``git ls-files`` subprocess.
+
+    :type directory: str
+    :rtype: list[str]
+    """
+    try:
+        output = subprocess.check_output(
+            ['git', 'ls-files', '-z'], cwd=directory)
+    except (OSError, subprocess.CalledProcessError):
+        from .adamalib import APIException
+        raise APIException('could not list the files tracked by git in '
+                           'directory: {}'.format(directory))
+    paths = [path.decode('utf-8') for path in output.split(b'\0') if path]
+    patterns = read_ignore_file(os.path.join(directory, IGNORE_FILE))
+    return sorted(
+        path for path in paths
+        if os.path.lexists(os.path.join(directory, path)) and
+        not os.path.isdir(os.path.join(directory, path)) and
+        not any(fnmatch.fnmatch(path, pattern) for pattern in patterns))
+
+
+def read_ignore_file(path):
+    """
+    :type path: str
+    :rtype: list[str]
+    """
+    try:
+        with open(path) as ignore:
+            lines = [line.strip() for line in ignore]
+    except IOError:
+        return []
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def content_digest(directory, paths, compresslevel):
+    """Hash of the names, modes and contents of ``paths``.
+
+    :type directory: str
+    :type paths: list[str]
+    :type compresslevel: int
+    :rtype: str
+    """
+    digest = hashlib.sha1(str(compresslevel).encode('ascii'))
+    for path in paths:
+        full = os.path.join(directory, path)
+        mode = os.lstat(full).st_mode
+        digest.update(path.encode('utf-8') + b'\0')
+        digest.update(str(stat.S_IMODE(mode) & 0o111).encode('ascii'))
+        if stat.S_ISLNK(mode):
+            digest.update(os.readlink(full).encode('utf-8'))
+        else:
+            with open(full, 'rb') as f:
+                for block in iter(lambda: f.read(64 * 1024), b''):
+                    digest.update(block)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def pack(directory, compresslevel=9, cache_dir=None):
+    """Archive the git tracked files of ``directory``.
+
+    The archive is stored in ``cache_dir`` (``PACK_CACHE_DIR`` by default)
+    under the content hash of the files, and reused as long as they do not
+    change. A ``compresslevel`` of 0 produces an uncompressed tar, which is
+    fastest to build.
+
+    :type directory: str
+    :type compresslevel: int
+    :type cache_dir: str
+    :rtype: Archive
+    """
+    start = time.time()
+    paths = tracked_files(directory)
+    digest = content_digest(directory, paths, compresslevel)
+    extension = '.tgz' if compresslevel else '.tar'
+    cache_dir = private_directory(cache_dir or PACK_CACHE_DIR)
+    target = os.path.join(cache_dir, digest + extension)
+    reused = is_private_file(target)
+    if reused:
+        try:
+            os.utime(target, None)
+        except OSError:  # pruned by another process meanwhile
+            reused = False
+    if not reused:
+        write_archive(directory, paths, target, compresslevel)
+        prune_pack_cache(cache_dir)
+    archive = Archive(target, digest, len(paths), time.time() - start, reused)
+    logger.info('packed %s: %r', directory, archive)
+    return archive
+
+
+def private_directory(path):
+    """Create the directory ``path`` for the current user only.
+
+    Archives found in the pack cache are uploaded as service code, so an
+    existing directory must belong to the current user and must not be
+    writable by anyone else.
+
+    :type path: str
+    :rtype: str
+    """
+    path = os.path.expanduser(path)
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or not _private(info):
+        from .adamalib import APIException
+        raise APIException('pack cache directory {} must be a directory '
+                           'owned by the current user and not writable by '
+                           'others'.format(path))
+    return path
+
+
+def is_private_file(path):
+    """Whether ``path`` is a regular file only the current user can write.
+
+    :type path: str
+    :rtype: bool
+    """
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISREG(info.st_mode) and _private(info)
+
+
+def _private(info):
+    if hasattr(os, 'getuid') and info.st_uid != os.getuid():
+        return False
+    return not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def write_archive(directory, paths, target, compresslevel):
+    """
+    :type directory: str
+    :type paths: list[str]
+    :type target: str
+    :type compresslevel: int
+    :rtype: None
+    """
+    import tarfile
+    fd, partial = tempfile.mkstemp(dir=os.path.dirname(target),
+                                   suffix='.partial')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            if compresslevel:
+                tar = tarfile.open(fileobj=out, mode='w:gz',
+                                   compresslevel=compresslevel)
+            else:
+                tar = tarfile.open(fileobj=out, mode='w')
+            with tar:
+                for path in paths:
+                    tar.add(os.path.join(directory, path),
+                            arcname=os.path.join('.', path),
+                            recursive=False)
+        os.rename(partial, target)
+    except BaseException:
+        os.remove(partial)
+        raise
+
+
+def prune_pack_cache(cache_dir=PACK_CACHE_DIR, keep=PACK_CACHE_SIZE):
+    """Remove all but the ``keep`` most recently used archives.
+
+    Archives removed meanwhile by another thread or process are skipped.
+
+    :type cache_dir: str
+    :type keep: int
+    :rtype: None
+    """
+    cache_dir = os.path.expanduser(cache_dir)
+    archives = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(('.tgz', '.tar')):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            archives.append((os.stat(path).st_mtime, path))
+        except OSError:
+            continue
+    archives.sort(reverse=True)
+    for _, path in archives[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class ArchiveStream(object):
+    """Archive of a directory produced while it is being uploaded.
+
+    Nothing is written to disk: a producer thread feeds tar and gzip
+    output into a bounded queue, so at most ``queue_size`` chunks are held
+    in memory.
+    """
+
+    size = None
+
+    def __init__(self, directory, compresslevel=9, chunk_size=CHUNK_SIZE,
+                 queue_size=4):
+        """
+        :type directory: str
+        :type compresslevel: int
+        :type chunk_size: int
+        :type queue_size: int
+        :rtype: None
+        """
+        self.directory = directory
+        self.compresslevel = compresslevel
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+        self.paths = tracked_files(directory)
+
+    @property
+    def filename(self):
+        return 'code.tgz' if self.compresslevel else 'code.tar'
+
+    def chunks(self):
+        """
+        :rtype: collections.Iterator[bytes]
+        """
+        import gzip
+        import tarfile
+        chunks = queue.Queue(self.queue_size)
+        writer = _QueueWriter(chunks, self.chunk_size)
+        failure = []
+
+        def produce():
+            try:
+                # tarfile's 'w|gz' mode ignores compresslevel
+                sink = writer
+                if self.compresslevel:
+                    sink = gzip.GzipFile(fileobj=writer, mode='wb',
+                                         compresslevel=self.compresslevel)
+                with tarfile.open(fileobj=sink, mode='w|') as tar:
+                    for path in self.paths:
+                        tar.add(os.path.join(self.directory, path),
+                                arcname=os.path.join('.', path),
+                                recursive=False)
+                sink.close()
+                writer.flush()
+            except _Cancelled:
+                return
+            except Exception as exc:
+                failure.append(exc)
+            writer.finish()
+
+        producer = threading.Thread(target=produce)
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            writer.cancelled = True
+            try:
+                # unblock a producer waiting on a full queue
+                while True:
+                    chunks.get_nowait()
+            except queue.Empty:
+                pass
+        if failure:
+            raise failure[0]
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _QueueWriter(object):
+    """File-like sink that hands fixed size chunks to a queue."""
+
+    def __init__(self, chunks, chunk_size):
+        self.chunks = chunks
+        self.chunk_size = chunk_size
+        self.cancelled = False
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer.extend(data)
+        while len(self._buffer) >= self.chunk_size:
+            self._put(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+
+    def close(self):
+        pass
+
+    def flush(self):
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            del self._buffer[:]
+
+    def finish(self):
+        self.chunks.put(None)
+
+    def _put(self, chunk):
+        while True:
+            if self.cancelled:
+                raise _Cancelled()
+            try:
+                self.chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+
+def file_chunks(path, chunk_size=CHUNK_SIZE):
+    """
+    :type path: str
+    :type chunk_size: int
+    :rtype: collections.Iterator[bytes]
+    """
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
+
+
+def multipart_upload(fields, name, archive, progress=None):
+    """Build a streaming ``multipart/form-data`` body for ``archive``.
+
+    Returns the body and its content type. Archives of known size give a
+    file-like body with a length; streamed archives give a generator,
+    sent with chunked transfer encoding. ``progress`` is called after
+    every chunk with the bytes sent, the total (or ``None``) and the
+    elapsed seconds.
+
+    :type fields: dict[str, str]
+    :type name: str
+    :type archive: Archive|ArchiveStream
+    :type progress: callable
+    :rtype: (object, str)
+    """
+    boundary = uuid.uuid4().hex
+    head = b''.join(
+        '--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n{}\r\n'
+        .format(boundary, key, value).encode('utf-8')
+        for key, value in sorted(fields.items()))
+    head += ('--{}\r\nContent-Disposition: form-data; name="{}"; '
+             'filename="{}"\r\nContent-Type: application/octet-stream'
+             '\r\n\r\n'.format(boundary, name, archive.filename)
+             .encode('utf-8'))
+    tail = '\r\n--{}--\r\n'.format(boundary).encode('utf-8')
+    size = archive.size
+    total = None if size is None else len(head) + size + len(tail)
+
+    def body():
+        start = time.time()
+        sent = 0
+        parts = itertools.chain([head], archive.chunks(), [tail])
+        for chunk in parts:
+            yield chunk
+            sent += len(chunk)
+            if progress is not None:
+                progress(sent, total, time.time() - start)
+        elapsed = time.time() - start
+        logger.info('uploaded %d bytes in %.3fs (%.0f bytes/s)', sent,
+                    elapsed, sent / elapsed if elapsed else float('inf'))
+
+    content_type = 'multipart/form-data; boundary={}'.format(boundary)
+    if total is None:
+        return body(), content_type
+    return _IterReader(body(), total), content_type
+
+
+class _IterReader(object):
+    """File-like view of an iterator of bytes with a known total length."""
+
+    def __init__(self, chunks, length):
+        self._chunks = chunks
+        self._length = length
+        self._buffer = b''
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        if self._buffer:
+            yield self._buffer
+            self._buffer = b''
+        for chunk in self._chunks:
+            yield chunk
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+
+from six.moves import queue
+
+
+_STOP = object()
+
+
+def bounded_map(func, iterable, concurrency=4, ordered=True, window=None):
+    """Apply ``func`` to every item of ``iterable`` in a pool of threads.
+
+    Yields ``(item, ok, value)`` tuples, where ``value`` is the result of
+    ``func(item)`` or the exception it raised. At most ``window`` items
+    (twice the concurrency by default) are read from ``iterable`` ahead of
+    the consumer, so arbitrarily large inputs are never materialized.
+
+    :type func: callable
+    :type iterable: collections.Iterable
+    :type concurrency: int
+    :type ordered: bool
+    :type window: int
+    :rtype: collections.Iterator[(object, bool, object)]
+    """
+    if concurrency < 1:
+        raise ValueError('concurrency must be at least 1')
+    window = max(window or 2 * concurrency, concurrency)
+    tasks = queue.Queue()
+    results = queue.Queue()
+
+    def worker():
+        while True:
+            task = tasks.get()
+            if task is _STOP:
+                return
+            index, item = task
+            try:
+                results.put((index, item, True, func(item)))
+            except Exception as exc:
+                results.put((index, item, False, exc))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    items = iter(iterable)
+    exhausted = False
+    submitted = 0
+    pending = 0
+    done = {}
+    next_index = 0
+    try:
+        while True:
+            while not exhausted and pending < window:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                tasks.put((submitted, item))
+                submitted += 1
+                pending += 1
+            if not pending:
+                return
+            index, item, ok, value = results.get()
+            if not ordered:
+                pending -= 1
+                yield item, ok, value
+                continue
+            done[index] = (item, ok, value)
+            while next_index in done:
+                pending -= 1
+                yield done.pop(next_index)
+                next_index += 1
+    finally:
+        # drop work that was queued but not started, then stop the workers
+        try:
+            while True:
+                tasks.get_nowait()
+        except queue.Empty:
+            pass
+        for _ in threads:
+            tasks.put(_STOP)
+
+
+class SingleFlight(object):
+    """Share one execution of a call among concurrent callers of a key.
+
+    The first caller of a key runs the function; callers arriving while
+    it runs wait for it and get the same result or exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._executed = 0
+        self._coalesced = 0
+
+    def do(self, key, func):
+        """
+        :type key: collections.Hashable
+        :type func: callable
+        :rtype: object
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._executed += 1
+            else:
+                self._coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = func()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value
+
+    @property
+    def stats(self):
+        """Calls executed, calls that joined one in flight, and in flight.
+
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return {'executed': self._executed,
+                    'coalesced': self._coalesced,
+                    'in_flight': len(self._calls)}
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Run Adama services locally, to profile them before registering them.
+
+::
+
+    service = LocalService('path/to/service')
+    invocation = service.run({'q': 'AT1G01010'})
+    invocation.results, invocation.wall, invocation.cpu, invocation.max_rss
+
+    invocations = list(service.map(arg_sets, processes=4))
+    summary(invocations)
+"""
+import os
+import sys
+import time
+import traceback
+
+import six
+
+from .adamalib import Adama, APIException, service_metadata
+from .instrumentation import QUANTILES, quantile, timer
+from .stream import DocumentParser
+
+
+FUNCTIONS = ('search', 'main')  # entry points tried, in order
+cpu_timer = getattr(time, 'process_time', lambda: sum(os.times()[:2]))
+
+
+def max_rss():
+    """Peak resident memory of this process in bytes, ``None`` if unknown.
+
+    :rtype: int|None
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def load_module(path, name):
+    """Import the source file at ``path`` as a module called ``name``.
+
+    The directory of the file is added to ``sys.path`` while it is
+    imported, so that it can import its neighbours.
+
+    :type path: str
+    :type name: str
+    :rtype: module
+    """
+    saved = list(sys.path)
+    sys.path.insert(0, os.path.dirname(path))
+    try:
+        if six.PY3:
+            import importlib.util
+            spec = importlib.util.spec_from_file_location(name, path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[name] = module
+            spec.loader.exec_module(module)
+            return module
+        import imp
+        return imp.load_source(name, path)
+    finally:
+        sys.path[:] = saved
+
+
+class Invocation(object):
+    """Outcome of one call of a service.
+
+    ``wall`` and ``cpu`` are in seconds. ``max_rss`` is the peak resident
+    memory of the process that ran the call, and ``peak_memory`` the peak
+    of Python allocations during the call when memory was traced, both in
+    bytes. ``error`` is the formatted traceback of a failed call.
+    """
+
+    def __init__(self, args, results=None, documents=0, wall=0.0, cpu=0.0,
+                 max_rss=None, peak_memory=None, error=None, pid=None):
+        self.args = args
+        self.results = results
+        self.documents = documents
+        self.wall = wall
+        self.cpu = cpu
+        self.max_rss = max_rss
+        self.peak_memory = peak_memory
+        self.error = error
+        self.pid = pid
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def as_dict(self):
+        """
+        :rtype: dict
+        """
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return 'Invocation({!r}, {} documents, {:.3f}s{})'.format(
+            self.args, self.documents, self.wall,
+            '' if self.ok else ', failed')
+
+
+class _Output(object):
+    """Stand-in for ``sys.stdout`` feeding a ``DocumentParser``."""
+
+    def __init__(self, on_document):
+        self._parser = DocumentParser()
+        self._on_document = on_document
+
+    def write(self, text):
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        for document in self._parser.feed(text):
+            self._on_document(document)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        for document in self._parser.close():
+            self._on_document(document)
+
+
+class LocalService(object):
+    """Service found from a directory, called in this or worker processes.
+
+    The service is located as by ``Services.add``: the ``metadata.yml`` of
+    ``directory`` names its ``main_module``, which is imported on the
+    first call. ``function`` is called with the arguments of each call and
+    ``adama``, and prints JSON documents separated by ``---`` lines; by
+    default it is ``search``, or ``main`` as created by ``Utils.create``.
+    """
+
+    def __init__(self, directory, function=None, adama=None):
+        """
+        :type directory: str
+        :type function: str
+        :type adama: adamalib.Adama
+        :rtype: None
+        """
+        _, metadata, md_dict = service_metadata(os.path.abspath(directory))
+        self.directory = os.path.dirname(metadata)
+        self.metadata = md_dict
+        self.name = md_dict['name']
+        self.type = md_dict['type']
+        self.main_module = os.path.join(self.directory,
+                                        md_dict['main_module'])
+        self.function = function
+        self.adama = adama
+        self._callable = None
+
+    def __repr__(self):
+        return 'LocalService({}, {})'.format(self.name, self.main_module)
+
+    def load(self):
+        """Import the main module and return the service function.
+
+        :rtype: callable
+        """
+        if self._callable is None:
+            module = load_module(self.main_module, 'adama_service_{}'.format(
+                self.name))
+            names = [self.function] if self.function else FUNCTIONS
+            for name in names:
+                if callable(getattr(module, name, None)):
+                    self._callable = getattr(module, name)
+                    break
+            else:
+                raise APIException('{} defines none of: {}'.format(
+                    self.main_module, ', '.join(names)))
+        return self._callable
+
+    def run(self, args, trace_memory=False, keep_results=True,
+            on_document=None):
+        """Call the service once in this process.
+
+        Output is parsed while the service prints it, and every document
+        is passed to ``on_document``. With ``trace_memory`` the peak of
+        Python allocations is measured too, which slows the call down.
+
+        :type args: dict
+        :type trace_memory: bool
+        :type keep_results: bool
+        :type on_document: callable
+        :rtype: Invocation
+        """
+        function = self.load()
+        invocation = Invocation(args, [] if keep_results else None,
+                                pid=os.getpid())
+
+        def collect(document):
+            invocation.documents += 1
+            if keep_results:
+                invocation.results.append(document)
+            if on_document is not None:
+                on_document(document)
+
+        tracemalloc = _start_tracing() if trace_memory else None
+        output = _Output(collect)
+        stdout, sys.stdout = sys.stdout, output
+        start, start_cpu = timer(), cpu_timer()
+        try:
+            function(args, self.adama)
+            output.close()
+        except Exception:
+            invocation.error = traceback.format_exc()
+        finally:
+            sys.stdout = stdout
+            invocation.wall = timer() - start
+            invocation.cpu = cpu_timer() - start_cpu
+            if tracemalloc is not None:
+                invocation.peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            invocation.max_rss = max_rss()
+        return invocation
+
+    def map(self, arg_sets, processes=None, ordered=True, **kwargs):
+        """Call the service once per element of ``arg_sets``, in parallel.
+
+        Calls run in a pool of ``processes`` worker processes (one per CPU
+        by default), which import the service once. Workers get a client
+        of their own for the url and token of ``adama``, not a copy of its
+        caches and connections. The other arguments are those of ``run``;
+        results and invocations are sent back from the workers, so they
+        must be picklable.
+
+        :type arg_sets: collections.Iterable[dict]
+        :type processes: int
+        :type ordered: bool
+        :rtype: collections.Iterator[Invocation]
+        """
+        import multiprocessing
+        client = (None if self.adama is None else
+                  (self.adama.url, self.adama.token, self.adama.verify))
+        pool = multiprocessing.Pool(
+            processes, _start_worker,
+            (self.directory, self.function, client))
+        try:
+            calls = ((args, kwargs) for args in arg_sets)
+            if ordered:
+                invocations = pool.imap(_run_in_worker, calls)
+            else:
+                invocations = pool.imap_unordered(_run_in_worker, calls)
+            for invocation in invocations:
+                yield invocation
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+def _start_tracing():
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    tracemalloc.start()
+    return tracemalloc
+
+
+_worker_service = None
+
+
+def _start_worker(directory, function, client):
+    global _worker_service
+    adama = None if client is None else Adama(*client)
+    _worker_service = LocalService(directory, function, adama)
+    _worker_service.load()
+
+
+def _run_in_worker(call):
+    args, kwargs = call
+    return _worker_service.run(args, **kwargs)
+
+
+def summary(invocations):
+    """Latency percentiles, CPU time and memory of many invocations.
+
+    :type invocations: list[Invocation]
+    :rtype: dict
+    """
+    walls = [invocation.wall for invocation in invocations]
+    result = {'count': len(invocations),
+              'errors': sum(1 for invocation in invocations
+                            if not invocation.ok),
+              'documents': sum(invocation.documents
+                               for invocation in invocations),
+              'wall': sum(walls),
+              'cpu': sum(invocation.cpu for invocation in invocations),
+              'max_rss': max([invocation.max_rss or 0
+                              for invocation in invocations] or [0])}
+    for q in QUANTILES:
+        result['p{}'.format(q)] = quantile(walls, q)
+    return result
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import re
+
+
+WHITESPACE = re.compile(r'\s*')
+DELIMITERS = frozenset(' \t\r\n,:]}')
+
+
+class ResultParser(object):
+    """Incremental parser for Adama response envelopes.
+
+    Text fed to the parser is scanned as the top level JSON object of a
+    response such as ``{"result": [...], "status": "success"}``. Elements
+    of the ``result`` array are returned by ``feed`` as soon as they are
+    complete; every other member is kept in ``fields``. Only the unparsed
+    tail of the input is buffered.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._state = 'start'
+        self._key = None
+
+    def feed(self, text):
+        """
+        :type text: str
+        :rtype: list
+        """
+        self._buf += text
+        records = []
+        pos = 0
+        while True:
+            step = self._step(pos, records)
+            if step is None:
+                break
+            pos = step
+        self._buf = self._buf[pos:]
+        return records
+
+    def close(self):
+        """Check that the whole envelope was received.
+
+        :rtype: None
+        """
+        if self._state != 'done' or self._buf.strip():
+            raise ValueError('incomplete or invalid JSON response')
+
+    def _skip(self, pos):
+        return WHITESPACE.match(self._buf, pos).end()
+
+    def _char(self, pos):
+        pos = self._skip(pos)
+        if pos >= len(self._buf):
+            return pos, None
+        return pos, self._buf[pos]
+
+    def _value(self, pos):
+        # a value is only complete when a delimiter follows it: numbers
+        # cut at a chunk boundary would otherwise parse
+        try:
+            value, end = self._decoder.raw_decode(self._buf, pos)
+        except ValueError:
+            return None, None
+        if end >= len(self._buf) or self._buf[end] not in DELIMITERS:
+            return None, None
+        return value, end
+
+    def _expect(self, pos, char):
+        if self._buf[pos] != char:
+            raise ValueError('unexpected {!r} in JSON response at {}'
+                             .format(self._buf[pos], pos))
+        return pos + 1
+
+    def _step(self, pos, records):
+        pos, char = self._char(pos)
+        if char is None:
+            return None
+        state = self._state
+        if state == 'start':
+            self._state = 'key'
+            return self._expect(pos, '{')
+        if state == 'key':
+            if char == '}':
+                self._state = 'done'
+                return pos + 1
+            key, end = self._value(pos)
+            if end is None:
+                return None
+            self._key = key
+            self._state = 'colon'
+            return end
+        if state == 'colon':
+            self._state = 'value'
+            return self._expect(pos, ':')
+        if state == 'value':
+            if self._key == 'result' and char == '[':
+                self._state = 'item'
+                return pos + 1
+            value, end = self._value(pos)
+            if end is None:
+                return None
+            self.fields[self._key] = value
+            self._state = 'next'
+            return end
+        if state == 'item':
+            if char == ']':
+                self._state = 'next'
+                return pos + 1
+            value, end = self._value(pos)
+            if end is None:
+                return None
+            records.append(value)
+            self._state = 'item-next'
+            return end
+        if state == 'item-next':
+            self._state = 'next' if char == ']' else 'item'
+            if char == ']':
+                return pos + 1
+            return self._expect(pos, ',')
+        if state == 'next':
+            if char == '}':
+                self._state = 'done'
+                return pos + 1
+            self._state = 'key'
+            return self._expect(pos, ',')
+        raise ValueError('trailing data in JSON response')
+
+
+class DocumentParser(object):
+    """Incremental parser for the output of an Adama service.
+
+    Services print JSON documents separated by lines containing only
+    ``---``. Documents are decoded and returned by ``feed`` as soon as
+    their separator arrives; only the current document is buffered.
+    """
+
+    def __init__(self, loads=json.loads):
+        """
+        :type loads: callable
+        :rtype: None
+        """
+        self._loads = loads
+        self._line = ''
+        self._lines = []
+
+    def feed(self, text):
+        """
+        :type text: str
+        :rtype: list
+        """
+        documents = []
+        lines = (self._line + text).split('\n')
+        self._line = lines.pop()
+        for line in lines:
+            if line.strip() == '---':
+                self._flush(documents)
+            else:
+                self._lines.append(line)
+        return documents
+
+    def close(self):
+        """Decode the last document, which has no separator.
+
+        :rtype: list
+        """
+        documents = []
+        self._lines.append(self._line)
+        self._line = ''
+        self._flush(documents)
+        return documents
+
+    def _flush(self, documents):
+        text = '\n'.join(self._lines)
+        self._lines = []
+        if text.strip():
+            documents.append(self._loads(text))
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import array
+import collections
+import numbers
+
+import six
+
+
+SCHEMA_SAMPLE = 1000  # records inspected to infer a schema
+NUMERIC = ('bool', 'int', 'float')
+ARRAY_TYPECODES = {'bool': 'b', 'int': 'q' if six.PY3 else 'l', 'float': 'd'}
+NUMPY_DTYPES = {'bool': 'bool', 'int': 'int64', 'float': 'float64'}
+WIDER = {'bool': 'int', 'int': 'float', 'float': 'object', 'str': 'object'}
+
+_UNLOADED = object()
+numpy = _UNLOADED
+
+
+def load_numpy():
+    """NumPy, imported on first use, or ``None`` if it is not installed.
+
+    :rtype: module|None
+    """
+    global numpy
+    if numpy is _UNLOADED:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+    return numpy
+
+
+def value_type(value):
+    """Column type of a single JSON value, ``None`` for nulls.
+
+    :type value: object
+    :rtype: str|None
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, six.integer_types):
+        return 'int'
+    if isinstance(value, numbers.Real):
+        return 'float'
+    if isinstance(value, six.string_types):
+        return 'str'
+    return 'object'
+
+
+def merge_types(first, second):
+    """Narrowest column type that holds values of both types.
+
+    :type first: str|None
+    :type second: str|None
+    :rtype: str|None
+    """
+    if first is None or first == second:
+        return second
+    if second is None:
+        return first
+    if first in NUMERIC and second in NUMERIC:
+        return max(first, second, key=NUMERIC.index)
+    return 'object'
+
+
+def infer_schema(records, schema=None, sample=SCHEMA_SAMPLE):
+    """Column types of ``records``, extending an existing ``schema``.
+
+    Only the first ``sample`` records are inspected. Integer columns with
+    missing values become ``float`` columns, so that they can hold NaN,
+    and boolean columns with missing values become ``object`` columns.
+
+    :type records: list[dict]
+    :type schema: collections.OrderedDict
+    :type sample: int
+    :rtype: collections.OrderedDict
+    """
+    types = collections.OrderedDict(schema or ())
+    nullable = set()
+    for index, record in enumerate(records[:sample]):
+        for name in types:
+            if record.get(name) is None:
+                nullable.add(name)
+        for name, value in six.iteritems(record):
+            if name not in types:
+                types[name] = None
+                if index or schema:
+                    nullable.add(name)
+            types[name] = merge_types(types[name], value_type(value))
+    for name, typ in types.items():
+        if typ is None:
+            types[name] = 'object'
+        elif name in nullable and typ in ('bool', 'int'):
+            types[name] = 'float' if typ == 'int' else 'object'
+    return types
+
+
+def column(records, name, typ):
+    """Array of the ``name`` values of ``records``.
+
+    Numeric columns are NumPy arrays, or ``array.array`` without NumPy;
+    other columns are object arrays, or lists. Raises ``TypeError`` or
+    ``ValueError`` when a value does not fit ``typ``.
+
+    :type records: list[dict]
+    :type name: str
+    :type typ: str
+    :rtype: numpy.ndarray|array.array|list
+    """
+    np = load_numpy()
+    if typ == 'float':
+        values = (_float(record.get(name)) for record in records)
+    elif typ in NUMERIC:
+        values = (_exact(record[name], typ) for record in records)
+    elif np is not None:
+        result = np.empty(len(records), dtype=object)
+        result[:] = [record.get(name) for record in records]
+        return result
+    else:
+        return [record.get(name) for record in records]
+    if np is not None:
+        return np.fromiter(values, dtype=NUMPY_DTYPES[typ],
+                           count=len(records))
+    return array.array(ARRAY_TYPECODES[typ], values)
+
+
+def _float(value):
+    if value is None:
+        return float('nan')
+    if isinstance(value, (bool,) + six.string_types):
+        raise TypeError('not a number: {!r}'.format(value))
+    return value
+
+
+def _exact(value, typ):
+    if NUMERIC.index(value_type(value) or 'object') > NUMERIC.index(typ):
+        raise TypeError('not a {}: {!r}'.format(typ, value))
+    return value
+
+
+class Table(object):
+    """Query results stored as one typed array per field.
+
+    Numeric fields are NumPy arrays (``array.array`` when NumPy is not
+    installed), strings and nested values are object arrays (lists).
+    Missing numbers are NaN in ``float`` columns and ``None`` elsewhere.
+    """
+
+    def __init__(self, columns, schema, length, prov_url, adama):
+        """
+        :type columns: collections.OrderedDict
+        :type schema: collections.OrderedDict
+        :type length: int
+        :type prov_url: str
+        :type adama: adamalib.Adama
+        :rtype: None
+        """
+        self.columns = columns
+        self.schema = schema
+        self.prov_url = prov_url
+        self.adama = adama
+        self._length = length
+
+    @classmethod
+    def from_records(cls, records, prov_url, adama, schema=None):
+        """Build a table from decoded records.
+
+        ``schema`` is extended with the fields of the records and widened
+        for values that do not fit it; the schema actually used is in
+        ``table.schema``.
+
+        :type records: list[dict]
+        :type prov_url: str
+        :type adama: adamalib.Adama
+        :type schema: collections.OrderedDict
+        :rtype: Table
+        """
+        schema = infer_schema(records, schema)
+        columns = collections.OrderedDict()
+        for name, typ in list(schema.items()):
+            while True:
+                try:
+                    columns[name] = column(records, name, typ)
+                    break
+                except (TypeError, ValueError, KeyError, OverflowError):
+                    typ = schema[name] = WIDER[typ]
+        return cls(columns, schema, len(records), prov_url, adama)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, name):
+        """
+        :type name: str
+        :rtype: numpy.ndarray|array.array|list
+        """
+        return self.columns[name]
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def rows(self):
+        """Iterate over the records as dicts.
+
+        :rtype: collections.Iterator[dict]
+        """
+        names = list(self.columns)
+        for values in zip(*self.columns.values()):
+            yield dict(zip(names, values))
+
+    def prov(self, format='json', filename=None):
+        from .adamalib import ProvList
+        return ProvList([], self.prov_url, self.adama).prov(format, filename)
+
+    def __repr__(self):
+        return 'Table({} rows, {})'.format(
+            len(self), ', '.join('{}: {}'.format(name, typ)
+                                 for name, typ in self.schema.items()))
@@ -0,0 +1,475 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""In-process stand-in for an Adama server, for tests and benchmarks.
+
+::
+
+    with FakeAdama(latency=0.01, records=1000) as fake:
+        fake.add_service('ns', 'srv')
+        adama = Adama(fake.url)
+        adama.ns.srv.search(q='AT1G01010')
+"""
+import email
+import hashlib
+import io
+import itertools
+import json
+import random
+import re
+import tarfile
+import threading
+import time
+import zlib
+
+import six
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qsl, urlparse
+
+
+PROV_LINK = 'http://www.w3.org/ns/prov#has_provenance'
+PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+RECORDS_PER_CHUNK = 100
+
+
+class FakeAdama(object):
+    """Adama API served from a background thread on localhost.
+
+    Every request waits ``latency`` seconds before responding, and fails
+    with a 500 error with probability ``error_rate``. Query endpoints
+    return ``records`` generated records of about ``record_size`` bytes
+    each, unless the service was added with its own ``records`` function.
+    They are paged by the ``limit`` and ``offset`` query parameters.
+    Uploaded services become ready ``register_delay`` seconds after they
+    are posted. With ``compress``, responses are gzip compressed for
+    clients accepting it. Compressed request bodies are always accepted.
+    """
+
+    def __init__(self, latency=0.0, records=10, record_size=100,
+                 error_rate=0.0, register_delay=0.0, seed=0, compress=False):
+        """
+        :type latency: float
+        :type records: int
+        :type record_size: int
+        :type error_rate: float
+        :type register_delay: float
+        :type seed: int
+        :type compress: bool
+        :rtype: None
+        """
+        self.latency = latency
+        self.records = records
+        self.record_size = record_size
+        self.error_rate = error_rate
+        self.register_delay = register_delay
+        self.compress = compress
+        self.requests = []
+        self.namespaces = {}
+        self.services = {}
+        self.provenance = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _Server(self)
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        :rtype: str
+        """
+        return 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+
+    def start(self):
+        """
+        :rtype: FakeAdama
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        :rtype: None
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def add_namespace(self, name, description=''):
+        """
+        :type name: str
+        :type description: str
+        :rtype: dict
+        """
+        with self._lock:
+            return self.namespaces.setdefault(name, {
+                'name': name, 'description': description,
+                'url': None, 'self': '{}/{}'.format(self.url, name)})
+
+    def add_service(self, namespace, name, version='0.1', type='query',
+                    records=None, ready_at=None, error=None, **metadata):
+        """Register a service directly, without uploading code.
+
+        ``records`` is an optional function from the query parameters to
+        the list of records to return, or to the bytes returned by
+        services other than ``query`` and ``map_filter``.
+
+        :type namespace: str
+        :type name: str
+        :type version: str
+        :type type: str
+        :type records: callable
+        :type ready_at: float
+        :type error: str
+        :rtype: dict
+        """
+        self.add_namespace(namespace)
+        info = dict(metadata, name=name, version=str(version), type=type,
+                    namespace=namespace,
+                    self='{}/{}/{}_v{}'.format(self.url, namespace, name,
+                                               version))
+        with self._lock:
+            self.services['{}/{}_v{}'.format(namespace, name, version)] = {
+                'info': info, 'records': records, 'error': error,
+                'ready_at': ready_at or 0}
+        return info
+
+    def generate_records(self, params):
+        """
+        :type params: dict
+        :rtype: list[dict]
+        """
+        return list(self.iter_records(params))
+
+    def iter_records(self, params):
+        """Generate the default records lazily, as the server streams them.
+
+        :type params: dict
+        :rtype: collections.Iterator[dict]
+        """
+        count = int(params.get('records', self.records))
+        padding = 'x' * max(self.record_size - 60, 0)
+        for i in range(count):
+            yield {'locus': 'AT1G{:05d}'.format(i), 'start': i * 1000,
+                   'end': i * 1000 + 500, 'annotation': padding}
+
+    def new_provenance(self, namespace, service, params):
+        """
+        :type namespace: str
+        :type service: str
+        :type params: dict
+        :rtype: str
+        """
+        with self._lock:
+            prov_id = str(len(self.provenance) + 1)
+            self.provenance[prov_id] = {
+                'prefix': {'adama': 'http://adama.example/'},
+                'entity': {
+                    'adama:response_{}'.format(prov_id): {
+                        'adama:query': json.dumps(params, sort_keys=True)},
+                    'adama:{}'.format(service): {}},
+                'wasDerivedFrom': {
+                    '_:d{}'.format(prov_id): {
+                        'prov:generatedEntity':
+                            'adama:response_{}'.format(prov_id),
+                        'prov:usedEntity': 'adama:{}'.format(service)}},
+            }
+        return '{}/prov/{}'.format(self.url, prov_id)
+
+    def _should_fail(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, fake):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.fake = fake
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    _compressor = None  # of the chunked response being sent
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = self._read_chunked()
+        else:
+            body = self.rfile.read(length) if length else b''
+        if self.headers.get('Content-Encoding') in ('gzip', 'deflate'):
+            body = zlib.decompress(body, zlib.MAX_WBITS | 32)
+        parts = [part for part in url.path.split('/') if part]
+        self.fake.requests.append((method, url.path, params))
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        if self.fake._should_fail():
+            return self._json({'status': 'error',
+                               'message': 'injected failure'}, 500)
+        route = getattr(self, '_{}_{}'.format(method.lower(), len(parts)),
+                        None)
+        if route is None:
+            return self._not_found()
+        return route(parts, params, body)
+
+    def _read_chunked(self):
+        body = b''
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            chunk = self.rfile.read(size + 2)[:size]
+            if not size:
+                return body
+            body += chunk
+
+    def _gzip(self):
+        """Compressor for the response, if it is to be compressed.
+
+        :rtype: zlib.Compress|None
+        """
+        if (self.fake.compress and
+                'gzip' in self.headers.get('Accept-Encoding', '')):
+            self.send_header('Content-Encoding', 'gzip')
+            return zlib.compressobj(6, zlib.DEFLATED, 31)
+        return None
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        gzip = self._gzip()
+        if gzip is not None:
+            body = gzip.compress(body) + gzip.flush()
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_range(self, body, content_type):
+        """Send ``body``, or the part of it asked for with ``Range``."""
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if match is None:
+            return self._send(200, body, content_type,
+                              {'Accept-Ranges': 'bytes'})
+        start = int(match.group(1))
+        if start >= len(body):
+            return self._send(416, b'', content_type, {
+                'Content-Range': 'bytes */{}'.format(len(body))})
+        return self._send(206, body[start:], content_type, {
+            'Content-Range': 'bytes {}-{}/{}'.format(
+                start, len(body) - 1, len(body))})
+
+    def _json(self, obj, status=200, headers=None):
+        self._send(status, json.dumps(obj).encode('utf-8'),
+                   'application/json', headers)
+
+    def _cacheable(self, obj):
+        """Send ``obj`` with an ETag, or 304 if the client has it."""
+        body = json.dumps(obj, sort_keys=True).encode('utf-8')
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, b'', 'application/json', {'ETag': etag})
+        self._send(200, body, 'application/json', {'ETag': etag})
+
+    def _success(self, result=None, **extra):
+        extra.update(status='success', message='', result=result)
+        self._json(extra)
+
+    def _not_found(self, message='not found'):
+        self._json({'status': 'error', 'message': message}, 404)
+
+    # /status, /namespaces, /{ns}
+    def _get_1(self, parts, params, body):
+        if parts[0] == 'status':
+            return self._json({'status': 'success', 'api': 'Adama v0.3',
+                               'hash': 'fake'})
+        if parts[0] == 'namespaces':
+            return self._success(sorted(self.fake.namespaces.values(),
+                                        key=lambda ns: ns['name']))
+        namespace = self.fake.namespaces.get(parts[0])
+        if namespace is None:
+            return self._not_found()
+        return self._success(namespace)
+
+    def _post_1(self, parts, params, body):
+        if parts[0] != 'namespaces':
+            return self._not_found()
+        form = dict(parse_qsl(body.decode('utf-8')))
+        self.fake.add_namespace(form['name'], form.get('description', ''))
+        return self._success()
+
+    def _delete_1(self, parts, params, body):
+        with self.fake._lock:
+            self.fake.namespaces.pop(parts[0], None)
+            for key in [key for key in self.fake.services
+                        if key.startswith(parts[0] + '/')]:
+                del self.fake.services[key]
+        return self._success()
+
+    # /{ns}/services, /{ns}/{srv}_v{version}, /prov/{id}
+    def _get_2(self, parts, params, body):
+        if parts[0] == 'prov':
+            return self._prov(parts[1], params)
+        if parts[0] not in self.fake.namespaces:
+            return self._not_found()
+        if parts[1] == 'services':
+            return self._cacheable({
+                'status': 'success', 'message': '', 'result': [
+                    service['info'] for key, service in
+                    sorted(self.fake.services.items())
+                    if key.startswith(parts[0] + '/')]})
+        service = self.fake.services.get('/'.join(parts))
+        if service is None:
+            return self._not_found()
+        if service['error']:
+            return self._success({'slot': 'error', 'msg': service['error']})
+        if time.time() < service['ready_at']:
+            return self._success({'service': None})
+        return self._success({'service': service['info']})
+
+    def _post_2(self, parts, params, body):
+        if parts[1] != 'services' or parts[0] not in self.fake.namespaces:
+            return self._not_found()
+        content_type = self.headers.get('Content-Type', '')
+        message = _parse_multipart(content_type, body)
+        fields = {}
+        for part in message.get_payload():
+            name = part.get_param('name', header='Content-Disposition')
+            fields[name] = part.get_payload(decode=True)
+        try:
+            metadata = _read_metadata(fields['code'],
+                                      fields['metadata'].decode('utf-8'))
+        except (KeyError, tarfile.TarError) as exc:
+            return self._json({'status': 'error', 'message': str(exc)}, 400)
+        self.fake.add_service(
+            parts[0], metadata['name'],
+            version=metadata.get('version', '0.1'),
+            type=metadata.get('type', fields['type'].decode('utf-8')),
+            ready_at=time.time() + self.fake.register_delay)
+        return self._success({'state': 'started'})
+
+    def _delete_2(self, parts, params, body):
+        with self.fake._lock:
+            self.fake.services.pop('/'.join(parts), None)
+        return self._success()
+
+    # /{ns}/{srv}_v{version}/{endpoint}
+    def _get_3(self, parts, params, body):
+        service = self.fake.services.get('/'.join(parts[:2]))
+        if service is None or time.time() < service['ready_at']:
+            return self._not_found()
+        records = (service['records'] or self.fake.iter_records)(params)
+        if 'limit' in params or 'offset' in params:
+            offset = int(params.get('offset', 0))
+            limit = params.get('limit')
+            records = itertools.islice(
+                records, offset, None if limit is None else
+                offset + int(limit))
+        if service['info']['type'] not in ('query', 'map_filter'):
+            if not isinstance(records, bytes):
+                records = json.dumps(list(records)).encode('utf-8')
+            return self._send_range(records, 'application/octet-stream')
+        prov_url = self.fake.new_provenance(parts[0], parts[1], params)
+        self._stream_records(records, {
+            'Link': '<{}>; rel="{}"'.format(prov_url, PROV_LINK)})
+
+    def _prov(self, prov_id, params):
+        document = self.fake.provenance.get(prov_id)
+        if document is None:
+            return self._not_found()
+        fmt = params.get('format', 'json')
+        if fmt in ('json', 'prov'):
+            return self._json(document)
+        if fmt == 'sources':
+            return self._json([{'title': 'fake source'}])
+        if fmt == 'prov-n':
+            return self._send(200, _prov_n(document).encode('utf-8'),
+                              'text/plain; charset=utf-8')
+        if fmt == 'png':
+            return self._send(200, PNG_HEADER + b'\0' * 1024, 'image/png')
+        return self._not_found('unknown format')
+
+    def _stream_records(self, records, headers):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self._compressor = self._gzip()
+        self.end_headers()
+        self._chunk(b'{"result": [')
+        records = iter(records)
+        separator = ''
+        while True:
+            batch = list(itertools.islice(records, RECORDS_PER_CHUNK))
+            if not batch:
+                break
+            text = ', '.join(json.dumps(record) for record in batch)
+            self._chunk((separator + text).encode('utf-8'))
+            separator = ', '
+        self._chunk(b'], "metadata": {"time_in_main": 0.0}, '
+                    b'"status": "success", "message": ""}', final=True)
+        self.wfile.write(b'0\r\n\r\n')
+        self._compressor = None
+
+    def _chunk(self, data, final=False):
+        if self._compressor is not None:
+            data = self._compressor.compress(data) + self._compressor.flush(
+                zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+        self.wfile.write('{:x}\r\n'.format(len(data)).encode('ascii'))
+        self.wfile.write(data + b'\r\n')
+        self.wfile.flush()
+
+
+def _prov_n(document):
+    lines = ['document']
+    for prefix, uri in sorted(document['prefix'].items()):
+        lines.append('  prefix {} <{}>'.format(prefix, uri))
+    for entity in sorted(document['entity']):
+        lines.append('  entity({})'.format(entity))
+    lines.append('endDocument')
+    return '\n'.join(lines)
+
+
+def _parse_multipart(content_type, body):
+    header = 'Content-Type: {}\r\n\r\n'.format(content_type).encode('ascii')
+    if six.PY3:
+        return email.message_from_bytes(header + body)
+    return email.message_from_string(header + body)
+
+
+def _read_metadata(code, directory):
+    import yaml
+    name = '/'.join(part for part in ('.', directory, 'metadata.yml')
+                    if part)
+    with tarfile.open(fileobj=io.BytesIO(code)) as tar:
+        return yaml.safe_load(tar.extractfile(name).read())
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connectionpool import (HTTPConnectionPool,
+                                                      HTTPSConnectionPool)
+from requests.packages.urllib3.response import HTTPResponse
+from requests.packages.urllib3.util.retry import Retry
+
+from .compression import MIN_COMPRESSED_BODY, accept_encoding, compress_body
+
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+RETRY_STATUSES = (502, 503, 504)
+BODY_METHODS = ('POST', 'PUT', 'PATCH')
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class Transport(object):
+    """Pooled, keep-alive HTTP transport shared by every request of a client.
+
+    ``pool_connections`` is the number of hosts whose pools are kept,
+    ``pool_maxsize`` the number of connections kept per host, and
+    ``pool_block`` makes ``pool_maxsize`` a hard per-host limit.
+    Idempotent requests are retried up to ``max_retries`` times with
+    exponential ``backoff_factor``. Pooled connections idle for longer than
+    ``keepalive_timeout`` seconds are discarded before the next request.
+
+    Responses are requested with the content codings of
+    ``accept_encoding`` (every coding the client can decode by default,
+    ``'identity'`` to disable compression) and decoded while they are
+    read. With ``request_encoding``, request bodies of at least
+    ``compress_min_size`` bytes are compressed with that coding; the
+    server must accept compressed requests.
+    """
+
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=False,
+                 max_retries=0, backoff_factor=0.0,
+                 keepalive_timeout=None, timeout=None, accept_encoding=None,
+                 request_encoding=None, compress_min_size=MIN_COMPRESSED_BODY):
+        """
+        :type pool_connections: int
+        :type pool_maxsize: int
+        :type pool_block: bool
+        :type max_retries: int
+        :type backoff_factor: float
+        :type keepalive_timeout: float
+        :type timeout: float|(float, float)
+        :type accept_encoding: str
+        :type request_encoding: str
+        :type compress_min_size: int
+        :rtype: None
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.accept_encoding = accept_encoding
+        self.request_encoding = request_encoding
+        self.compress_min_size = compress_min_size
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._requests = 0
+        self._opened = 0
+        self._last_used = None
+        self._session = None
+
+    @property
+    def session(self):
+        """
+        :rtype: requests.Session
+        """
+        with self._lock:
+            if self._session is None:
+                self._session = self._new_session()
+            return self._session
+
+    def _new_session(self):
+        if self.max_retries:
+            retries = Retry(total=self.max_retries,
+                            backoff_factor=self.backoff_factor,
+                            status_forcelist=RETRY_STATUSES,
+                            raise_on_status=False)
+        else:
+            retries = Retry(0, read=False)
+        adapter = _CountingAdapter(
+            self._connection_opened,
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+            max_retries=retries)
+        session = requests.Session()
+        session.headers['Accept-Encoding'] = (
+            self.accept_encoding if self.accept_encoding is not None
+            else accept_encoding())
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _connection_opened(self, elapsed):
+        with self._lock:
+            self._opened += 1
+        self._local.connect_time = self.connect_time + elapsed
+
+    @property
+    def connect_time(self):
+        """Seconds spent opening connections by the current thread.
+
+        :rtype: float
+        """
+        return getattr(self._local, 'connect_time', 0.0)
+
+    def pop_connect_time(self):
+        """Return ``connect_time`` and reset it.
+
+        :rtype: float
+        """
+        elapsed = self.connect_time
+        self._local.connect_time = 0.0
+        return elapsed
+
+    def _expire_idle(self, session):
+        now = time.time()
+        with self._lock:
+            idle = (self.keepalive_timeout is not None and
+                    self._last_used is not None and
+                    now - self._last_used > self.keepalive_timeout)
+            self._last_used = now
+            self._requests += 1
+        if idle:
+            for adapter in set(session.adapters.values()):
+                adapter.poolmanager.clear()
+
+    def request(self, method, url, **kwargs):
+        """
+        :type method: str
+        :type url: str
+        :type kwargs: dict[str, object]
+        :rtype: requests.Response
+        """
+        session = self.session
+        self._expire_idle(session)
+        kwargs.setdefault('timeout', self.timeout)
+        if self.request_encoding and method.upper() in BODY_METHODS:
+            compress_body(kwargs, self.request_encoding,
+                          self.compress_min_size)
+        return session.request(method.upper(), url, **kwargs)
+
+    @property
+    def stats(self):
+        """Counters of requests sent and connections opened or reused.
+
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return {'requests': self._requests,
+                    'opened': self._opened,
+                    'reused': max(self._requests - self._opened, 0)}
+
+    def close(self):
+        """
+        :rtype: None
+        """
+        with self._lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+
+class _CountingAdapter(HTTPAdapter):
+
+    def __init__(self, on_connect, **kwargs):
+        self._on_connect = on_connect
+        super(_CountingAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(_CountingAdapter, self).init_poolmanager(*args, **kwargs)
+        on_connect = self._on_connect
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool(HTTPConnectionPool, on_connect),
+            'https': _counting_pool(HTTPSConnectionPool, on_connect)}
+
+
+def _counting_pool(base, on_connect):
+
+    class TimedConnection(base.ConnectionCls):
+
+        def connect(self):
+            start = timer()
+            super(TimedConnection, self).connect()
+            on_connect(timer() - start)
+
+    class CountingPool(base):
+        ConnectionCls = TimedConnection
+        ResponseCls = _CountingResponse
+
+    return CountingPool
+
+
+class _CountingResponse(HTTPResponse):
+    """Response counting the body bytes received, before decoding.
+
+    ``tell()`` does not count chunked bodies on every urllib3 version.
+    """
+
+    wire_bytes = 0
+
+    def _decode(self, data, *args, **kwargs):
+        self.wire_bytes += len(data)
+        return super(_CountingResponse, self)._decode(data, *args, **kwargs)
@@ -0,0 +1,502 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Client benchmarks against the in-process ``FakeAdama`` server.
+
+Run from the repository root::
+
+    python benchmarks/bench_client.py
+    python benchmarks/bench_client.py --only map stream --json out.json
+
+Every benchmark uses a fixed seed and fixed sizes, so runs on the same
+machine are comparable.
+"""
+from __future__ import division, print_function
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import adamalib  # noqa: E402
+from adamalib.adamalib import ProvList  # noqa: E402
+from adamalib.instrumentation import quantile  # noqa: E402
+from adamalib.testing import FakeAdama  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+timer = getattr(time, 'perf_counter', time.time)
+
+BENCHMARKS = []
+
+
+def benchmark(fun):
+    BENCHMARKS.append(fun)
+    return fun
+
+
+def summary(samples, elapsed=None, **extra):
+    """Latency percentiles (ms) and throughput (calls/s) of ``samples``."""
+    elapsed = sum(samples) if elapsed is None else elapsed
+    result = {'calls': len(samples),
+              'p50_ms': quantile(samples, 50) * 1000,
+              'p95_ms': quantile(samples, 95) * 1000,
+              'p99_ms': quantile(samples, 99) * 1000,
+              'throughput': len(samples) / elapsed if elapsed else 0}
+    result.update(extra)
+    return result
+
+
+def timed(fun, *args, **kwargs):
+    start = timer()
+    value = fun(*args, **kwargs)
+    return timer() - start, value
+
+
+def peak_memory(fun):
+    """Peak bytes allocated by Python while running ``fun``."""
+    if tracemalloc is None:
+        fun()
+        return None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fun()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+HEAVY_MODULES = ('prov', 'yaml', 'tarfile', 'gzip', 'numpy', 'IPython')
+
+
+@benchmark
+def import_time(runs=10):
+    """Cold ``import adamalib`` in a fresh interpreter, against requests."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = ('import sys, time; start = time.time(); import {}; '
+            'print(time.time() - start); '
+            'print(" ".join(m for m in {!r} if m in sys.modules))')
+
+    def measure(module):
+        samples = []
+        for _ in range(runs):
+            output = subprocess.check_output(
+                [sys.executable, '-c', code.format(module, HEAVY_MODULES)],
+                cwd=root).decode('ascii').splitlines()
+            samples.append(float(output[0]))
+        return quantile(samples, 50), ' '.join(output[1:]).split()
+
+    adamalib_s, heavy = measure('adamalib')
+    requests_s, _ = measure('requests')
+    return {'adamalib_s': adamalib_s, 'requests_s': requests_s,
+            'heavy_modules_loaded': heavy}
+
+
+@benchmark
+def single(calls=200):
+    """Sequential endpoint calls on one client."""
+    with FakeAdama(records=10) as fake:
+        fake.add_service('ns', 'srv')
+        with adamalib.Adama(fake.url) as adama:
+            endpoint = adama.ns.srv.search
+            endpoint(q='warmup')
+            samples = [timed(endpoint, q=i)[0] for i in range(calls)]
+            return summary(samples, connections=adama.transport.stats)
+
+
+@benchmark
+def instrumentation(calls=200):
+    """Overhead of request instrumentation on sequential calls."""
+    results = {}
+    with FakeAdama(records=10) as fake:
+        fake.add_service('ns', 'srv')
+        for name, hooks in (('disabled', None),
+                            ('enabled', adamalib.Instrumentation())):
+            with adamalib.Adama(fake.url, instrumentation=hooks) as adama:
+                endpoint = adama.ns.srv.search
+                endpoint(q='warmup')
+                samples = [timed(endpoint, q=i)[0] for i in range(calls)]
+                results[name] = summary(samples)
+    return results
+
+
+@benchmark
+def map(calls=64, latency=0.02, levels=(1, 2, 4, 8, 16)):
+    """Endpoint.map throughput against a server with fixed latency."""
+    results = {}
+    with FakeAdama(records=10, latency=latency) as fake:
+        fake.add_service('ns', 'srv')
+        for concurrency in levels:
+            transport = adamalib.Transport(pool_maxsize=concurrency)
+            with adamalib.Adama(fake.url, transport=transport) as adama:
+                endpoint = adama.ns.srv.search
+                elapsed, _ = timed(lambda: list(endpoint.map(
+                    ({'q': i} for i in range(calls)),
+                    concurrency=concurrency)))
+                results[concurrency] = {
+                    'throughput': calls / elapsed,
+                    'speedup': None}
+        base = results[levels[0]]['throughput']
+        for level in levels:
+            results[level]['speedup'] = results[level]['throughput'] / base
+    return results
+
+
+@benchmark
+def prepared(calls=50, latency=0.01):
+    """Calls through fresh navigation objects versus a prepared handle."""
+    with FakeAdama(latency=latency, records=10) as fake:
+        fake.add_service('ns', 'srv')
+        results = {}
+        for name in ('navigation', 'prepared'):
+            adama = adamalib.Adama(fake.url, metadata_cache=adamalib.TTLCache(
+                maxsize=0))
+            handle = adama.prepare('ns', 'srv', '0.1', 'search')
+            del fake.requests[:]
+            if name == 'navigation':
+                samples = [timed(lambda: adama.ns.srv.search(q=i))[0]
+                           for i in range(calls)]
+            else:
+                samples = [timed(handle, q=i)[0] for i in range(calls)]
+            results[name] = dict(summary(samples),
+                                 requests=len(fake.requests))
+        return results
+
+
+@benchmark
+def stream(records=50000):
+    """Time to first record and peak memory, buffered versus streamed."""
+    with FakeAdama(records=records) as fake:
+        fake.add_service('ns', 'srv')
+        adama = adamalib.Adama(fake.url)
+        endpoint = adama.ns.srv.search
+        endpoint(records=1)
+        results = {}
+
+        def buffered():
+            start = timer()
+            result = endpoint()
+            results['buffered'] = {'first_record_s': timer() - start,
+                                   'records': len(result)}
+
+        def streamed():
+            start = timer()
+            first = None
+            count = 0
+            for _ in endpoint.stream():
+                if first is None:
+                    first = timer() - start
+                count += 1
+            results['streamed'] = {'first_record_s': first,
+                                   'records': count}
+
+        for name, fun in (('buffered', buffered), ('streamed', streamed)):
+            elapsed, memory = timed(peak_memory, fun)
+            results[name].update(total_s=elapsed, peak_bytes=memory)
+        return results
+
+
+def retained_memory(fun):
+    """Bytes still allocated by Python for the value returned by ``fun``."""
+    if tracemalloc is None:
+        return None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        value = fun()
+        gc.collect()
+        current = tracemalloc.get_traced_memory()[0]
+        del value
+        return current
+    finally:
+        tracemalloc.stop()
+
+
+@benchmark
+def compression(records=20000, calls=10):
+    """Query latency and bytes received with and without gzip."""
+    results = {}
+    with FakeAdama(records=records, compress=True) as fake:
+        fake.add_service('ns', 'srv')
+        for name, encoding in (('identity', 'identity'), ('gzip', None)):
+            instrumentation = adamalib.Instrumentation()
+            adama = adamalib.Adama(
+                fake.url, instrumentation=instrumentation,
+                transport=adamalib.Transport(accept_encoding=encoding))
+            samples = [timed(adama.ns.srv.search, q=i)[0]
+                       for i in range(calls)]
+            route = instrumentation.stats.summary()['/{ns}/{srv}/{endpoint}']
+            results[name] = dict(summary(samples),
+                                 bytes=route['bytes'] // calls,
+                                 wire_bytes=route['wire_bytes'] // calls)
+    return results
+
+
+@benchmark
+def download(size=32 * 1024 * 1024):
+    """Buffered passthrough call versus a streamed download to disk."""
+    payload = os.urandom(size)
+    root = tempfile.mkdtemp()
+    try:
+        with FakeAdama() as fake:
+            fake.add_service('ns', 'files', type='passthrough',
+                             records=lambda params: payload)
+            endpoint = adamalib.Adama(fake.url).ns.files.get
+            target = os.path.join(root, 'payload.bin')
+
+            def buffered():
+                with open(target, 'wb') as out:
+                    out.write(endpoint().content)
+
+            results = {}
+            for name, fun in (('buffered', buffered),
+                              ('download', lambda: endpoint.download(
+                                  target, resume=False))):
+                elapsed, _ = timed(fun)
+                results[name] = {'total_s': elapsed,
+                                 'mb_per_s': size / elapsed / 1e6,
+                                 'peak_bytes': peak_memory(fun)}
+            return results
+    finally:
+        shutil.rmtree(root)
+
+
+@benchmark
+def columns(records=50000):
+    """Memory per row and conversion time, list of dicts versus Table."""
+    with FakeAdama(records=records) as fake:
+        fake.add_service('ns', 'srv')
+        adama = adamalib.Adama(fake.url)
+        endpoint = adama.ns.srv.search
+        rows = endpoint()
+        convert, table = timed(rows.to_columns)
+        results = {'numpy': adamalib.table.load_numpy() is not None,
+                   'schema': dict(table.schema),
+                   'to_columns_s': convert}
+        for name, call in (('list', endpoint), ('table', endpoint.table)):
+            elapsed, _ = timed(call)
+            memory = retained_memory(call)
+            results[name] = {
+                'total_s': elapsed,
+                'bytes_per_row': memory / records if memory else None}
+        return results
+
+
+@benchmark
+def decoding(records=50000):
+    """JSON decoding of a large response, requests versus Decoder."""
+    from adamalib.decoding import Decoder
+    with FakeAdama(records=records) as fake:
+        fake.add_service('ns', 'srv')
+        adama = adamalib.Adama(fake.url)
+        response = adama.get('/ns/srv_v0.1/search')
+        results = {}
+        decoders = [('requests', response.json)]
+        for label, decoder in (('stdlib', Decoder(backends=())),
+                               ('installed', Decoder())):
+            label += '_' + decoder.name
+            decoders.append((label, lambda d=decoder: d.loads(
+                response.content)))
+            decoders.append((label + '_envelope',
+                             lambda d=decoder: d.envelope(response.content)))
+        for name, fun in decoders:
+            results[name] = summary([timed(fun)[0] for _ in range(5)])
+        return results
+
+
+@benchmark
+def paging(records=2000, page_size=200, latency=0.02, work=0.02):
+    """Paged iteration with and without prefetch, with per-page work."""
+    results = {}
+    with FakeAdama(records=records, latency=latency) as fake:
+        fake.add_service('ns', 'srv')
+        adama = adamalib.Adama(fake.url)
+        endpoint = adama.ns.srv.search
+        endpoint()
+        for prefetch in (False, True):
+            def consume():
+                for _ in endpoint.pages(page_size, prefetch).iter_pages():
+                    time.sleep(work)
+            results['prefetch' if prefetch else 'sequential'] = {
+                'total_s': timed(consume)[0]}
+    return results
+
+
+@benchmark
+def catalog(namespaces=10, services=10, latency=0.01):
+    """Catalog discovery by navigation versus a catalog snapshot."""
+    with FakeAdama(latency=latency) as fake:
+        for i in range(namespaces):
+            for j in range(services):
+                fake.add_service('ns{}'.format(i), 'srv{}'.format(j))
+
+        def navigate():
+            adama = adamalib.Adama(fake.url)
+            return [srv.type for ns in adama.namespaces
+                    for srv in getattr(adama, ns.namespace).services]
+
+        results = {}
+        for name, fun in (('navigation', navigate),
+                          ('snapshot', lambda: adamalib.Adama(
+                              fake.url).catalog())):
+            del fake.requests[:]
+            elapsed, _ = timed(fun)
+            results[name] = {'total_s': elapsed,
+                             'requests': len(fake.requests)}
+        return results
+
+
+@benchmark
+def state(calls=20, latency=0.02):
+    """First calls of a new client with a cold and a warm state directory."""
+    root = tempfile.mkdtemp()
+    try:
+        with FakeAdama(latency=latency, records=100) as fake:
+            fake.add_service('ns', 'srv')
+
+            def run():
+                with adamalib.Adama(fake.url, state_dir=root) as adama:
+                    for i in range(calls):
+                        adama.ns.srv.search(q=i).prov()
+
+            results = {}
+            for name in ('cold', 'warm'):
+                del fake.requests[:]
+                elapsed, _ = timed(run)
+                results[name] = {'total_s': elapsed,
+                                 'requests': len(fake.requests)}
+            return results
+    finally:
+        shutil.rmtree(root)
+
+
+@benchmark
+def registration(services=3, register_delay=0.2):
+    """Services.add and wait_all against a server with a registration delay."""
+    root = tempfile.mkdtemp()
+    sys_path = list(sys.path)
+    pack_cache_dir = adamalib.packaging.PACK_CACHE_DIR
+    adamalib.packaging.PACK_CACHE_DIR = os.path.join(root, 'packs')
+    try:
+        modules = []
+        for i in range(services):
+            directory = os.path.join(root, 'bench_srv_{}'.format(i))
+            os.makedirs(directory)
+            with open(os.path.join(directory, 'metadata.yml'), 'w') as md:
+                md.write('name: bench_srv_{}\nversion: 0.1\ntype: query\n'
+                         'main_module: main.py\n'.format(i))
+            with open(os.path.join(directory, 'bench_srv_{}.py'.format(i)),
+                      'w') as main:
+                main.write('def main(args, adama):\n    pass\n')
+            subprocess.check_call(['git', 'init', '-q', directory])
+            subprocess.check_call(['git', 'add', '.'], cwd=directory)
+            sys.path.insert(0, directory)
+            modules.append(__import__('bench_srv_{}'.format(i)))
+        with FakeAdama(register_delay=register_delay) as fake:
+            fake.add_namespace('ns')
+            adama = adamalib.Adama(fake.url)
+            services_ = adama.ns.services
+            add = timed(services_.add, modules[0])[0]
+            readd = timed(services_.add, modules[0])[0]
+            start = timer()
+            handles = [services_.add(module, **{'async': True})
+                       for module in modules]
+            adamalib.adamalib.wait_all(handles)
+            together = timer() - start
+            return {'add_s': add, 'add_cached_pack_s': readd,
+                    'wait_all_s': together,
+                    'polls': sum(handle.polls for handle in handles)}
+    finally:
+        sys.path[:] = sys_path
+        adamalib.packaging.PACK_CACHE_DIR = pack_cache_dir
+        for i in range(services):
+            sys.modules.pop('bench_srv_{}'.format(i), None)
+        shutil.rmtree(root)
+
+
+@benchmark
+def discovery(services=20, calls=50, threads=8):
+    """service_metadata from nested directories, against git rev-parse."""
+    from adamalib import discovery as discovery_
+    from adamalib.adamalib import service_metadata
+    from adamalib.parallel import bounded_map
+    root = tempfile.mkdtemp()
+    try:
+        subprocess.check_call(['git', 'init', '-q', root])
+        nested = []
+        for i in range(services):
+            directory = os.path.join(root, 'srv_{}'.format(i))
+            os.makedirs(os.path.join(directory, 'lib', 'deep'))
+            with open(os.path.join(directory, 'metadata.yml'), 'w') as md:
+                md.write('name: srv_{}\nversion: 0.1\ntype: query\n'
+                         'main_module: main.py\n'.format(i))
+            nested.append(os.path.join(directory, 'lib', 'deep'))
+        git = [timed(subprocess.check_output,
+                     ['git', 'rev-parse', '--show-toplevel'],
+                     cwd=directory)[0] for directory in nested]
+        discovery_.clear_caches()
+        cold = [timed(service_metadata, directory)[0]
+                for directory in nested]
+        warm = [timed(service_metadata, nested[i % services])[0]
+                for i in range(calls)]
+        start = timer()
+        outcomes = list(bounded_map(service_metadata,
+                                    nested * (calls // services), threads))
+        concurrent = timer() - start
+        assert all(ok for _, ok, _ in outcomes)
+        return {'git_rev_parse': summary(git), 'cold': summary(cold),
+                'cached': summary(warm), 'threads_total_s': concurrent}
+    finally:
+        shutil.rmtree(root)
+
+
+@benchmark
+def provenance(calls=50):
+    """ProvList.prov cold, memoized, and bulk fetches."""
+    with FakeAdama(records=10) as fake:
+        fake.add_service('ns', 'srv')
+        adama = adamalib.Adama(fake.url)
+        results = [adama.ns.srv.search(q=i) for i in range(calls)]
+        cold = [timed(result.prov, format='prov')[0] for result in results]
+        warm = [timed(result.prov, format='prov')[0] for result in results]
+        fresh = [ProvList([], result.prov_url, adamalib.Adama(fake.url))
+                 for result in results]
+        bulk, _ = timed(fresh[0].adama.bulk_prov, fresh, concurrency=8)
+        return {'cold': summary(cold), 'memoized': summary(warm),
+                'bulk_s': bulk}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', nargs='*', metavar='NAME',
+                        help='benchmarks to run: {}'.format(
+                            ', '.join(fun.__name__ for fun in BENCHMARKS)))
+    parser.add_argument('--json', metavar='PATH',
+                        help='also write the results as JSON')
+    args = parser.parse_args(argv)
+    results = {}
+    for fun in BENCHMARKS:
+        if args.only and fun.__name__ not in args.only:
+            continue
+        results[fun.__name__] = fun()
+        print('{}: {}'.format(fun.__name__, json.dumps(
+            results[fun.__name__], indent=2, sort_keys=True)))
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+    return results
+
+
+if __name__ == '__main__':
+    main()
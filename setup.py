@@ -46,6 +46,7 @@ setup(
     cmdclass={'test': PyTest},
     data_files=[('', ['requirements.txt'])],
     description='Adama Library',
+    extras_require={'async': ['aiohttp'], 'fast-json': ['orjson']},
     download_url='https://github.com/Arabidopsis-Information-Portal/adamalib',
     include_package_data=True,
     install_requires=requires,
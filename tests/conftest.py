@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import sys
+import threading
+
+import pytest
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlparse, parse_qsl
+
+
+if sys.version_info < (3, 5):
+    collect_ignore = ['test_aio.py']
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, method):
+        url = urlparse(self.path)
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = self._read_chunked()
+        else:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+        request = {'method': method, 'path': url.path,
+                   'params': dict(parse_qsl(url.query)),
+                   'headers': dict(self.headers.items()), 'body': body}
+        self.server.requests.append(request)
+        handler = self.server.routes.get((method, url.path))
+        if handler is None:
+            status, headers, payload = 404, {}, {'status': 'error',
+                                                 'message': 'not found'}
+        else:
+            status, headers, payload = handler(request)
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if isinstance(payload, bytes):
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        # any other iterable of bytes is sent with chunked encoding
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for chunk in payload:
+            self.wfile.write('{:x}\r\n'.format(len(chunk)).encode('ascii'))
+            self.wfile.write(chunk + b'\r\n')
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _read_chunked(self):
+        body = b''
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            chunk = self.rfile.read(size + 2)[:size]
+            if not size:
+                return body
+            body += chunk
+
+    def do_GET(self):
+        self._respond('GET')
+
+    def do_POST(self):
+        self._respond('POST')
+
+    def do_DELETE(self):
+        self._respond('DELETE')
+
+
+class StubServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.routes = {}
+        self.requests = []
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def route(self, path, payload, status=200, headers=None, method='GET'):
+        if callable(payload):
+            self.routes[(method, path)] = payload
+        else:
+            self.routes[(method, path)] = (
+                lambda request: (status, headers or {}, payload))
+
+
+@pytest.fixture
+def stub():
+    server = StubServer()
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -8,9 +8,721 @@ test_adamalib
 Tests for `adamalib` module.
 """
 
+import os
+import pickle
+import stat
+import subprocess
+import sys
+import threading
+import time
+
 import pytest
+import requests
+
+import adamalib
 
-from adamalib import adamalib
 
 def test_true():
-    assert True
\ No newline at end of file
+    assert True
+
+
+@pytest.fixture
+def adama(stub):
+    stub.route('/status', {'status': 'success', 'api': 'Adama v0.3'})
+    with adamalib.Adama(stub.url, token='tok') as client:
+        yield client
+
+
+def test_import_does_not_load_optional_dependencies():
+    code = ('import sys, adamalib; print(" ".join(sorted(set(sys.modules) & '
+            '{"prov", "yaml", "tarfile", "gzip", "numpy", "IPython"})))')
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.strip() == b''
+
+
+def test_requests_share_pooled_connection(stub, adama):
+    for _ in range(5):
+        assert adama.status['api'] == 'Adama v0.3'
+    assert adama.transport.stats == {'requests': 5, 'opened': 1,
+                                     'reused': 4}
+    assert stub.requests[0]['headers']['Authorization'] == 'Bearer tok'
+
+
+def test_utils_request_uses_client_pool(stub, adama):
+    stub.route('/prov', {'prov': True})
+    adama.status
+    assert adama.utils.request(stub.url + '/prov').json() == {'prov': True}
+    assert adama.transport.stats['opened'] == 1
+
+
+def test_keepalive_timeout_drops_idle_connections(stub):
+    stub.route('/status', {'status': 'success'})
+    transport = adamalib.Transport(keepalive_timeout=0)
+    with adamalib.Adama(stub.url, transport=transport) as adama:
+        adama.status
+        time.sleep(0.01)
+        adama.status
+    assert transport.stats['opened'] == 2
+
+
+def test_retries_idempotent_requests(stub):
+    calls = []
+
+    def flaky(request):
+        calls.append(request)
+        if len(calls) < 3:
+            return 503, {}, {'status': 'error', 'message': 'busy'}
+        return 200, {}, {'status': 'success'}
+
+    stub.route('/status', flaky)
+    transport = adamalib.Transport(max_retries=3, backoff_factor=0)
+    with adamalib.Adama(stub.url, transport=transport) as adama:
+        assert adama.status['status'] == 'success'
+    assert len(calls) == 3
+
+
+def test_exhausted_retries_raise_the_last_response(stub):
+    calls = []
+    stub.route('/status', lambda request: calls.append(request) or (
+        503, {}, {'status': 'error', 'message': 'busy'}))
+    transport = adamalib.Transport(max_retries=2, backoff_factor=0)
+    with adamalib.Adama(stub.url, transport=transport) as adama:
+        with pytest.raises(requests.HTTPError) as info:
+            adama.status
+    assert info.value.response.status_code == 503
+    assert len(calls) == 3
+
+
+def test_close_releases_session(adama):
+    adama.status
+    session = adama.transport.session
+    adama.close()
+    assert adama.transport.session is not session
+
+
+def serve_endpoint(stub, handler, typ='query'):
+    stub.route('/ns', {'status': 'success',
+                       'result': {'name': 'ns', 'description': ''}})
+    stub.route('/ns/srv_v0.1', {'status': 'success', 'result': {
+        'service': {'name': 'srv', 'version': '0.1', 'type': typ}}})
+    stub.route('/ns/srv_v0.1/search', handler)
+
+
+def test_prepared_endpoint_calls_are_single_requests(stub, adama):
+    serve_endpoint(stub, lambda request: (200, {}, {
+        'status': 'success', 'result': [request['params']]}))
+    search = adama.prepare('ns', 'srv', '0.1', 'search')
+    assert search.type == 'query'
+    assert [r['path'] for r in stub.requests] == ['/ns/srv_v0.1']
+    del stub.requests[:]
+    assert search(q='a') == [{'q': 'a'}]
+    declared = adama.prepare('ns', 'srv', 0.1, 'search', type='query')
+    assert declared == search
+    assert declared(q='b') == [{'q': 'b'}]
+    assert [r['path'] for r in stub.requests] == ['/ns/srv_v0.1/search'] * 2
+    with pytest.raises(AttributeError):
+        search.endpoint = 'list'
+
+
+def test_prepared_endpoint_pickles_without_client(stub, adama):
+    serve_endpoint(stub, lambda request: (200, {}, {
+        'status': 'success', 'result': [request['params']]}))
+    search = pickle.loads(pickle.dumps(
+        adama.ns.srv.search.prepare(), protocol=2))
+    assert search.adama is not adama
+    assert search.adama is adamalib.adamalib.shared_client(
+        stub.url, 'tok', True)
+    assert search(q='a') == [{'q': 'a'}]
+    assert stub.requests[-1]['headers']['Authorization'] == 'Bearer tok'
+
+
+def test_map_yields_results_in_order_and_keeps_errors(stub, adama):
+    def search(request):
+        n = int(request['params']['n'])
+        if n == 3:
+            return 500, {}, b'boom'
+        time.sleep(0.01 * (5 - n))
+        return 200, {}, {'status': 'success', 'result': [{'n': n}]}
+
+    serve_endpoint(stub, search)
+    results = list(adama.ns.srv.search.map(
+        ({'n': n} for n in range(5)), concurrency=3))
+    assert [r[0]['n'] for r in results if not isinstance(
+        r, adamalib.adamalib.MapError)] == [0, 1, 2, 4]
+    error = results[3]
+    assert isinstance(error, adamalib.adamalib.MapError)
+    assert error.kwargs == {'n': 3}
+
+
+def test_map_bounds_concurrency_and_reads_input_lazily(stub, adama):
+    lock = threading.Lock()
+    active = [0, 0]
+
+    def search(request):
+        with lock:
+            active[0] += 1
+            active[1] = max(active)
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return 200, {}, {'status': 'success', 'result': []}
+
+    serve_endpoint(stub, search)
+    consumed = []
+
+    def params():
+        for n in range(1000):
+            consumed.append(n)
+            yield {'n': n}
+
+    results = adama.ns.srv.search.map(params(), concurrency=4,
+                                      ordered=False)
+    for _ in range(8):
+        next(results)
+    results.close()
+    assert active[1] == 4
+    assert len(consumed) <= 8 + 2 * 4
+
+
+def test_stream_yields_records_before_response_ends(stub, adama):
+    released = threading.Event()
+
+    def search(request):
+        def chunks():
+            yield b'{"result": [{"n": 0}, '
+            released.wait(5)
+            yield b'{"n": 1}], "status": "success", "message": ""}'
+        return 200, {'Link': '<http://prov.example/1>; rel='
+                             '"http://www.w3.org/ns/prov#has_provenance"'}, \
+            chunks()
+
+    serve_endpoint(stub, search)
+    stream = adama.ns.srv.search.stream()
+    assert stream.prov_url == 'http://prov.example/1'
+    records = iter(stream)
+    assert next(records) == {'n': 0}
+    released.set()
+    assert list(records) == [{'n': 1}]
+    assert stream.fields['status'] == 'success'
+
+
+def test_client_options_do_not_shadow_service_parameters(stub, adama):
+    serve_endpoint(stub, lambda request: (200, {}, {
+        'status': 'success', 'result': [request['params']]}))
+    params = {'stream': 'true', 'as_table': '1', 'q': 'x'}
+    result = adama.ns.srv.search(**params)
+    assert isinstance(result, adamalib.adamalib.ProvList)
+    assert result == [params]
+    assert stub.requests[-1]['params'] == params
+
+
+def test_stream_raises_on_error_status(stub, adama):
+    serve_endpoint(stub, {'result': [], 'status': 'error', 'message': 'bad'})
+    with pytest.raises(adamalib.adamalib.APIException):
+        list(adama.ns.srv.search.stream())
+
+
+def test_metadata_is_cached_across_navigation(stub, adama):
+    serve_endpoint(stub, {'status': 'success', 'result': []})
+    for _ in range(3):
+        adama.ns.srv.search()
+    paths = [r['path'] for r in stub.requests]
+    assert paths.count('/ns') == 1
+    assert paths.count('/ns/srv_v0.1') == 1
+    assert paths.count('/ns/srv_v0.1/search') == 3
+    assert adama.metadata_cache.stats['hits'] >= 4
+
+
+def test_metadata_cache_expires_and_is_invalidated(stub):
+    now = [0]
+    cache = adamalib.adamalib.TTLCache(maxsize=10, ttl=60,
+                                       timer=lambda: now[0])
+    adama = adamalib.Adama(stub.url, metadata_cache=cache)
+    serve_endpoint(stub, {'status': 'success', 'result': []})
+    stub.route('/ns/srv_v0.1', {'status': 'success'}, method='DELETE')
+    adama.ns.srv.type
+    now[0] = 61
+    adama.ns.srv.type
+    adama.ns.srv.delete()
+    adama.ns.srv.type
+    paths = [r['path'] for r in stub.requests if r['method'] == 'GET']
+    assert paths.count('/ns/srv_v0.1') == 3
+
+
+def test_metadata_of_registering_service_is_not_cached(stub, adama):
+    stub.route('/ns', {'status': 'success', 'result': {'name': 'ns'}})
+    stub.route('/ns/srv_v0.1', {'status': 'success',
+                                'result': {'service': None}})
+    assert adama.ns.srv.type is None
+    assert '/ns/srv_v0.1' not in adama.metadata_cache._data
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = adamalib.adamalib.TTLCache(maxsize=2, ttl=None)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    with pytest.raises(KeyError):
+        cache.get('b')
+    assert cache.get('a') == 1
+    assert cache.stats == {'hits': 2, 'misses': 1, 'size': 2}
+
+
+def test_response_cache_serves_repeated_queries(stub):
+    serve_endpoint(stub, lambda request: (200, {}, {
+        'status': 'success', 'result': [request['params']]}))
+    cache = adamalib.ResponseCache()
+    adama = adamalib.Adama(stub.url, response_cache=cache)
+    assert adama.ns.srv.search(q='a') == [{'q': 'a'}]
+    assert adama.ns.srv.search(q='a') == [{'q': 'a'}]
+    assert adama.ns.srv.search(q='b') == [{'q': 'b'}]
+    paths = [r['path'] for r in stub.requests]
+    assert paths.count('/ns/srv_v0.1/search') == 2
+    assert cache.stats == {'hits': 1, 'misses': 2, 'revalidated': 0}
+
+
+def test_response_cache_revalidates_with_etag(stub):
+    def search(request):
+        if request['headers'].get('If-None-Match') == '"v1"':
+            return 304, {}, b''
+        return 200, {'ETag': '"v1"', 'Link': '<http://prov.example/1>; '
+                     'rel="http://www.w3.org/ns/prov#has_provenance"'}, {
+            'status': 'success', 'result': [1, 2]}
+
+    serve_endpoint(stub, search)
+    cache = adamalib.ResponseCache()
+    adama = adamalib.Adama(stub.url, response_cache=cache)
+    adama.ns.srv.search()
+    result = adama.ns.srv.search()
+    assert result == [1, 2]
+    assert result.prov_url == 'http://prov.example/1'
+    assert cache.stats['revalidated'] == 1
+
+
+def test_response_cache_is_keyed_and_invalidated_per_server(stub):
+    serve_endpoint(stub, lambda request: (200, {}, {
+        'status': 'success', 'result': [request['params']]}))
+    stub.route('/ns/srv_v0.1', {'status': 'success'}, method='DELETE')
+    cache = adamalib.ResponseCache()
+    other = cache.key('http://elsewhere', '/ns/srv_v0.1/search', {'q': 'a'})
+    assert other != cache.key(stub.url, '/ns/srv_v0.1/search', {'q': 'a'})
+    cache.backend.set(other, b'{}')
+    adama = adamalib.Adama(stub.url, response_cache=cache)
+    srv = adama.ns.srv
+    srv.search(q='a')
+    srv.search(q='a')
+    assert cache.stats['misses'] == 1
+    srv.delete()
+    adama.ns.srv.search(q='a')
+    assert cache.stats['misses'] == 2
+    assert cache.backend.get(other) == b'{}'
+
+
+def test_response_cache_is_keyed_per_token(stub):
+    serve_endpoint(stub, lambda request: (200, {}, {
+        'status': 'success',
+        'result': [request['headers'].get('Authorization')]}))
+    cache = adamalib.ResponseCache()
+    alice = adamalib.Adama(stub.url, token='alice', response_cache=cache)
+    bob = adamalib.Adama(stub.url, token='bob', response_cache=cache)
+    assert alice.ns.srv.search() == ['Bearer alice']
+    assert bob.ns.srv.search() == ['Bearer bob']
+    assert alice.ns.srv.search() == ['Bearer alice']
+    assert cache.stats['misses'] == 2
+    assert not any('alice' in key for key in cache.backend._data)
+
+
+def test_response_cache_opt_out(stub):
+    serve_endpoint(stub, {'status': 'success', 'result': []})
+    cache = adamalib.ResponseCache(exclude=['ns/srv'])
+    adama = adamalib.Adama(stub.url, response_cache=cache)
+    adama.ns.srv.search()
+    adama.ns.srv.search()
+    assert [r['path'] for r in stub.requests].count(
+        '/ns/srv_v0.1/search') == 2
+
+
+def test_response_cache_opt_out_matches_whole_service_names():
+    cache = adamalib.ResponseCache(exclude=['ns/srv'])
+    cache.exclude('ns', 'other', '0.1')
+    assert not cache.accepts('/ns/srv_v0.1/search')
+    assert cache.accepts('/ns/srv_v2_v0.1/search')
+    assert not cache.accepts('/ns/other_v0.1/search')
+    assert cache.accepts('/ns/other_v0.10/search')
+
+
+def test_sqlite_backend_persists_and_evicts(tmpdir):
+    path = str(tmpdir.join('responses.db'))
+    backend = adamalib.SQLiteBackend(path, max_bytes=10)
+    backend.set('a', b'12345')
+    backend.set('b', b'67890')
+    backend.get('a')
+    backend.set('c', b'abcde')
+    backend.close()
+    backend = adamalib.SQLiteBackend(path)
+    assert backend.get('a') == b'12345'
+    assert backend.get('b') is None
+    assert backend.get('c') == b'abcde'
+
+
+def test_state_dir_warms_up_new_clients(stub, tmpdir):
+    serve_endpoint(stub, lambda request: (200, {'ETag': '"v1"'}, {
+        'status': 'success', 'result': [request['params']]}))
+    stub.route('/prov', {'prov': True})
+    state = str(tmpdir.join('state'))
+    with adamalib.Adama(stub.url, state_dir=state) as adama:
+        assert adama.ns.srv.search(q='a') == [{'q': 'a'}]
+        assert adama.get_prov(stub.url + '/prov') == {'prov': True}
+    del stub.requests[:]
+    with adamalib.Adama(stub.url, state_dir=state) as adama:
+        assert adama.ns.srv.search(q='a') == [{'q': 'a'}]
+        assert adama.get_prov(stub.url + '/prov') == {'prov': True}
+        assert adama.metadata_cache.stats['loaded'] == 2
+    # only the conditional request revalidating the result is sent
+    assert [r['path'] for r in stub.requests] == ['/ns/srv_v0.1/search']
+
+
+def test_state_dir_results_without_validators_expire(stub, tmpdir,
+                                                     monkeypatch):
+    serve_endpoint(stub, lambda request: (200, {}, {
+        'status': 'success', 'result': [request['params']]}))
+    state = str(tmpdir.join('state'))
+    with adamalib.Adama(stub.url, state_dir=state) as adama:
+        adama.ns.srv.search(q='a')
+    now = time.time()
+    with adamalib.Adama(stub.url, state_dir=state) as adama:
+        search = adama.prepare('ns', 'srv', '0.1', 'search', type='query')
+        del stub.requests[:]
+        assert search(q='a') == [{'q': 'a'}]
+        assert stub.requests == []
+        monkeypatch.setattr(adamalib.cache.time, 'time', lambda: (
+            now + adamalib.cache.DEFAULT_STATE_RESPONSE_TTL + 1))
+        assert search(q='a') == [{'q': 'a'}]
+        assert [r['path'] for r in stub.requests] == ['/ns/srv_v0.1/search']
+
+
+def test_persistent_cache_expires_and_invalidates(tmpdir):
+    state = adamalib.StateDirectory(str(tmpdir))
+    cache = adamalib.PersistentCache(adamalib.TTLCache(ttl=60),
+                                     state.scope('metadata'))
+    cache.set('/ns', {'a': 1})
+    cache.set('/ns/srv_v0.1', {'b': 2})
+    fresh = adamalib.PersistentCache(adamalib.TTLCache(ttl=60),
+                                     state.scope('metadata'))
+    assert fresh.get('/ns') == {'a': 1}
+    fresh.invalidate(prefix='/ns/')
+    assert state.scope('metadata').get('/ns/srv_v0.1') is None
+    expired = adamalib.PersistentCache(adamalib.TTLCache(ttl=0),
+                                       state.scope('metadata'))
+    with pytest.raises(KeyError):
+        expired.get('/ns')
+    assert state.scope('metadata').get('/ns') is None
+    state.close()
+
+
+def test_state_dir_is_private(tmpdir):
+    state = adamalib.StateDirectory(str(tmpdir.join('state')))
+    state.close()
+    assert stat.S_IMODE(os.stat(state.path).st_mode) == 0o700
+
+
+def test_state_dir_is_shared_by_processes(tmpdir):
+    code = ('import sys, adamalib\n'
+            'state = adamalib.StateDirectory(sys.argv[1], max_bytes=4000)\n'
+            'scope = state.scope(sys.argv[2])\n'
+            'for n in range(200):\n'
+            '    scope.set(str(n), b"x" * 100)\n')
+    processes = [subprocess.Popen([sys.executable, '-c', code, str(tmpdir),
+                                   name]) for name in 'abcd']
+    assert [process.wait() for process in processes] == [0] * 4
+    state = adamalib.StateDirectory(str(tmpdir))
+    rows, total = state.backend._db.execute(
+        'SELECT COUNT(*), SUM(size) FROM responses').fetchone()
+    assert 0 < total <= 4000 and total == rows * 100
+    state.close()
+
+
+def test_memory_backend_limits_bytes():
+    backend = adamalib.MemoryBackend(max_bytes=8)
+    backend.set('a', b'1234')
+    backend.set('b', b'5678')
+    backend.set('c', b'9')
+    assert backend.get('a') is None
+    assert backend.get('c') == b'9'
+
+
+def test_instrumentation_times_phases_per_route(stub):
+    serve_endpoint(stub, lambda request: (200, {}, {
+        'status': 'success', 'result': [request['params']]}))
+    events = []
+    instrumentation = adamalib.Instrumentation(hooks=[events.append])
+    adama = adamalib.Adama(stub.url, instrumentation=instrumentation)
+    for n in range(3):
+        adama.ns.srv.search(n=n)
+    events = [event for event in events if event.cache != 'hit']
+    assert [event.route for event in events] == [
+        '/{ns}', '/{ns}/{srv}'] + ['/{ns}/{srv}/{endpoint}'] * 3
+    first, later = events[2], events[3]
+    assert first.status == 200 and first.bytes > 0
+    assert events[0].connect > 0 and later.connect == 0
+    assert all(phase >= 0 for phase in (
+        later.wait, later.download, later.decode))
+    stats = instrumentation.stats.summary()['/{ns}/{srv}/{endpoint}']
+    assert stats['count'] == 3 and stats['errors'] == 0
+    assert 0 < stats['p50'] <= stats['p95'] <= stats['p99']
+
+
+def test_instrumentation_records_cache_hits_and_errors(stub):
+    serve_endpoint(stub, {'status': 'success', 'result': []})
+    stub.route('/broken', lambda request: (500, {}, b'boom'))
+    instrumentation = adamalib.Instrumentation()
+    adama = adamalib.Adama(stub.url, instrumentation=instrumentation,
+                           response_cache=adamalib.ResponseCache())
+    adama.ns.srv.search()
+    adama.ns.srv.search()
+    with pytest.raises(adamalib.adamalib.APIException):
+        adama.utils.request(stub.url + '/broken')
+    summary = instrumentation.stats.summary()
+    assert summary['/{ns}/{srv}/{endpoint}']['cache'] == {
+        'miss': 1, 'hit': 1}
+    assert summary['/{ns}/{srv}/{endpoint}']['count'] == 1
+    assert summary['/{ns}']['cache'] == {'miss': 1, 'hit': 1}
+    assert summary['/{ns}']['count'] == 2
+    assert summary['/{ns}']['errors'] == 1
+    text = instrumentation.stats.prometheus()
+    assert ('adama_client_request_seconds_count'
+            '{route="/{ns}/{srv}/{endpoint}"} 1') in text
+    assert ('adama_client_cache_total{route="/{ns}/{srv}/{endpoint}",'
+            'result="hit"} 1') in text
+    assert 'adama_client_errors_total{route="/{ns}"} 1' in text
+
+
+def test_route_templates():
+    route = adamalib.instrumentation.route_template
+    base = 'http://adama/v0.3'
+    assert route(base, base + '/status') == '/status'
+    assert route(base, base + '/ns/services') == '/{ns}/services'
+    assert route(base, base + '/ns/srv_v0.1/search?q=1') == (
+        '/{ns}/{srv}/{endpoint}')
+    assert route(base, base + '/prov/abc') == '/prov/{id}'
+    assert route(base, 'http://elsewhere/prov') == 'external'
+
+
+def test_concurrent_identical_requests_are_coalesced(stub, adama):
+    def search(request):
+        time.sleep(0.2)
+        return 200, {}, {'status': 'success',
+                         'result': [request['params']]}
+
+    serve_endpoint(stub, search)
+    stub.route('/prov', lambda request: (time.sleep(0.2) or 200, {}, {}))
+    results = []
+
+    def work():
+        results.append(adama.ns.srv.search(locus='AT1'))
+        results.append(adama.get_prov(stub.url + '/prov'))
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 16
+    paths = [r['path'] for r in stub.requests]
+    assert paths.count('/ns/srv_v0.1/search') == 1
+    assert paths.count('/prov') == 1
+    assert paths.count('/ns/srv_v0.1') == 1
+    stats = adama.single_flight.stats
+    assert stats['coalesced'] >= 2 * 7 and stats['in_flight'] == 0
+
+
+def test_coalescing_can_be_disabled(stub):
+    stub.route('/slow', lambda request: (time.sleep(0.2) or 200, {}, {}))
+    adama = adamalib.Adama(stub.url, coalesce=False)
+    threads = [threading.Thread(target=adama.utils.request,
+                                args=(stub.url + '/slow',))
+               for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(stub.requests) == 2
+
+
+def test_service_versions_are_new_objects(stub, adama):
+    serve_endpoint(stub, {'status': 'success', 'result': []})
+    srv = adama.ns.srv
+    other = srv['0.2']
+    assert other is not srv
+    assert other._full_name == '/ns/srv_v0.2'
+    assert srv._full_name == '/ns/srv_v0.1'
+
+
+def test_shared_navigation_objects_under_threads(stub, adama, monkeypatch):
+    def search(request):
+        return 200, {}, {'status': 'success',
+                         'result': [request['path']]}
+
+    serve_endpoint(stub, search)
+    stub.route('/ns/srv_v0.2', {'status': 'success', 'result': {
+        'service': {'name': 'srv', 'version': '0.2', 'type': 'query'}}})
+    stub.route('/ns/srv_v0.2/search', search)
+    preloads = []
+    preload = adamalib.adamalib.Service._preload
+
+    def counting_preload(service):
+        preloads.append(service._full_name)
+        time.sleep(0.05)
+        return preload(service)
+
+    monkeypatch.setattr(adamalib.adamalib.Service, '_preload',
+                        counting_preload)
+    ns = adama.ns
+    srv = ns.srv
+    barrier = threading.Barrier(16) if hasattr(threading, 'Barrier') \
+        else None
+    errors = []
+
+    def work(i):
+        try:
+            if barrier is not None:
+                barrier.wait()
+            for n in range(20):
+                version = '0.2' if (i + n) % 2 else '0.1'
+                service = srv[version] if version == '0.2' else srv
+                result = service.search(n=n)
+                assert result == ['/ns/srv_v{}/search'.format(version)]
+                assert srv.version == '0.1'
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert preloads.count('/ns/srv_v0.1') == 1
+
+
+PROV_JSON = {
+    'prefix': {'ex': 'http://example.org/'},
+    'entity': {'ex:result': {}},
+    'bundle': {'ex:b': {'entity': {'ex:source': {}}}},
+}
+
+
+def test_prov_documents_are_memoized(stub, adama):
+    stub.route('/prov', PROV_JSON)
+    result = adamalib.adamalib.ProvList([], stub.url + '/prov', adama)
+    document = result.prov(format='prov')
+    assert result.prov(format='prov') is document
+    assert len(document.bundles) == 1
+    assert len(stub.requests) == 1
+    assert stub.requests[0]['params'] == {'format': 'prov'}
+
+
+def test_bulk_prov_fetches_each_url_once(stub, adama):
+    stub.route('/p1', {'n': 1})
+    stub.route('/p2', {'n': 2})
+    results = [adamalib.adamalib.ProvList([], stub.url + path, adama)
+               for path in ('/p1', '/p2', '/p1')]
+    assert adama.bulk_prov(results) == [{'n': 1}, {'n': 2}, {'n': 1}]
+    assert len(stub.requests) == 2
+
+
+def registering(stub, path, responses):
+    responses = list(responses)
+
+    def handler(request):
+        result = responses.pop(0) if len(responses) > 1 else responses[0]
+        return 200, {}, {'status': 'success', 'result': result}
+
+    stub.route(path, handler)
+
+
+def new_registration(adama, name, **kwargs):
+    srv = adamalib.adamalib.Service(adama.ns, name)
+    kwargs.setdefault('initial_delay', 0.01)
+    return adamalib.adamalib.Registration(srv, **kwargs)
+
+
+def test_registration_polls_with_backoff_until_ready(stub, adama):
+    registering(stub, '/ns/a_v0.1', [{'service': None}] * 3 + [
+        {'service': {'name': 'a', 'version': '0.1', 'type': 'query'}}])
+    registration = new_registration(adama, 'a', jitter=0)
+    assert not registration.done()
+    assert registration.result().type == 'query'
+    assert registration.polls == 4
+    assert registration.done() and registration.exception() is None
+
+
+def test_registration_reports_errors_and_timeouts(stub, adama):
+    registering(stub, '/ns/a_v0.1', [{'slot': 'error', 'msg': 'bad code'}])
+    registering(stub, '/ns/b_v0.1', [{'service': None}])
+    failed = new_registration(adama, 'a')
+    with pytest.raises(adamalib.adamalib.APIException) as excinfo:
+        failed.result()
+    assert str(excinfo.value) == 'bad code'
+    slow = new_registration(adama, 'b', timeout=0.05)
+    assert 'timeout' in str(slow.exception())
+
+
+def test_wait_all_polls_registrations_together(stub, adama):
+    for name in 'abc':
+        registering(stub, '/ns/{}_v0.1'.format(name), [{'service': None}, {
+            'service': {'name': name, 'version': '0.1', 'type': 'query'}}])
+    registrations = [new_registration(adama, name) for name in 'abc']
+    services = adamalib.adamalib.wait_all(registrations)
+    assert [srv.name for srv in services] == ['a', 'b', 'c']
+    assert len(stub.requests) == 6
+
+
+def test_pages_stop_when_service_ignores_paging(stub, adama):
+    records = [{'n': n} for n in range(250)]
+    serve_endpoint(stub, lambda request: (200, {}, {
+        'status': 'success', 'result': records}))
+    pages = adama.ns.srv.search.pages(page_size=100)
+    assert [len(page) for page in pages.iter_pages()] == [250]
+    assert pages.unpaged
+    assert len(pages) == 250 and list(pages) == records
+    assert pages[180] == {'n': 180}
+    with pytest.raises(IndexError):
+        pages[250]
+    searches = [r for r in stub.requests if r['path'].endswith('/search')]
+    assert len(searches) == 1
+    fresh = adama.ns.srv.search.pages(page_size=100)
+    assert fresh[180] == {'n': 180} and fresh.unpaged
+
+
+def test_coalesced_callers_get_their_own_results(stub, adama):
+    def search(request):
+        time.sleep(0.2)
+        return 200, {}, {'status': 'success', 'result': [{'n': 1}]}
+
+    serve_endpoint(stub, search)
+    search = adama.prepare('ns', 'srv', '0.1', 'search', type='query')
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(search()))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert adama.single_flight.stats['coalesced'] == 3
+    results[0][0]['n'] = 2
+    assert [result[0]['n'] for result in results[1:]] == [1, 1, 1]
+    assert len(set(id(result[0]) for result in results)) == 4
+
+
+def test_item_access_reaches_names_shadowed_by_attributes(stub, adama):
+    stub.route('/catalog', {'status': 'success',
+                            'result': {'name': 'catalog'}})
+    stub.route('/catalog/delete_v0.1', {'status': 'success', 'result': {
+        'service': {'name': 'delete', 'version': '0.1', 'type': 'query'}}})
+    stub.route('/catalog/delete_v0.1/search',
+               {'status': 'success', 'result': [1]})
+    assert adama['catalog'].name == 'catalog'
+    assert adama['state'].namespace == 'state'
+    assert adama['catalog']['delete'].search() == [1]
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from adamalib.adamalib import APIException  # noqa: E402
+from adamalib.aio import AsyncAdama  # noqa: E402
+
+from .test_adamalib import serve_endpoint  # noqa: E402
+
+
+PROV = ('<http://prov.example/1>; '
+        'rel="http://www.w3.org/ns/prov#has_provenance"')
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def search(request):
+    n = int(request['params'].get('n', 3))
+    return 200, {'Link': PROV}, {
+        'status': 'success', 'message': '',
+        'result': [{'n': i} for i in range(n)]}
+
+
+def test_navigation_and_call(stub):
+    serve_endpoint(stub, search)
+
+    async def main():
+        async with AsyncAdama(stub.url, token='tok') as adama:
+            result = await adama.ns.srv.search(n=2)
+            srv = adama.ns.srv
+            await srv.load()
+            return result, srv.type
+
+    result, typ = run(main())
+    assert result == [{'n': 0}, {'n': 1}]
+    assert result.prov_url == 'http://prov.example/1'
+    assert typ == 'query'
+    assert stub.requests[-1]['headers']['Authorization'] == 'Bearer tok'
+
+
+def test_service_metadata_is_loaded_once_per_object(stub):
+    serve_endpoint(stub, search)
+
+    async def main():
+        async with AsyncAdama(stub.url) as adama:
+            endpoint = adama.ns.srv.search
+            await asyncio.gather(*[endpoint(n=1) for _ in range(3)])
+            await endpoint(n=1)
+
+    run(main())
+    paths = [r['path'] for r in stub.requests]
+    assert paths.count('/ns/srv_v0.1/search') == 4
+    assert paths.count('/ns/srv_v0.1') == 1
+    assert paths[-1] == paths[-2] == '/ns/srv_v0.1/search'
+
+
+def test_stream_yields_records_and_prov_url(stub):
+    serve_endpoint(stub, search)
+
+    async def main():
+        async with AsyncAdama(stub.url, concurrency=1) as adama:
+            stream = await adama.ns.srv.search.stream(n=500)
+            records = [record async for record in stream]
+            # the concurrency slot was released by the exhausted stream
+            await adama.ns.srv.search(n=1)
+            return stream.prov_url, records
+
+    prov_url, records = run(main())
+    assert prov_url == 'http://prov.example/1'
+    assert records == [{'n': i} for i in range(500)]
+
+
+def test_stream_reports_error_status(stub):
+    serve_endpoint(stub, lambda request: (200, {}, json.dumps(
+        {'result': [], 'status': 'error', 'message': 'bad'}).encode()))
+
+    async def main():
+        async with AsyncAdama(stub.url) as adama:
+            stream = await adama.ns.srv.search.stream()
+            return [record async for record in stream]
+
+    with pytest.raises(Exception) as excinfo:
+        run(main())
+    assert 'bad' in str(excinfo.value)
+
+
+def test_delete_invalidates_service_metadata(stub):
+    serve_endpoint(stub, search)
+    stub.route('/ns/srv_v0.1', {'status': 'success'}, method='DELETE')
+
+    async def main():
+        async with AsyncAdama(stub.url) as adama:
+            adama.metadata_cache.set('/ns/srv_v0.1/nested', {})
+            await adama.ns.srv.load()
+            await adama.ns.srv.delete()
+            return len(adama.metadata_cache)
+
+    assert run(main()) == 0
+
+
+def test_prov_is_memoized_and_checks_the_format(stub):
+    link = PROV.replace('http://prov.example/1', stub.url + '/prov')
+    serve_endpoint(stub, lambda request: (200, {'Link': link}, {
+        'status': 'success', 'result': []}))
+    stub.route('/prov', {'prov': True})
+
+    async def main():
+        async with AsyncAdama(stub.url) as adama:
+            result = await adama.ns.srv.search()
+            first = await result.prov()
+            assert await result.prov() is first
+            with pytest.raises(APIException):
+                await result.prov('yaml')
+            return first
+
+    assert run(main()) == {'prov': True}
+    assert [r['path'] for r in stub.requests].count('/prov') == 1
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+
+import adamalib
+from adamalib.testing import FakeAdama
+
+
+@pytest.fixture
+def fake():
+    with FakeAdama() as server:
+        server.add_service('araport', 'gene_search', type='query',
+                           description='Search genes by locus',
+                           endpoints={'/search': {}, '/list': {}})
+        server.add_service('araport', 'expression', version='0.2',
+                           type='map_filter', description='Expression data')
+        server.add_service('other', 'gene_search', type='generic')
+        yield server
+
+
+def requests_to(fake, suffix):
+    return [path for _, path, _ in fake.requests if path.endswith(suffix)]
+
+
+def test_catalog_fetches_each_service_list_once(fake):
+    catalog = adamalib.Adama(fake.url).catalog()
+    assert len(catalog) == 3
+    assert len(fake.requests) == 3
+    assert catalog.complete('araport/') == [
+        'araport/expression_v0.2', 'araport/gene_search_v0.1']
+
+
+def test_catalog_search(fake):
+    catalog = adamalib.Adama(fake.url).catalog()
+
+    def keys(**kwargs):
+        return [(s['namespace'], s['name']) for s in catalog.search(**kwargs)]
+
+    assert keys(text='gene') == [('araport', 'gene_search'),
+                                 ('other', 'gene_search')]
+    assert keys(text='gen loc') == [('araport', 'gene_search')]
+    assert keys(type='map_filter') == [('araport', 'expression')]
+    assert keys(version='0.2') == [('araport', 'expression')]
+    assert keys(endpoint='/list') == [('araport', 'gene_search')]
+    assert keys(text='search', namespace='other') == [
+        ('other', 'gene_search')]
+    assert keys(text='nothing') == []
+
+
+def test_catalog_indexes_non_ascii_text(fake, tmpdir):
+    fake.add_service('araport', 'lexique', description=u'Gènes exprimés')
+    catalog = adamalib.Adama(fake.url).catalog()
+    assert [s['name'] for s in catalog.search(text=u'exprimés')] == [
+        'lexique']
+    path = str(tmpdir.join('catalog.json'))
+    catalog.save(path)
+    loaded = adamalib.Catalog.load(path)
+    assert loaded.search(text=u'gènes')[0]['description'] == u'Gènes exprimés'
+
+
+def test_catalog_persists_and_refreshes_incrementally(fake, tmpdir):
+    adama = adamalib.Adama(fake.url)
+    path = str(tmpdir.join('catalog.json'))
+    adama.catalog().save(path)
+    catalog = adamalib.Catalog.load(path)
+    assert catalog.search(text='expression')[0]['version'] == '0.2'
+
+    fake.add_service('other', 'new_service')
+    fake.add_namespace('empty')
+    del fake.requests[:]
+    assert catalog.refresh(adama) == ['empty', 'other']
+    assert len(requests_to(fake, '/services')) == 3
+    assert catalog.search(text='new')[0]['name'] == 'new_service'
+
+    del fake.requests[:]
+    assert catalog.refresh(adama, max_age=3600) == []
+    assert requests_to(fake, '/services') == []
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import zlib
+
+from six.moves.urllib.parse import parse_qsl
+
+import adamalib
+from adamalib.compression import accept_encoding, compress_body
+from adamalib.testing import FakeAdama
+
+
+def search(fake, transport=None):
+    events = []
+    adama = adamalib.Adama(
+        fake.url, transport=transport,
+        instrumentation=adamalib.Instrumentation(hooks=[events.append]))
+    result = adama.ns.srv.search(q='AT1G01010')
+    streamed = list(adama.ns.srv.search.stream(q='AT1G01010'))
+    event = [event for event in events if event.route.endswith(
+        '{endpoint}')][0]
+    return result, streamed, event, adama.instrumentation.stats.summary()
+
+
+def test_responses_are_decompressed_and_counted():
+    with FakeAdama(records=500, compress=True) as fake:
+        fake.add_service('ns', 'srv')
+        result, streamed, event, summary = search(fake)
+        assert len(result) == 500 and streamed == list(result)
+        assert 0 < event.wire_bytes < event.bytes / 2
+        route = summary['/{ns}/{srv}/{endpoint}']
+        assert route['wire_bytes'] < route['bytes']
+        transport = adamalib.Transport(accept_encoding='identity')
+        plain, _, event, _ = search(fake, transport)
+        assert plain == result
+        assert event.wire_bytes == event.bytes
+
+
+def test_accept_encoding_offers_decodable_codings():
+    assert accept_encoding().startswith('gzip, deflate')
+
+
+def test_request_bodies_are_compressed(stub):
+    stub.route('/namespaces', {'status': 'success'}, method='POST')
+    transport = adamalib.Transport(request_encoding='gzip',
+                                   compress_min_size=100)
+    adama = adamalib.Adama(stub.url, transport=transport)
+    adama.post('/namespaces', data={'name': 'ns', 'description': 'x' * 200})
+    adama.post('/namespaces', data={'name': 'ns'})
+    large, small = stub.requests
+    assert large['headers']['Content-Encoding'] == 'gzip'
+    assert dict(parse_qsl(zlib.decompress(large['body'], 31).decode(
+        'ascii'))) == {'name': 'ns', 'description': 'x' * 200}
+    assert 'Content-Encoding' not in small['headers']
+    assert small['body'] == b'name=ns'
+
+
+def test_streamed_bodies_are_not_compressed():
+    kwargs = {'data': iter([b'x' * 2000])}
+    assert not compress_body(kwargs, 'gzip')
+    kwargs = {'data': b'x' * 2000}
+    assert compress_body(kwargs, 'deflate')
+    assert zlib.decompress(kwargs['data']) == b'x' * 2000
+    assert kwargs['headers'] == {'Content-Encoding': 'deflate'}
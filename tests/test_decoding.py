@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import math
+
+import pytest
+
+import adamalib
+from adamalib.decoding import Decoder
+
+from .test_adamalib import serve_endpoint
+
+
+def test_missing_backends_fall_back_to_stdlib():
+    decoder = Decoder(backends=('no_such_json_module',))
+    assert decoder.name == 'json'
+    assert decoder.loads(b'{"a": [1, 2.5, null]}') == {'a': [1, 2.5, None]}
+    assert decoder.loads(u'{"é": 1}'.encode('utf-16')) == {u'é': 1}
+    with pytest.raises(ValueError):
+        decoder.loads(b'{"a": ')
+
+
+def test_rejected_documents_are_decoded_by_stdlib():
+    def strict(data):
+        if b'NaN' in data:
+            raise ValueError('NaN')
+        return json.loads(data.decode('utf-8'))
+
+    decoder = Decoder(backends=(strict,))
+    assert decoder.name == 'strict'
+    assert math.isnan(decoder.loads(b'[NaN]')[0])
+    with pytest.raises(ValueError):
+        decoder.loads(b'not json')
+
+
+def test_envelope_keeps_only_response_fields():
+    decoder = Decoder()
+    body = b'{"status": "success", "result": [1], "metadata": {"x": 1}}'
+    assert decoder.envelope(body) == {'status': 'success', 'result': [1]}
+    assert decoder.envelope(b'[1]') == [1]
+
+
+def test_client_decodes_responses_with_its_decoder(stub):
+    serve_endpoint(stub, {'status': 'success', 'result': [{'n': 1}],
+                          'metadata': {'time_in_main': 0.1}})
+    decoded = []
+
+    def loads(data):
+        decoded.append(data)
+        return json.loads(data.decode('utf-8'))
+
+    adama = adamalib.Adama(stub.url, decoder=Decoder(backends=(loads,)))
+    assert adama.ns.srv.search() == [{'n': 1}]
+    assert len(decoded) == 3
+    assert all(isinstance(data, bytes) for data in decoded)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+import pytest
+import yaml
+
+from adamalib import discovery
+from adamalib.adamalib import (APIException, Utils, find_metadata,
+                               git_top_level, service_metadata)
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    discovery.clear_caches()
+    yield
+    discovery.clear_caches()
+
+
+@pytest.fixture
+def repo(tmpdir):
+    directory = tmpdir.mkdir('repo')
+    directory.mkdir('.git')
+    service = directory.mkdir('services').mkdir('srv')
+    service.join('metadata.yml').write('name: srv\ntype: query\n')
+    service.mkdir('lib').mkdir('deep')
+    return directory
+
+
+def test_metadata_is_found_in_parent_directories(repo):
+    deep = str(repo.join('services', 'srv', 'lib', 'deep'))
+    toplevel, metadata, md = service_metadata(deep)
+    assert toplevel == os.path.realpath(str(repo))
+    assert metadata == os.path.realpath(
+        str(repo.join('services', 'srv', 'metadata.yml')))
+    assert md == {'name': 'srv', 'type': 'query'}
+    with pytest.raises(APIException):
+        find_metadata(str(repo.join('services')), toplevel)
+
+
+def test_directories_named_like_the_parent_are_inside(repo):
+    toplevel = os.path.realpath(str(repo))
+    dotted = repo.mkdir('..srv')
+    dotted.join('metadata.yml').write('name: dotted\ntype: query\n')
+    assert discovery.find_metadata_file(str(dotted), toplevel) == \
+        os.path.join(toplevel, '..srv', 'metadata.yml')
+    assert discovery.find_metadata_file(
+        str(repo.dirpath()), toplevel) is None
+
+
+def test_git_file_marks_a_repository(tmpdir):
+    worktree = tmpdir.mkdir('worktree')
+    worktree.join('.git').write('gitdir: /elsewhere/.git/worktrees/x\n')
+    nested = worktree.mkdir('a')
+    assert git_top_level(str(nested)) == os.path.realpath(str(worktree))
+    with pytest.raises(APIException):
+        git_top_level(str(tmpdir))
+
+
+def test_metadata_is_parsed_once_per_content(repo, monkeypatch):
+    calls = []
+    safe_load = yaml.safe_load
+    monkeypatch.setattr(yaml, 'safe_load',
+                        lambda content: calls.append(1) or safe_load(content))
+    directory = str(repo.join('services', 'srv'))
+    service_metadata(directory)[2]['name'] = 'changed'
+    assert service_metadata(directory)[2]['name'] == 'srv'
+    assert len(calls) == 1
+    repo.join('services', 'srv', 'metadata.yml').write(
+        'name: renamed\ntype: query\n')
+    assert service_metadata(directory)[2]['name'] == 'renamed'
+    assert len(calls) == 2
+
+
+def test_parsed_metadata_cache_is_bounded(tmpdir, monkeypatch):
+    monkeypatch.setattr(discovery, 'PARSED_CACHE_SIZE', 2)
+    paths = []
+    for n in range(3):
+        path = tmpdir.join('metadata{}.yml'.format(n))
+        path.write('name: srv{}\n'.format(n))
+        paths.append(str(path))
+    discovery.load_metadata(paths[0])
+    discovery.load_metadata(paths[1])
+    discovery.load_metadata(paths[0])
+    discovery.load_metadata(paths[2])
+    assert len(discovery._parsed) == 2
+    calls = []
+    safe_load = yaml.safe_load
+    monkeypatch.setattr(yaml, 'safe_load',
+                        lambda content: calls.append(1) or safe_load(content))
+    assert discovery.load_metadata(paths[0]) == {'name': 'srv0'}
+    assert not calls
+    assert discovery.load_metadata(paths[1]) == {'name': 'srv1'}
+    assert len(calls) == 1
+
+
+def test_discovery_from_threads_keeps_working_directory(repo, tmpdir):
+    cwd = os.getcwd()
+    results, errors = [], []
+
+    def discover(n):
+        try:
+            target = str(tmpdir.join('created{}'.format(n)))
+            Utils(None).create('srv{}'.format(n), 'query', target=target)
+            results.append(service_metadata(target)[2]['name'])
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=discover, args=(n,))
+               for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert sorted(results) == sorted('srv{}'.format(n) for n in range(8))
+    assert os.getcwd() == cwd
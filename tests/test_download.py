@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+import io
+import os
+import zlib
+
+import pytest
+
+import adamalib
+from adamalib.download import ChecksumError
+from adamalib.testing import PNG_HEADER, FakeAdama
+
+from .test_adamalib import serve_endpoint
+
+
+PAYLOAD = b''.join(hashlib.sha256(str(n).encode('ascii')).digest()
+                   for n in range(10000))
+SHA256 = 'sha256:' + hashlib.sha256(PAYLOAD).hexdigest()
+
+
+@pytest.fixture
+def fake():
+    with FakeAdama(records=5) as server:
+        server.add_service('ns', 'files', type='passthrough',
+                           records=lambda params: PAYLOAD)
+        server.add_service('ns', 'srv')
+        yield server
+
+
+def test_download_streams_to_file_and_verifies(fake, tmpdir):
+    path = str(tmpdir.join('data.bin'))
+    sizes = []
+    result = adamalib.Adama(fake.url).ns.files.get.download(
+        path, checksum=SHA256, progress=lambda *args: sizes.append(args[:2]),
+        name='x')
+    with open(path, 'rb') as f:
+        assert f.read() == PAYLOAD
+    assert result.size == result.transferred == len(PAYLOAD)
+    assert result.digest == SHA256.split(':')[1]
+    assert result.throughput > 0
+    assert sizes[-1] == (len(PAYLOAD), len(PAYLOAD))
+    assert not os.path.exists(path + '.partial')
+    assert fake.requests[-1][2] == {'name': 'x'}
+
+
+def test_download_resumes_partial_file(fake, tmpdir):
+    path = str(tmpdir.join('data.bin'))
+    tmpdir.join('data.bin.partial').write(PAYLOAD[:1000], mode='wb')
+    endpoint = adamalib.Adama(fake.url).ns.files.get
+    result = endpoint.download(path, checksum=SHA256)
+    assert (result.resumed_from, result.transferred) == (
+        1000, len(PAYLOAD) - 1000)
+    tmpdir.join('again.bin.partial').write(PAYLOAD, mode='wb')
+    complete = endpoint.download(str(tmpdir.join('again.bin')))
+    assert complete.size == len(PAYLOAD) and complete.transferred == 0
+
+
+def test_download_rejects_bad_checksum(fake, tmpdir):
+    path = str(tmpdir.join('data.bin'))
+    with pytest.raises(ChecksumError):
+        adamalib.Adama(fake.url).ns.files.get.download(
+            path, checksum='sha256:' + '0' * 64)
+    assert not os.path.exists(path) and not os.path.exists(
+        path + '.partial')
+
+
+def test_interrupted_download_continues_with_range(stub):
+    def handler(request):
+        start = int(request['headers'].get('Range', 'bytes=0-')[6:-1])
+        if start == 0:
+            def interrupted():
+                yield PAYLOAD[:50000]
+                raise IOError('connection lost')
+            return 200, {}, interrupted()
+        return 206, {'Content-Range': 'bytes {}-{}/{}'.format(
+            start, len(PAYLOAD) - 1, len(PAYLOAD))}, PAYLOAD[start:]
+
+    serve_endpoint(stub, handler, typ='passthrough')
+    out = io.BytesIO()
+    result = adamalib.Adama(stub.url).ns.srv.search.download(
+        out, checksum=SHA256)
+    assert out.getvalue() == PAYLOAD
+    assert result.resumes == 1
+
+
+def test_encoded_bodies_are_written_and_resumed_as_sent(stub, tmpdir):
+    encoded = zlib.compress(PAYLOAD)
+
+    def handler(request):
+        start = int(request['headers'].get('Range', 'bytes=0-')[6:-1])
+        headers = {'Content-Encoding': 'deflate'}
+        if start:
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, len(encoded) - 1, len(encoded))
+        return 206 if start else 200, headers, encoded[start:]
+
+    serve_endpoint(stub, handler, typ='passthrough')
+    path = str(tmpdir.join('data.z'))
+    tmpdir.join('data.z.partial').write(encoded[:100], mode='wb')
+    result = adamalib.Adama(stub.url).ns.srv.search.download(path)
+    assert result.resumed_from == 100 and result.size == len(encoded)
+    with open(path, 'rb') as f:
+        assert zlib.decompress(f.read()) == PAYLOAD
+
+
+def test_png_provenance_is_written_in_binary(fake, tmpdir):
+    path = str(tmpdir.join('prov.png'))
+    adamalib.Adama(fake.url).ns.srv.search().prov('png', filename=path)
+    with open(path, 'rb') as f:
+        assert f.read().startswith(PNG_HEADER)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import email
+import io
+import os
+import stat
+import subprocess
+import tarfile
+
+import pytest
+import requests
+
+from adamalib.adamalib import APIException
+from adamalib.packaging import (ArchiveStream, multipart_upload, pack,
+                                prune_pack_cache)
+
+
+@pytest.fixture
+def repo(tmpdir):
+    directory = tmpdir.mkdir('service')
+    subprocess.check_call(['git', 'init', '-q', str(directory)])
+    directory.join('main.py').write('def main(args, adama):\n    pass\n')
+    directory.join('metadata.yml').write('name: srv\ntype: query\n')
+    directory.join('notes.txt').write('scratch')
+    directory.join('.adamaignore').write('# local only\n*.txt\n')
+    directory.join('untracked.py').write('')
+    subprocess.check_call(
+        ['git', 'add', 'main.py', 'metadata.yml', 'notes.txt',
+         '.adamaignore'], cwd=str(directory))
+    return directory
+
+
+def members(archive):
+    with tarfile.open(archive.path) as tar:
+        return sorted(tar.getnames())
+
+
+def test_pack_includes_only_tracked_files(repo, tmpdir):
+    archive = pack(str(repo), cache_dir=str(tmpdir.join('cache')))
+    assert members(archive) == ['./.adamaignore', './main.py',
+                                './metadata.yml']
+    assert archive.filename == 'code.tgz'
+    assert not archive.reused
+
+
+def test_pack_reuses_archive_until_content_changes(repo, tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    first = pack(str(repo), cache_dir=cache_dir)
+    second = pack(str(repo), cache_dir=cache_dir)
+    assert second.reused and second.path == first.path
+    repo.join('main.py').write('def main(args, adama):\n    return 1\n')
+    third = pack(str(repo), cache_dir=cache_dir)
+    assert not third.reused and third.path != first.path
+    assert tmpdir.join('cache').listdir(
+        lambda path: path.ext == '.partial') == []
+
+
+def test_pack_cache_is_private(repo, tmpdir):
+    cache = tmpdir.join('cache')
+    archive = pack(str(repo), cache_dir=str(cache))
+    assert stat.S_IMODE(os.stat(str(cache)).st_mode) & 0o077 == 0
+    os.chmod(archive.path, 0o666)
+    assert not pack(str(repo), cache_dir=str(cache)).reused
+    os.chmod(str(cache), 0o777)
+    with pytest.raises(APIException):
+        pack(str(repo), cache_dir=str(cache))
+
+
+def test_prune_skips_archives_removed_meanwhile(tmpdir, monkeypatch):
+    for n in range(3):
+        tmpdir.join('{}.tgz'.format(n)).write('')
+    listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir',
+                        lambda path: listdir(path) + ['gone.tgz'])
+    prune_pack_cache(str(tmpdir), keep=1)
+    assert len(listdir(str(tmpdir))) == 1
+
+
+def test_pack_uncompressed(repo, tmpdir):
+    archive = pack(str(repo), compresslevel=0,
+                   cache_dir=str(tmpdir.join('cache')))
+    assert archive.filename == 'code.tar'
+    assert tarfile.open(archive.path, 'r:').getnames()
+
+
+def uploaded_archive(stub, archive):
+    stub.route('/upload', {'status': 'success'}, method='POST')
+    sent = []
+    body, content_type = multipart_upload(
+        {'type': 'query', 'metadata': ''}, 'code', archive,
+        progress=lambda done, total, elapsed: sent.append((done, total)))
+    requests.post(stub.url + '/upload', data=body,
+                  headers={'Content-Type': content_type})
+    request = stub.requests[-1]
+    message = email.message_from_bytes(
+        b'Content-Type: ' + content_type.encode('ascii') + b'\r\n\r\n' +
+        request['body'])
+    parts = {part.get_param('name', header='Content-Disposition'): part
+             for part in message.get_payload()}
+    assert parts['type'].get_payload() == 'query'
+    code = parts['code'].get_payload(decode=True)
+    return request, code, sent
+
+
+def test_upload_cached_archive_with_length(repo, tmpdir, stub):
+    archive = pack(str(repo), cache_dir=str(tmpdir.join('cache')))
+    request, code, sent = uploaded_archive(stub, archive)
+    assert 'Content-Length' in request['headers']
+    assert code == open(archive.path, 'rb').read()
+    assert sent[-1][0] == sent[-1][1] == len(request['body'])
+
+
+def test_upload_streamed_archive_without_temp_file(repo, stub):
+    archive = ArchiveStream(str(repo), chunk_size=16)
+    request, code, sent = uploaded_archive(stub, archive)
+    assert request['headers']['Transfer-Encoding'] == 'chunked'
+    with tarfile.open(fileobj=io.BytesIO(code)) as tar:
+        assert sorted(tar.getnames()) == [
+            './.adamaignore', './main.py', './metadata.yml']
+    assert len(sent) > 3 and sent[-1][1] is None
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+
+import pytest
+
+from adamalib import Adama
+from adamalib.runner import LocalService, summary
+from adamalib.stream import DocumentParser
+
+
+SERVICE = '''
+import json
+import os
+
+
+def search(args, adama):
+    if args.get('client'):
+        print(json.dumps([adama.url, adama.token, len(adama.prov_cache)]))
+    if args.get('fail'):
+        raise ValueError('bad args')
+    for n in range(args.get('n', 2)):
+        print(json.dumps({'n': n, 'pid': os.getpid()}))
+        print('---')
+'''
+
+
+@pytest.fixture
+def service(tmpdir):
+    directory = tmpdir.mkdir('service')
+    subprocess.check_call(['git', 'init', '-q', str(directory)])
+    directory.join('metadata.yml').write(
+        'name: local\nversion: 0.1\ntype: query\nmain_module: main.py\n')
+    directory.join('main.py').write(SERVICE)
+    return LocalService(str(directory))
+
+
+def test_document_parser_splits_output_incrementally():
+    parser = DocumentParser()
+    assert parser.feed('{"a":\n 1}\n--') == []
+    assert parser.feed('-\n{"b": 2}') == [{'a': 1}]
+    assert parser.feed('\n---\n') == [{'b': 2}]
+    assert parser.feed('[3]') == []
+    assert parser.close() == [[3]]
+
+
+def test_run_parses_output_and_measures(service):
+    seen = []
+    invocation = service.run({'n': 3}, on_document=seen.append)
+    assert invocation.ok
+    assert [document['n'] for document in invocation.results] == [0, 1, 2]
+    assert seen == invocation.results
+    assert invocation.wall > 0 and invocation.cpu >= 0
+    assert invocation.max_rss > 0
+
+
+def test_load_restores_sys_path(service):
+    path = list(sys.path)
+    service.load()
+    assert sys.path == path
+
+
+def test_run_reports_errors(service):
+    invocation = service.run({'fail': True})
+    assert not invocation.ok
+    assert 'bad args' in invocation.error
+
+
+def test_map_runs_in_worker_processes(service):
+    arg_sets = [{'n': n % 3} for n in range(12)] + [{'fail': True}]
+    invocations = list(service.map(arg_sets, processes=2))
+    assert [invocation.args for invocation in invocations] == arg_sets
+    assert os.getpid() not in set(
+        invocation.pid for invocation in invocations)
+    stats = summary(invocations)
+    assert stats['count'] == 13 and stats['errors'] == 1
+    assert stats['documents'] == 12
+    assert 0 < stats['p50'] <= stats['p99']
+
+
+def test_map_workers_get_a_client_of_their_own(service):
+    service.adama = Adama('http://adama.example', token='tok')
+    service.adama.prov_cache.set('http://prov.example/1', {})
+    invocations = list(service.map([{'client': True, 'n': 0}], processes=1))
+    assert invocations[0].results == [['http://adama.example', 'tok', 0]]
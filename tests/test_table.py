@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import array
+import math
+
+import pytest
+
+import adamalib
+from adamalib import table
+
+from .test_adamalib import serve_endpoint
+
+
+RECORDS = [
+    {'locus': 'AT1G01010', 'start': 3631, 'score': 0.5, 'ok': True},
+    {'locus': 'AT1G01020', 'start': 5928, 'score': 1, 'ok': False,
+     'tags': ['a']},
+    {'locus': 'AT1G01030', 'score': None, 'ok': True},
+]
+
+
+@pytest.fixture
+def no_numpy(monkeypatch):
+    monkeypatch.setattr(table, 'numpy', None)
+
+
+def test_infer_schema_widens_and_handles_missing_values():
+    schema = table.infer_schema(RECORDS)
+    assert list(schema.items()) == [
+        ('locus', 'str'), ('start', 'float'), ('score', 'float'),
+        ('ok', 'bool'), ('tags', 'object')]
+
+
+def test_columns_without_numpy(no_numpy):
+    result = adamalib.Table.from_records(RECORDS, None, None)
+    assert isinstance(result['score'], array.array)
+    assert result['locus'] == ['AT1G01010', 'AT1G01020', 'AT1G01030']
+    assert list(result['ok']) == [1, 0, 1]
+    assert result['start'][:2].tolist() == [3631.0, 5928.0]
+    assert math.isnan(result['start'][2])
+    assert result['tags'] == [None, ['a'], None]
+    assert len(result) == 3
+
+
+def test_schema_is_widened_for_values_that_do_not_fit(no_numpy):
+    schema = table.infer_schema([{'n': 1}])
+    result = adamalib.Table.from_records(
+        [{'n': 1}, {'n': 'x'}], None, None, schema)
+    assert result.schema['n'] == 'object'
+    assert result['n'] == [1, 'x']
+    assert schema['n'] == 'int'
+
+
+def test_columns_with_numpy():
+    numpy = pytest.importorskip('numpy')
+    result = adamalib.Table.from_records(RECORDS, None, None)
+    assert result['score'].dtype == numpy.float64
+    assert result['ok'].dtype == numpy.bool_
+    assert result['locus'].dtype == object
+
+
+def test_endpoint_table_reuses_service_schema(stub, no_numpy):
+    serve_endpoint(stub, lambda request: (200, {
+        'Link': '<http://prov.example/1>; '
+                'rel="http://www.w3.org/ns/prov#has_provenance"'}, {
+        'status': 'success',
+        'result': [{'n': int(request['params']['n'])}]}))
+    adama = adamalib.Adama(stub.url)
+    first = adama.ns.srv.search.table(n=1)
+    assert first.prov_url == 'http://prov.example/1'
+    assert first['n'].typecode == table.ARRAY_TYPECODES['int']
+    assert list(adama.ns.srv.search(n=2).to_columns().rows()) == [{'n': 2}]
+    adama._schemas['/ns/srv_v0.1']['n'] = 'float'
+    assert adama.ns.srv.search.table(n=3)['n'].typecode == 'd'
+
+
+def test_table_needs_a_query_service(stub):
+    serve_endpoint(stub, b'raw', typ='generic')
+    with pytest.raises(adamalib.adamalib.APIException):
+        adamalib.Adama(stub.url).ns.srv.search.table()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import importlib
+import subprocess
+import sys
+import time
+
+import pytest
+
+import adamalib
+from adamalib.adamalib import APIException
+from adamalib.testing import FakeAdama
+
+
+@pytest.fixture
+def fake():
+    with FakeAdama(records=250) as server:
+        server.add_service('ns', 'srv')
+        yield server
+
+
+def test_fake_serves_queries_with_provenance(fake):
+    adama = adamalib.Adama(fake.url)
+    result = adama.ns.srv.search(q='AT1G01010')
+    assert len(result) == 250
+    assert result[0]['locus'] == 'AT1G00000'
+    assert result.prov()['entity']
+    assert 'entity(' in result.prov(format='prov-n')
+    assert len(result.prov(format='prov').records) >= 2
+    assert len(list(adama.ns.srv.search.stream(records=3))) == 3
+
+
+def test_fake_lists_catalog(fake):
+    adama = adamalib.Adama(fake.url)
+    assert adama.status['api'] == 'Adama v0.3'
+    assert [ns.namespace for ns in adama.namespaces] == ['ns']
+    assert [srv.service for srv in adama.ns.services] == ['srv']
+
+
+def test_pages_fetch_lazily_with_per_page_provenance(fake):
+    adama = adamalib.Adama(fake.url)
+    pages = adama.ns.srv.search.pages(page_size=100, q='x')
+    assert pages[150]['locus'] == 'AT1G00150'
+    queries = [params for _, path, params in fake.requests
+               if path.endswith('/search')]
+    assert queries == [{'q': 'x', 'limit': '100', 'offset': '100'}]
+    assert [len(page) for page in pages.iter_pages()] == [100, 100, 50]
+    assert len(pages) == 250
+    assert [r['start'] for r in pages][-1] == 249000
+    urls = [page.prov_url for page in pages.loaded_pages]
+    assert len(set(urls)) == 3
+    assert len(pages.prov()) == 3
+    with pytest.raises(IndexError):
+        pages[250]
+
+
+def test_pages_prefetch_next_page(fake):
+    fake.latency = 0.05
+    adama = adamalib.Adama(fake.url)
+    pages = adama.ns.srv.search.pages(page_size=100).iter_pages()
+    next(pages)
+    time.sleep(0.2)
+    assert sum(1 for _, path, _ in fake.requests
+               if path.endswith('/search')) == 2
+    pages.close()
+
+
+def test_fake_injects_errors():
+    with FakeAdama(error_rate=1.0) as fake:
+        with pytest.raises(Exception):
+            adamalib.Adama(fake.url).status
+
+
+def test_fake_registers_uploaded_services(fake, tmpdir, monkeypatch):
+    directory = tmpdir.mkdir('uploaded')
+    subprocess.check_call(['git', 'init', '-q', str(directory)])
+    directory.join('metadata.yml').write(
+        'name: uploaded\nversion: 1.2\ntype: query\nmain_module: main.py\n')
+    directory.join('uploaded_main.py').write(
+        'def main(args, adama):\n    pass\n')
+    subprocess.check_call(['git', 'add', '.'], cwd=str(directory))
+    monkeypatch.syspath_prepend(str(directory))
+    monkeypatch.setattr(adamalib.packaging, 'PACK_CACHE_DIR',
+                        str(tmpdir.join('packs')))
+    module = importlib.import_module('uploaded_main')
+    fake.register_delay = 0.1
+    adama = adamalib.Adama(fake.url)
+    services = adama.ns.services
+    registration = services.add(module, timeout=5, **{'async': True})
+    assert not registration.done()
+    srv = registration.result()
+    assert srv.type == 'query' and srv.version == '1.2'
+    assert adama.ns.uploaded['1.2'].search(records=2) == \
+        fake.generate_records({'records': 2})
+    del sys.modules['uploaded_main']
+
+
+def test_fake_reports_registration_errors(fake):
+    fake.add_service('ns', 'broken', error='bad code')
+    registration = adamalib.adamalib.Registration(
+        adamalib.adamalib.Service(adamalib.Adama(fake.url).ns, 'broken'))
+    with pytest.raises(APIException):
+        registration.result()